@@ -1,8 +1,26 @@
 """
-Defines the available submodules
+Defines the available submodules. Collector modules are only imported on
+first access, so the modules of disabled collectors are never imported
 """
 
-from . import cpu
-from . import memory
-from . import disk
-from . import network
+import importlib
+
+from . import registry
+from . import sampler
+from . import history
+from . import persistence
+from . import summary
+from . import streaming
+from . import metrics
+from . import caching
+from . import rendering
+from . import fleet
+from . import export
+
+# Collector modules, imported on first access
+LAZY_SUBMODULES: list[str] = ["cpu", "memory", "disk", "network"]
+
+def __getattr__(name: str):
+    if name in LAZY_SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,66 @@
+"""Defines the HTTP conditional requests support. Every sample generation is
+exposed as an ETag, so clients polling faster than the sampling interval are
+answered with 304 responses without body"""
+import time
+import logging
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+if __name__ == "__main__" or \
+    __name__.startswith("domain") or \
+    __name__.startswith("app.app."):
+    from app.app import sampler as app_sampler
+
+elif __name__.startswith("tests."):
+    from tests.app import sampler as app_sampler
+
+else:
+    logging.error("Unexpected module load: %s", __name__)
+    exit(1)
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Generations restart with the process, so ETags are prefixed with its start
+ETAG_PREFIX: str = format(time.time_ns(), 'x')
+
+##############################################################################
+#                              Public Functions                              #
+##############################################################################
+
+def make_etag(generation: int) -> str:
+    """Return the ETag of the given sample generation"""
+    return f'"{ETAG_PREFIX}-{generation}"'
+
+def cache_headers(generation: int, timestamp: float,
+                  interval: float = app_sampler.SAMPLE_INTERVAL) -> dict[str, str]:
+    """Return the validators of the given sample generation, taken at the
+    given timestamp, and the freshness lifetime, one sampling interval"""
+    return {
+        "ETag": make_etag(generation),
+        "Last-Modified": formatdate(timestamp, usegmt=True),
+        "Cache-Control": f"max-age={max(int(interval), 0)}"
+    }
+
+def is_not_modified(generation: int, timestamp: float,
+                    if_none_match: Optional[str] = None,
+                    if_modified_since: Optional[str] = None) -> bool:
+    """Check whether the client copy is still the given sample generation.
+    If-None-Match takes precedence and uses the weak comparison, while
+    If-Modified-Since is only used without it"""
+    if if_none_match is not None:
+        etag: str = make_etag(generation)
+        for candidate in if_none_match.split(','):
+            candidate = candidate.strip()
+            if candidate == '*' or candidate.removeprefix('W/') == etag:
+                return True
+        return False
+
+    if if_modified_since is not None:
+        try:
+            return int(timestamp) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    return False
@@ -1,5 +1,6 @@
 """Defines the app level functions for CPU"""
 import logging
+import dataclasses as dc
 
 if __name__ == "__main__" or \
     __name__.startswith("domain") or \
@@ -17,6 +18,11 @@ else:
 #                              Public Functions                              #
 ##############################################################################
 
+def format_cpu_info(cpu: domain_cpu.CPULoadAvgs) -> dict:
+    """Format the given CPU Load information in dictionary format. Ready to be
+    returned as API response."""
+    return dc.asdict(cpu)
+
 async def read_cpu_info() -> dict:
     """Read the system CPU Load information and return in dictionary format,
     parsed to float. Ready to be returned as API response.
@@ -17,10 +17,15 @@ else:
 #                              Public Functions                              #
 ###############################################################################
 
+def format_disks_info(disks: dict[str, domain_disk.DeviceInfo], unit: str) -> dict:
+    """Format the given storage information in dictionary format, in the given
+    unit. Ready to be returned as API response."""
+    return {device: disk.as_dict(unit) for device, disk in disks.items()}
+
 async def read_disks_info(unit: str) -> dict:
     """Read the system storage information and return in dictionary format,
     in kbi parsed to integer.
     
     Will return an empty dict if any error is found"""
     disks: dict[str, domain_disk.DeviceInfo] = await domain_disk.read_disks_info()
-    return {device: disk.as_dict(unit) for device, disk in disks.items()}
+    return format_disks_info(disks, unit)
@@ -0,0 +1,375 @@
+"""Defines the optional push exporter, which ships every sampled point to a
+remote collector over HTTP, for hosts that can't be scraped.
+
+Points are formatted as lines of the InfluxDB line protocol and batched until
+a batch reaches its size or its age, then compressed and queued. A single
+sender posts the queued batches in order, retrying with backoff while the
+collector is unavailable. Once the queue is full, the oldest batches are
+spilled to an on-disk spool, and dropped only when the spool is full too.
+Compression and every spool access run in the default executor, so neither
+the sampler nor the event loop waits for them"""
+import os
+import time
+import gzip
+import random
+import socket
+import asyncio
+import logging
+import functools
+import collections
+import dataclasses as dc
+from typing import Mapping, Optional
+
+import httpx
+
+if __name__ == "__main__" or \
+    __name__.startswith("domain") or \
+    __name__.startswith("app.app."):
+    from app.app import sampler as app_sampler
+    from app.app import history as app_history
+    from app.infrastructure import spool as infra_spool
+
+elif __name__.startswith("tests."):
+    from tests.app import sampler as app_sampler
+    from tests.app import history as app_history
+    from tests.infrastructure import spool as infra_spool
+
+else:
+    logging.error("Unexpected module load: %s", __name__)
+    exit(1)
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Collector URL the batches are posted to, exporting is disabled when empty
+EXPORT_URL: str = os.environ.get("RPI_MON_EXPORT_URL", "")
+
+# Value of the host tag of every line
+EXPORT_HOST: str = os.environ.get("RPI_MON_EXPORT_HOST", socket.gethostname())
+
+# Uncompressed bytes and seconds a batch may reach before being sent
+EXPORT_BATCH_BYTES: int = int(os.environ.get("RPI_MON_EXPORT_BATCH_BYTES", str(256 * 1024)))
+EXPORT_BATCH_AGE: float = float(os.environ.get("RPI_MON_EXPORT_BATCH_AGE", "10"))
+
+# Batches kept in memory waiting to be sent
+EXPORT_QUEUE_SIZE: int = int(os.environ.get("RPI_MON_EXPORT_QUEUE_SIZE", "16"))
+
+# Seconds a post may take before it is retried
+EXPORT_TIMEOUT: float = float(os.environ.get("RPI_MON_EXPORT_TIMEOUT", "5"))
+
+# Seconds before the first retry, doubled on every failure up to the maximum
+EXPORT_RETRY_INTERVAL: float = float(os.environ.get("RPI_MON_EXPORT_RETRY_INTERVAL", "1"))
+EXPORT_MAX_BACKOFF: float = float(os.environ.get("RPI_MON_EXPORT_MAX_BACKOFF", "60"))
+
+# Spool directory for the batches not fitting in the queue, disabled if empty
+EXPORT_SPOOL_PATH: str = os.environ.get("RPI_MON_EXPORT_SPOOL_PATH", "")
+EXPORT_SPOOL_MAX_BYTES: int = int(os.environ.get("RPI_MON_EXPORT_SPOOL_MAX_BYTES", str(16 * 1024 * 1024)))
+
+EXPORT_COMPRESSION_LEVEL: int = 6
+
+GZIP_MAGIC: bytes = b'\x1f\x8b'
+
+EXPORT_MEASUREMENT_PREFIX: str = "rpi_mon_"
+
+# Statuses retried, any other error status drops the batch
+RETRY_STATUSES: frozenset[int] = frozenset({408, 429})
+
+##############################################################################
+#                                 Aux Functions                              #
+##############################################################################
+
+def _escape_tag(value: str) -> str:
+    """Escape a tag value of the line protocol"""
+    return value.replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+def format_lines(samples: Mapping[str, app_sampler.Sample], host: str) -> list[bytes]:
+    """Format the series of the given samples as line protocol lines, one per
+    domain instance, e.g.
+    rpi_mon_net,host=pi,iface=wlan0 rx_bytes=1024.0,tx_bytes=512.0 1700000000000000000"""
+    lines: list[bytes] = []
+    host_tag: str = f"host={_escape_tag(host)}"
+
+    for domain, sample in samples.items():
+        instances: dict[str, list[str]] = {}
+        for (_, field, label), value in app_history.extract_series(domain, sample.value):
+            instances.setdefault(label, []).append(f"{field}={value!r}")
+
+        label_name: Optional[str] = app_history.SERIES_LABELS.get(domain)
+        timestamp: int = int(sample.timestamp * 1e9)
+        for label, fields in instances.items():
+            tags: str = host_tag
+            if label_name is not None:
+                tags += f",{label_name}={_escape_tag(label)}"
+            lines.append(
+                f"{EXPORT_MEASUREMENT_PREFIX}{domain},{tags} {','.join(fields)} {timestamp}".encode('utf8')
+            )
+
+    return lines
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+@dc.dataclass(frozen=True, slots=True)
+class Batch:
+    """Models a compressed batch of lines"""
+    data : bytes
+    lines: int
+
+class PushExporter:
+    """Batches the sampled points, queues the compressed batches and posts
+    them in order from a background sender"""
+
+    def __init__(self, url: str, host: str = EXPORT_HOST,
+                 batch_bytes: int = EXPORT_BATCH_BYTES,
+                 batch_age: float = EXPORT_BATCH_AGE,
+                 queue_size: int = EXPORT_QUEUE_SIZE,
+                 spool: Optional[infra_spool.Spool] = None,
+                 retry_interval: float = EXPORT_RETRY_INTERVAL,
+                 max_backoff: float = EXPORT_MAX_BACKOFF,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.url: str = url
+        self.host: str = host
+        self.batch_bytes: int = batch_bytes
+        self.batch_age: float = batch_age
+        self.queue_size: int = queue_size
+        self.spool: Optional[infra_spool.Spool] = spool
+        self.retry_interval: float = retry_interval
+        self.max_backoff: float = max_backoff
+
+        self.sent_batches: int = 0
+        self.sent_lines: int = 0
+        self.dropped_lines: int = 0
+        self.retries: int = 0
+        self.failures: int = 0
+        self.last_error: Optional[str] = None
+
+        self._pending: bytearray = bytearray()
+        self._pending_lines: int = 0
+        self._pending_since: float = time.monotonic()
+        # Uncompressed batches waiting for their compression, in order
+        self._sealed: collections.deque[Batch] = collections.deque()
+        self._queue: collections.deque[Batch] = collections.deque()
+        # Batch being sent, with its spool name if it was read from the spool
+        self._inflight: Optional[tuple[Batch, Optional[str]]] = None
+
+        self._client: httpx.AsyncClient = httpx.AsyncClient(transport=transport,
+                                                            timeout=httpx.Timeout(EXPORT_TIMEOUT))
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Task compressing the sealed batches and spilling the batches beyond
+        # the queue size, one at a time
+        self._sealing: Optional[asyncio.Task] = None
+
+    @property
+    def queued_lines(self) -> int:
+        """Lines of the batches sealed or queued in memory"""
+        return sum(batch.lines for batch in self._sealed) + sum(batch.lines for batch in self._queue)
+
+    def record(self, samples: Mapping[str, app_sampler.Sample]) -> None:
+        """Add the points of the given samples to the pending batch, sealing
+        it once it reaches its size or its age"""
+        for line in format_lines(samples, self.host):
+            if self._pending:
+                self._pending += b'\n'
+            self._pending += line
+            self._pending_lines += 1
+
+        if len(self._pending) >= self.batch_bytes or \
+            time.monotonic() - self._pending_since >= self.batch_age:
+            self.seal()
+
+    def seal(self) -> None:
+        """Seal the pending lines into a batch, compressed and queued in the
+        background. When the queue is full, the oldest batches are spilled,
+        or dropped if they can't"""
+        self._pending_since = time.monotonic()
+        if not self._pending:
+            return
+
+        self._sealed.append(Batch(bytes(self._pending), self._pending_lines))
+        self._pending.clear()
+        self._pending_lines = 0
+
+        if not self.sealing:
+            self._sealing = asyncio.get_running_loop().create_task(self._queue_sealed())
+
+    @property
+    def sealing(self) -> bool:
+        """Whether batches are being compressed or spilled"""
+        return self._sealing is not None and not self._sealing.done()
+
+    async def _queue_sealed(self) -> None:
+        """Compress the sealed batches in the executor and queue them, spilling
+        the oldest ones until the queue fits, then wake the sender up, which
+        waits for them to keep the order"""
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        compress = functools.partial(gzip.compress, compresslevel=EXPORT_COMPRESSION_LEVEL, mtime=0)
+        try:
+            while self._sealed:
+                data: bytes = await loop.run_in_executor(None, compress, self._sealed[0].data)
+                self._queue.append(Batch(data, self._sealed.popleft().lines))
+
+                while len(self._queue) > self.queue_size:
+                    await loop.run_in_executor(None, self._spill, self._queue.popleft())
+        finally:
+            self._wakeup.set()
+
+    def _spill(self, batch: Batch) -> None:
+        """Write the given batch to the spool, dropping it if it does not fit"""
+        try:
+            if self.spool is not None and self.spool.push(batch.data, batch.lines):
+                return
+        except Exception as err:
+            logging.error("Unexpected error writing the export spool:\n%s", err)
+
+        self.dropped_lines += batch.lines
+
+    async def _take(self) -> Optional[tuple[Batch, Optional[str]]]:
+        """Take the oldest batch, from the spool first as it holds the older
+        ones, None if there is nothing to send or batches are being sealed.
+        Spooled batches that can't be read, or are not compressed, are moved
+        aside and dropped"""
+        if self.sealing:
+            return None
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        while self.spool is not None and len(self.spool):
+            try:
+                name, data, lines = await loop.run_in_executor(None, self.spool.peek)
+                if data.startswith(GZIP_MAGIC):
+                    return Batch(data, lines), name
+                logging.error("Corrupt export spool batch %s, moving it aside", name)
+            except Exception as err:
+                logging.error("Unexpected error reading the export spool:\n%s", err)
+
+            self.dropped_lines += await loop.run_in_executor(None, self.spool.quarantine)
+
+        # Batches may have been sealed while reading the spool
+        if self.sealing or not self._queue:
+            return None
+        return self._queue.popleft(), None
+
+    def delay(self) -> float:
+        """Seconds before the next retry: the retry interval doubled on every
+        consecutive failure, up to the maximum backoff, with jitter"""
+        base: float = min(self.retry_interval * 2 ** (self.failures - 1), self.max_backoff)
+        return base * random.uniform(0.5, 1)
+
+    async def _send(self, batch: Batch) -> Optional[bool]:
+        """Post a batch. Returns True if it was accepted, False if it was
+        rejected and None if it has to be retried"""
+        try:
+            response: httpx.Response = await self._client.post(
+                self.url, content=batch.data,
+                headers={"Content-Encoding": "gzip", "Content-Type": "text/plain; charset=utf-8"}
+            )
+        except Exception as err:
+            self.last_error = str(err) or type(err).__name__
+            return None
+
+        if response.is_success:
+            return True
+
+        self.last_error = f"HTTP {response.status_code}"
+        if response.status_code >= 500 or response.status_code in RETRY_STATUSES:
+            return None
+
+        logging.error("Export batch of %i lines rejected: %s", batch.lines, self.last_error)
+        return False
+
+    async def _run(self) -> None:
+        """Send the batches in order, retrying the oldest one until it is
+        either accepted or rejected"""
+        while True:
+            if self._inflight is None:
+                self._inflight = await self._take()
+                if self._inflight is None:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+            batch, spool_name = self._inflight
+            accepted: Optional[bool] = await self._send(batch)
+            if accepted is None:
+                self.failures += 1
+                self.retries += 1
+                await asyncio.sleep(self.delay())
+                continue
+
+            self.failures = 0
+            self._inflight = None
+            if spool_name is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self.spool.remove, spool_name)
+
+            if accepted:
+                self.sent_batches += 1
+                self.sent_lines += batch.lines
+            else:
+                self.dropped_lines += batch.lines
+
+    def start(self) -> None:
+        """Start the background sender in the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the sender, spilling every unsent batch so it is sent on the
+        next start, and close the connection pool"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        self.seal()
+        if self._sealing is not None:
+            await self._sealing
+            self._sealing = None
+        if self._inflight is not None and self._inflight[1] is None:
+            self._queue.appendleft(self._inflight[0])
+        self._inflight = None
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        while self._queue:
+            await loop.run_in_executor(None, self._spill, self._queue.popleft())
+
+        await self._client.aclose()
+
+    def stats(self) -> dict:
+        """Return the queue depth and delivery counters"""
+        return {
+            "enabled": True,
+            "url": self.url,
+            "pending_lines": self._pending_lines,
+            "queue_depth": len(self._queue),
+            "queued_lines": self.queued_lines,
+            "spooled_batches": len(self.spool) if self.spool is not None else 0,
+            "spooled_bytes": self.spool.bytes if self.spool is not None else 0,
+            "sent_batches": self.sent_batches,
+            "sent_lines": self.sent_lines,
+            "dropped_lines": self.dropped_lines,
+            "retries": self.retries,
+            "last_error": self.last_error
+        }
+
+##############################################################################
+#                              Public Functions                              #
+##############################################################################
+
+def open_exporter(url: str = EXPORT_URL,
+                  spool_path: str = EXPORT_SPOOL_PATH) -> Optional[PushExporter]:
+    """Create the push exporter to the given collector, spooling to the given
+    directory if any.
+
+    Will return None if exporting is disabled"""
+    if not url:
+        return None
+
+    spool: Optional[infra_spool.Spool] = \
+        infra_spool.open_spool(spool_path, EXPORT_SPOOL_MAX_BYTES) if spool_path else None
+
+    logging.info("Exporting samples to %s", url)
+    return PushExporter(url, spool=spool)
@@ -0,0 +1,223 @@
+"""Defines the fleet aggregator, which scrapes the /v1/all document of many
+upstream rpi-monitor-api instances and serves them as a single host labelled
+view.
+
+Every host is scraped by its own loop over a shared pool of keep-alive
+connections, with a timeout, a jittered interval so hosts are not scraped in
+lockstep, and an exponential backoff while the host keeps failing. Requests
+are conditional, so an upstream with no new sample answers 304 without a
+body"""
+import os
+import time
+import random
+import asyncio
+import logging
+import dataclasses as dc
+from typing import Any, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Comma separated upstream instances, as <url> or <name>=<url>. Aggregation
+# is disabled when empty
+FLEET_UPSTREAMS: str = os.environ.get("RPI_MON_FLEET_UPSTREAMS", "")
+
+# Seconds between two scrapes of the same host
+FLEET_INTERVAL: float = float(os.environ.get("RPI_MON_FLEET_INTERVAL", "5"))
+
+# Seconds a scrape may take before it is abandoned
+FLEET_TIMEOUT: float = float(os.environ.get("RPI_MON_FLEET_TIMEOUT", "2"))
+
+# Fraction of the interval every scrape is randomly moved by
+FLEET_JITTER: float = float(os.environ.get("RPI_MON_FLEET_JITTER", "0.1"))
+
+# Maximum seconds between two scrapes of a failing host
+FLEET_MAX_BACKOFF: float = float(os.environ.get("RPI_MON_FLEET_MAX_BACKOFF", "60"))
+
+# Maximum number of connections open to all the upstreams
+FLEET_MAX_CONNECTIONS: int = int(os.environ.get("RPI_MON_FLEET_MAX_CONNECTIONS", "16"))
+
+FLEET_PATH: str = "/v1/all"
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+@dc.dataclass(slots=True)
+class Upstream:
+    """Models an upstream instance and the state of its scrapes. Times are
+    monotonic, latency is in seconds and data is the last /v1/all document"""
+    name        : str
+    url         : str
+    data        : Optional[dict] = None
+    etag        : Optional[str] = None
+    latency     : float = -1
+    last_success: float = -1
+    failures    : int = 0
+    error       : Optional[str] = None
+    scrapes     : int = 0
+
+    @property
+    def scrape_url(self) -> str:
+        """URL of the /v1/all document, keeping any query string of the URL"""
+        parts = urlsplit(self.url)
+        return urlunsplit(parts._replace(path=parts.path.rstrip('/') + FLEET_PATH))
+
+    @property
+    def up(self) -> bool:
+        """Whether the last scrape succeeded"""
+        return self.last_success >= 0 and self.failures == 0
+
+    @property
+    def staleness(self) -> float:
+        """Seconds since the last successful scrape, -1 if there was none"""
+        return time.monotonic() - self.last_success if self.last_success >= 0 else -1
+
+class Fleet:
+    """Scrapes every upstream on its own jittered schedule over a shared
+    connection pool, keeping the last document of each one"""
+
+    def __init__(self, upstreams: list[Upstream],
+                 interval: float = FLEET_INTERVAL,
+                 timeout: float = FLEET_TIMEOUT,
+                 jitter: float = FLEET_JITTER,
+                 max_backoff: float = FLEET_MAX_BACKOFF,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.upstreams: dict[str, Upstream] = {upstream.name: upstream for upstream in upstreams}
+        self.interval: float = interval
+        self.timeout: float = timeout
+        self.jitter: float = jitter
+        self.max_backoff: float = max_backoff
+        self._client: httpx.AsyncClient = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=FLEET_MAX_CONNECTIONS,
+                                max_keepalive_connections=FLEET_MAX_CONNECTIONS)
+        )
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        """Whether the scrape loops are active"""
+        return any(not task.done() for task in self._tasks)
+
+    def delay(self, upstream: Upstream) -> float:
+        """Seconds until the next scrape of the given host: the interval,
+        doubled on every consecutive failure up to the maximum backoff, and
+        moved randomly by the jitter"""
+        base: float = min(self.interval * 2 ** upstream.failures, max(self.max_backoff, self.interval))
+        return base * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def scrape(self, upstream: Upstream) -> None:
+        """Scrape the given host once, updating its state"""
+        headers: dict[str, str] = {"If-None-Match": upstream.etag} if upstream.etag else {}
+        started: float = time.perf_counter()
+        upstream.scrapes += 1
+
+        try:
+            response: httpx.Response = await asyncio.wait_for(
+                self._client.get(upstream.scrape_url, headers=headers), self.timeout
+            )
+            if response.status_code != 304:
+                response.raise_for_status()
+                upstream.data = response.json()
+                upstream.etag = response.headers.get("etag")
+
+        except asyncio.TimeoutError:
+            error: str = f"Timeout of {self.timeout}s exceeded"
+        except Exception as err:
+            error = str(err) or type(err).__name__
+        else:
+            upstream.latency = time.perf_counter() - started
+            upstream.last_success = time.monotonic()
+            upstream.failures = 0
+            upstream.error = None
+            return
+
+        logging.warning("Error scraping %s:\n%s", upstream.name, error)
+        upstream.latency = time.perf_counter() - started
+        upstream.failures += 1
+        upstream.error = error
+
+    async def _run(self, upstream: Upstream) -> None:
+        """Scrape the given host forever, starting at a random offset of the
+        interval so the hosts are spread over it"""
+        await asyncio.sleep(random.uniform(0, self.interval))
+        while True:
+            try:
+                await self.scrape(upstream)
+            except Exception as err:
+                logging.error("Unexpected error in fleet loop:\n%s", err)
+
+            await asyncio.sleep(self.delay(upstream))
+
+    def start(self) -> None:
+        """Start a scrape loop per host in the running event loop"""
+        if not self.running:
+            loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._run(upstream)) for upstream in self.upstreams.values()]
+
+    async def stop(self) -> None:
+        """Stop the scrape loops and close the connection pool"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._client.aclose()
+
+    def view(self, domains: Optional[frozenset[str]] = None) -> dict[str, Any]:
+        """Return the last document of every host, only with the given
+        domains if any, labelled with the host scrape state"""
+        hosts: dict[str, Any] = {}
+        for name, upstream in self.upstreams.items():
+            data: Optional[dict] = upstream.data
+            if data is not None and domains is not None:
+                data = {key: value for key, value in data.items()
+                        if key in domains or key in ("timestamp", "generation")}
+
+            hosts[name] = {
+                "url": upstream.url,
+                "up": upstream.up,
+                "scrape_latency": upstream.latency,
+                "staleness": upstream.staleness,
+                "failures": upstream.failures,
+                "error": upstream.error,
+                "data": data
+            }
+
+        return {"timestamp": time.time(), "hosts": hosts}
+
+##############################################################################
+#                              Public Functions                              #
+##############################################################################
+
+def parse_upstreams(upstreams: str) -> list[Upstream]:
+    """Parse a comma separated list of <url> or <name>=<url> upstreams. Hosts
+    without a name are named after the URL host and port. URLs may contain
+    '=', e.g. in their query string"""
+    parsed: list[Upstream] = []
+    for entry in upstreams.split(','):
+        name, separator, url = entry.strip().partition('=')
+        if not separator or '://' in name:
+            name, url = "", entry.strip()
+        if not url:
+            continue
+        url = url.rstrip('/')
+        parsed.append(Upstream(name or urlsplit(url).netloc or url, url))
+
+    return parsed
+
+def open_fleet(upstreams: str = FLEET_UPSTREAMS) -> Optional[Fleet]:
+    """Create the fleet aggregator of the given upstreams.
+
+    Will return None if aggregation is disabled"""
+    parsed: list[Upstream] = parse_upstreams(upstreams)
+    if not parsed:
+        return None
+
+    logging.info("Aggregating %i upstream instances", len(parsed))
+    return Fleet(parsed)
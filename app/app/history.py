@@ -0,0 +1,429 @@
+"""Defines the metrics history, which keeps the latest samples of every metric
+series in fixed size, array backed ring buffers under a hard memory ceiling.
+
+Raw samples are also folded, as they arrive, into coarser rollup tiers of
+min/max/avg/last buckets (by default 1 minute for a day and 1 hour for a
+week), each one in its own ring buffer.
+
+Every raw point takes POINT_SIZE bytes and every rollup bucket BUCKET_SIZE
+bytes (C doubles), so a series takes a fixed amount of bytes plus
+SERIES_OVERHEAD, and the number of series is bounded by HISTORY_MAX_BYTES"""
+import os
+import logging
+from array import array
+from typing import Any, Iterator, Mapping, Optional
+
+if __name__ == "__main__" or \
+    __name__.startswith("domain") or \
+    __name__.startswith("app.app."):
+    from app.app import sampler as app_sampler
+
+elif __name__.startswith("tests."):
+    from tests.app import sampler as app_sampler
+
+else:
+    logging.error("Unexpected module load: %s", __name__)
+    exit(1)
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Raw points kept per series, one hour at the default sampling interval
+HISTORY_CAPACITY: int = int(os.environ.get("RPI_MON_HISTORY_CAPACITY", "3600"))
+
+# Rollup tiers as comma separated <resolution seconds>:<buckets kept>
+HISTORY_ROLLUPS: list[tuple[float, int]] = [
+    (float(resolution), int(capacity))
+    for resolution, capacity in (
+        tier.split(":")
+        for tier in os.environ.get("RPI_MON_HISTORY_ROLLUPS", "60:1440,3600:168").split(",")
+        if tier
+    )
+]
+
+# Hard ceiling for the memory used by all the series buffers
+HISTORY_MAX_BYTES: int = int(os.environ.get("RPI_MON_HISTORY_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Bytes per raw point: timestamp and value, both C doubles
+POINT_SIZE: int = 2 * array('d').itemsize
+
+# Bytes per rollup bucket: start, min, max, sum, count and last, C doubles
+BUCKET_SIZE: int = 6 * array('d').itemsize
+
+# Approximate fixed bytes per series: arrays headers, rings and key
+SERIES_OVERHEAD: int = 512
+
+# Intervals of its own a series may miss before it can be evicted
+HISTORY_STALE_INTERVALS: float = 3
+
+# Aggregations available for the queried points
+AGGREGATIONS: list[str] = ["avg", "min", "max", "last"]
+
+# Fields kept per domain, and whether they are in bytes so the unit applies
+SERIES_FIELDS: dict[str, dict[str, bool]] = {
+    "cpu": {"m1": False, "m5": False, "m15": False},
+    "mem": {"mem_total": True, "mem_free": True, "mem_ava": True, "mem_used": True},
+    "disk": {"total": True, "used": True, "free": True},
+    "net": {
+        "rx_pack": False, "rx_bytes": True, "rx_err": False, "rx_drop": False,
+        "tx_pack": False, "tx_bytes": True, "tx_err": False, "tx_drop": False
+    }
+}
+
+# Label of the series of domains with many instances
+SERIES_LABELS: dict[str, str] = {
+    "disk": "mount_point",
+    "net": "iface"
+}
+
+# (domain, field, label value)
+SeriesKey = tuple[str, str, str]
+
+# (start, min, max, sum, count, last)
+Bucket = tuple[float, float, float, float, float, float]
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+class _Ring:
+    """Fixed capacity ring of entries in timestamp order, stored in parallel
+    C double arrays. Once full, every new entry overwrites the oldest one"""
+
+    def __init__(self, capacity: int, arrays: int):
+        self.capacity: int = capacity
+        self._arrays: list[array] = [array('d', bytes(8 * capacity)) for _ in range(arrays)]
+        self._timestamps: array = self._arrays[0]
+        self._start: int = 0
+        self._size: int = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes used by the entries storage"""
+        return sum(len(values) * values.itemsize for values in self._arrays)
+
+    @property
+    def last_timestamp(self) -> float:
+        """Timestamp of the newest entry, -1 if empty"""
+        if self._size == 0:
+            return -1
+        return self._timestamps[self._last_index()]
+
+    def _last_index(self) -> int:
+        """Physical index of the newest entry"""
+        return (self._start + self._size - 1) % self.capacity
+
+    def _next_index(self) -> int:
+        """Physical index for a new entry, dropping the oldest one if full"""
+        if self._size < self.capacity:
+            index: int = (self._start + self._size) % self.capacity
+            self._size += 1
+        else:
+            index = self._start
+            self._start = (self._start + 1) % self.capacity
+
+        return index
+
+    def _bisect(self, timestamp: float) -> int:
+        """Logical position of the first entry not older than timestamp"""
+        low: int = 0
+        high: int = self._size
+        while low < high:
+            middle: int = (low + high) // 2
+            if self._timestamps[(self._start + middle) % self.capacity] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def _indexes(self, since: float, until: float) -> Iterator[int]:
+        """Iterate the physical indexes of the entries within [since, until]"""
+        for position in range(self._bisect(since), self._size):
+            index: int = (self._start + position) % self.capacity
+            if self._timestamps[index] > until:
+                break
+            yield index
+
+class RingBuffer(_Ring):
+    """Fixed capacity buffer of raw (timestamp, value) points"""
+
+    def __init__(self, capacity: int = HISTORY_CAPACITY):
+        super().__init__(capacity, 2)
+        self._values: array = self._arrays[1]
+
+    def append(self, timestamp: float, value: float) -> None:
+        """Add a new point, which must not be older than the newest one"""
+        index: int = self._next_index()
+        self._timestamps[index] = timestamp
+        self._values[index] = value
+
+    def points(self, since: float = float("-inf"),
+               until: float = float("inf")) -> Iterator[tuple[float, float]]:
+        """Iterate the points within [since, until] in timestamp order"""
+        for index in self._indexes(since, until):
+            yield self._timestamps[index], self._values[index]
+
+    def buckets(self, since: float = float("-inf"),
+                until: float = float("inf")) -> Iterator[Bucket]:
+        """Iterate the points within [since, until] as single point buckets"""
+        for timestamp, value in self.points(since, until):
+            yield timestamp, value, value, value, 1, value
+
+class RollupBuffer(_Ring):
+    """Fixed capacity buffer of min/max/sum/count/last buckets of resolution
+    seconds, aligned to multiples of the resolution. Points are folded into
+    the newest bucket in O(1)"""
+
+    def __init__(self, resolution: float, capacity: int):
+        super().__init__(capacity, 6)
+        self.resolution: float = resolution
+        _, self._min, self._max, self._sum, self._count, self._last = self._arrays
+
+    def append(self, timestamp: float, value: float) -> None:
+        """Fold a new point, which must not be older than the newest one"""
+        start: float = timestamp - timestamp % self.resolution
+
+        if self._size and self._timestamps[self._last_index()] == start:
+            index: int = self._last_index()
+            self._min[index] = min(self._min[index], value)
+            self._max[index] = max(self._max[index], value)
+            self._sum[index] += value
+            self._count[index] += 1
+            self._last[index] = value
+            return
+
+        index = self._next_index()
+        self._timestamps[index] = start
+        self._min[index] = value
+        self._max[index] = value
+        self._sum[index] = value
+        self._count[index] = 1
+        self._last[index] = value
+
+    def buckets(self, since: float = float("-inf"),
+                until: float = float("inf")) -> Iterator[Bucket]:
+        """Iterate the buckets overlapping [since, until] in timestamp order"""
+        for index in self._indexes(since - since % self.resolution, until):
+            yield (self._timestamps[index], self._min[index], self._max[index],
+                   self._sum[index], self._count[index], self._last[index])
+
+class Series:
+    """Raw points of a metric series plus its rollup tiers. interval is the
+    longest of the expected and the observed seconds between two points"""
+
+    def __init__(self, capacity: int = HISTORY_CAPACITY,
+                 rollups: Optional[list[tuple[float, int]]] = None,
+                 interval: float = 0):
+        self.interval: float = interval
+        self.raw: RingBuffer = RingBuffer(capacity)
+        self.rollups: list[RollupBuffer] = [
+            RollupBuffer(resolution, buckets)
+            for resolution, buckets in sorted(rollups if rollups is not None else HISTORY_ROLLUPS)
+        ]
+
+    @property
+    def last_timestamp(self) -> float:
+        """Timestamp of the newest point, -1 if empty"""
+        return self.raw.last_timestamp
+
+    def append(self, timestamp: float, value: float) -> None:
+        """Add a new raw point and fold it into every rollup tier"""
+        if len(self.raw) and timestamp - self.last_timestamp > self.interval:
+            self.interval = timestamp - self.last_timestamp
+
+        self.raw.append(timestamp, value)
+        for rollup in self.rollups:
+            rollup.append(timestamp, value)
+
+    def tier(self, step: float) -> tuple[float, _Ring]:
+        """Return the coarsest tier, with its resolution, whose resolution
+        satisfies the given step. Raw points have resolution 0"""
+        resolution: float = 0
+        tier: _Ring = self.raw
+        for rollup in self.rollups:
+            if rollup.resolution <= step:
+                resolution, tier = rollup.resolution, rollup
+
+        return resolution, tier
+
+class History:
+    """Keeps the series of every metric. When the memory ceiling is reached,
+    the stalest series, relative to its own interval, is evicted to make
+    room if it missed enough of its points. Otherwise the new series is not
+    kept, so healthy series never evict each other.
+
+    intervals are the expected seconds between two points of every domain,
+    by default the sampling intervals, or the idle one if longer"""
+
+    def __init__(self, capacity: int = HISTORY_CAPACITY, max_bytes: int = HISTORY_MAX_BYTES,
+                 rollups: Optional[list[tuple[float, int]]] = None,
+                 intervals: Optional[Mapping[str, float]] = None):
+        self.capacity: int = capacity
+        self.max_bytes: int = max_bytes
+        self.rollups: list[tuple[float, int]] = rollups if rollups is not None else HISTORY_ROLLUPS
+        self.intervals: Mapping[str, float] = intervals if intervals is not None else {
+            domain: max(interval, app_sampler.IDLE_INTERVAL if app_sampler.IDLE_AFTER > 0 else 0)
+            for domain, interval in app_sampler.INTERVALS.items()
+        }
+        self._series: dict[SeriesKey, Series] = {}
+
+    @property
+    def series_size(self) -> int:
+        """Bytes taken by every series"""
+        return POINT_SIZE * self.capacity + \
+            BUCKET_SIZE * sum(buckets for _, buckets in self.rollups) + SERIES_OVERHEAD
+
+    @property
+    def max_series(self) -> int:
+        """Number of series fitting under the memory ceiling"""
+        return self.max_bytes // self.series_size
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes currently taken by all the series"""
+        return len(self._series) * self.series_size
+
+    def _staleness(self, series: Series, timestamp: float) -> float:
+        """Return the intervals of its own the given series missed at the
+        given time"""
+        return (timestamp - series.last_timestamp) / series.interval if series.interval > 0 else float("inf")
+
+    def _get_series(self, key: SeriesKey, timestamp: float) -> Optional[Series]:
+        """Return the given series, allocating it if needed.
+
+        Will return None if the memory ceiling is reached and no series is
+        stale enough to be evicted"""
+        series: Optional[Series] = self._series.get(key)
+        if series is None:
+            if len(self._series) >= self.max_series:
+                if not self._series:
+                    return None
+                stalest: SeriesKey = max(self._series, key=lambda k: self._staleness(self._series[k], timestamp))
+                if self._staleness(self._series[stalest], timestamp) < HISTORY_STALE_INTERVALS:
+                    logging.debug("History memory ceiling reached, not keeping series %s", key)
+                    return None
+                logging.info("History memory ceiling reached, evicting stale series %s", stalest)
+                del self._series[stalest]
+
+            series = self._series[key] = Series(self.capacity, self.rollups, self.intervals.get(key[0], 0))
+
+        return series
+
+    def append(self, key: SeriesKey, timestamp: float, value: float) -> None:
+        """Add a point to the given series"""
+        series: Optional[Series] = self._get_series(key, timestamp)
+        if series is not None:
+            series.append(timestamp, value)
+
+    def record(self, samples: Mapping[str, app_sampler.Sample]) -> None:
+        """Add the points of every series in the given samples"""
+        for domain, sample in samples.items():
+            for key, value in extract_series(domain, sample.value):
+                self.append(key, sample.timestamp, value)
+
+    def query(self, domain: str, since: float, until: float, step: float = 0,
+              unit: str = "B", agg: str = "avg") -> list[dict]:
+        """Return the points of every series of the given domain between since
+        and until. With a step, points are aggregated in buckets of step
+        seconds, read from the coarsest tier whose resolution satisfies it"""
+        result: list[dict] = []
+        for key, series in self._series.items():
+            if key[0] != domain:
+                continue
+
+            divisor: float = _unit_divisor(unit) if SERIES_FIELDS[domain][key[1]] else 1
+            resolution, tier = series.tier(step)
+            buckets: Iterator[Bucket] = tier.buckets(since, until)
+            if step > resolution:
+                buckets = _merge_buckets(buckets, step)
+
+            result.append({
+                "name": key[1],
+                "labels": {SERIES_LABELS[domain]: key[2]} if domain in SERIES_LABELS else {},
+                "resolution": resolution,
+                "points": [[bucket[0], _aggregate(bucket, agg) / divisor] for bucket in buckets]
+            })
+
+        return result
+
+##############################################################################
+#                               Aux Functions                                #
+##############################################################################
+
+def _unit_divisor(unit: str) -> int:
+    """Return the divisor for values in bytes in the given unit, like the
+    domain models as_dict methods do"""
+    unit_order: int = 1
+    available_units: list[str] = ["B", "kB", "MB", "GB"]
+
+    if unit in available_units:
+        unit_order += available_units.index(unit)
+
+    return 1024 ** unit_order
+
+def extract_series(domain: str, value: Any) -> Iterator[tuple[SeriesKey, float]]:
+    """Iterate the series keys and values of a domain sample value. Unknown
+    values (-1) of failed readings are skipped"""
+    fields: Optional[dict[str, bool]] = SERIES_FIELDS.get(domain)
+    if fields is None:
+        return
+
+    if domain == "disk":
+        instances: Iterator = (
+            (mount_point, partition)
+            for device in value.values()
+            for mount_point, partition in device.partitions.items()
+        )
+    elif domain == "net":
+        instances = iter(value.items())
+    else:
+        instances = iter([("", value)])
+
+    for label, instance in instances:
+        for field in fields:
+            field_value: float = float(getattr(instance, field))
+            if field_value >= 0:
+                yield (domain, field, label), field_value
+
+def _aggregate(bucket: Bucket, agg: str) -> float:
+    """Return the requested aggregation of the given bucket"""
+    if agg == "min":
+        return bucket[1]
+    if agg == "max":
+        return bucket[2]
+    if agg == "last":
+        return bucket[5]
+    return bucket[3] / bucket[4]
+
+def _merge_buckets(buckets: Iterator[Bucket], step: float) -> Iterator[Bucket]:
+    """Merge the given buckets into buckets of step seconds, aligned to
+    multiples of step and identified by their start"""
+    merged: Optional[list[float]] = None
+
+    for start, minimum, maximum, total, count, last in buckets:
+        merged_start: float = start - start % step
+        if merged is None or merged[0] != merged_start:
+            if merged is not None:
+                yield tuple(merged)
+            merged = [merged_start, minimum, maximum, total, count, last]
+            continue
+
+        merged[1] = min(merged[1], minimum)
+        merged[2] = max(merged[2], maximum)
+        merged[3] += total
+        merged[4] += count
+        merged[5] = last
+
+    if merged is not None:
+        yield tuple(merged)
+
+##############################################################################
+#                              Shared Instance                               #
+##############################################################################
+
+history: History = History()
@@ -17,10 +17,16 @@ else:
 #                              Public Functions                              #
 ##############################################################################
 
+def format_ram_info(ram: domain_mem.RAMRawInfo, unit: str, detail: bool = False) -> dict:
+    """Format the given Memory information in dictionary format, in the given
+    unit, optionally including buffers, page cache, swap, dirty, writeback
+    and slab memory. Ready to be returned as API response."""
+    return ram.as_dict(unit, detail)
+
 async def read_ram_info(unit: str) -> dict:
     """Read the system Memory information and return in dictionary format,
     in kbi parsed to integer.
     
     Will return -1 for each memory amount if any error is found"""
     ram: domain_mem.RAMRawInfo = await domain_mem.read_ram_info()
-    return ram.as_dict(unit)
+    return format_ram_info(ram, unit)
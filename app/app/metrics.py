@@ -0,0 +1,227 @@
+"""Defines the Prometheus text exposition of the sampled data. The text is
+rendered once per sampling round and reused by every scrape"""
+import logging
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Mapping
+
+if __name__ == "__main__" or \
+    __name__.startswith("domain") or \
+    __name__.startswith("app.app."):
+    from app.app import registry as app_registry
+    from app.app import sampler as app_sampler
+
+elif __name__.startswith("tests."):
+    from tests.app import registry as app_registry
+    from tests.app import sampler as app_sampler
+
+else:
+    logging.error("Unexpected module load: %s", __name__)
+    exit(1)
+
+if TYPE_CHECKING:
+    from app.domain import cpu as domain_cpu
+    from app.domain import memory as domain_mem
+    from app.domain import disk as domain_disk
+    from app.domain import network as domain_net
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+CONTENT_TYPE: str = "text/plain; version=0.0.4"
+
+METRICS_PREFIX: str = "rpi_mon_"
+
+# Window label and model field of every CPU load average
+CPU_METRICS: list[tuple[str, str]] = [("1m", "m1"), ("5m", "m5"), ("15m", "m15")]
+
+# Metric name, help and model field of every exposed value. Memory fields are
+# bytes while disk fields are kB, exposed as bytes
+CPU_RATES: list[tuple[str, str, str]] = [
+    ("cpu_context_switches_per_second", "Context switches per second", "ctxt_rate"),
+    ("cpu_forks_per_second", "Processes created per second", "fork_rate")
+]
+
+MEM_METRICS: list[tuple[str, str, str]] = [
+    ("memory_total_bytes", "Total usable memory", "mem_total"),
+    ("memory_free_bytes", "Memory not being used at all", "mem_free"),
+    ("memory_available_bytes", "Memory available for new applications", "mem_ava"),
+    ("memory_used_bytes", "Memory being used", "mem_used"),
+    ("memory_buffers_bytes", "Memory used by block device buffers", "buffers"),
+    ("memory_cached_bytes", "Memory used by the page cache", "cached"),
+    ("memory_dirty_bytes", "Memory waiting to be written back to disk", "dirty"),
+    ("memory_writeback_bytes", "Memory being written back to disk", "writeback"),
+    ("memory_slab_bytes", "Memory used by the kernel slab allocator", "slab"),
+    ("swap_total_bytes", "Total swap space", "swap_total"),
+    ("swap_free_bytes", "Swap space not being used", "swap_free"),
+    ("swap_used_bytes", "Swap space being used", "swap_used")
+]
+
+DISK_METRICS: list[tuple[str, str, str]] = [
+    ("disk_total_bytes", "Partition size", "total"),
+    ("disk_used_bytes", "Partition space being used", "used"),
+    ("disk_free_bytes", "Partition space available", "free")
+]
+
+NET_COUNTERS: list[tuple[str, str, str]] = [
+    ("network_receive_bytes_total", "Bytes received", "rx_bytes"),
+    ("network_receive_packets_total", "Packets received", "rx_pack"),
+    ("network_receive_errors_total", "Receive errors", "rx_err"),
+    ("network_receive_drop_total", "Received packets dropped", "rx_drop"),
+    ("network_transmit_bytes_total", "Bytes transmitted", "tx_bytes"),
+    ("network_transmit_packets_total", "Packets transmitted", "tx_pack"),
+    ("network_transmit_errors_total", "Transmit errors", "tx_err"),
+    ("network_transmit_drop_total", "Transmitted packets dropped", "tx_drop")
+]
+
+NET_GAUGES: list[tuple[str, str, str]] = [
+    ("network_link_quality", "Wireless link quality", "link_quality"),
+    ("network_signal_level_dbm", "Wireless signal level", "signal_level")
+]
+
+##############################################################################
+#                                 Aux Functions                              #
+##############################################################################
+
+def _escape(value: str) -> str:
+    """Escape a label value as required by the text exposition format"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels: str) -> str:
+    """Format the given labels, sorted by name"""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in sorted(labels.items())) + "}"
+
+def _header(name: str, metric_type: str, help_text: str) -> Iterator[str]:
+    """Yield the HELP and TYPE lines of a metric family"""
+    yield f"# HELP {METRICS_PREFIX}{name} {help_text}"
+    yield f"# TYPE {METRICS_PREFIX}{name} {metric_type}"
+
+def _sample(name: str, labels: str, value: float) -> str:
+    """Format a single sample line"""
+    return f"{METRICS_PREFIX}{name}{labels} {value!r}"
+
+def _cpu_lines(cpu: 'domain_cpu.CPULoadAvgs') -> Iterator[str]:
+    """Yield the CPU load metrics, skipping unknown values"""
+    # Domain models are only imported by the enabled collectors
+    domain_cpu = app_registry.domain_module("cpu")
+    yield from _header("cpu_load_percent", "gauge", "CPU load average, as a percentage of all the cores")
+    for window, field in CPU_METRICS:
+        value: float = getattr(cpu, field)
+        if value != -1:
+            yield _sample("cpu_load_percent", _labels(window=window), value)
+
+    usages: dict[str, 'domain_cpu.CPUUsage'] = {**cpu.cores}
+    if cpu.usage is not None:
+        usages[domain_cpu.CPU_TOTAL] = cpu.usage
+
+    yield from _header("cpu_usage_percent", "gauge", "CPU time percentage per state since the previous sample")
+    for name, usage in usages.items():
+        for state in domain_cpu.USAGE_FIELDS:
+            value = getattr(usage, state)
+            if value != -1:
+                yield _sample("cpu_usage_percent", _labels(cpu=name, state=state), value)
+
+    for name, help_text, field in CPU_RATES:
+        yield from _header(name, "gauge", help_text)
+        if getattr(cpu, field) != -1:
+            yield _sample(name, "", getattr(cpu, field))
+
+def _mem_lines(ram: 'domain_mem.RAMRawInfo') -> Iterator[str]:
+    """Yield the memory metrics, skipping unknown values"""
+    for name, help_text, field in MEM_METRICS:
+        value: int = getattr(ram, field)
+        yield from _header(name, "gauge", help_text)
+        if value != -1:
+            yield _sample(name, "", value)
+
+def _disk_lines(disks: dict[str, 'domain_disk.DeviceInfo']) -> Iterator[str]:
+    """Yield the metrics of every partition, skipping unknown values"""
+    for name, help_text, field in DISK_METRICS:
+        yield from _header(name, "gauge", help_text)
+        for device, device_info in disks.items():
+            for partition in device_info.partitions.values():
+                value: int = getattr(partition, field)
+                if value != -1:
+                    labels: str = _labels(device=device, mount_point=partition.mount_point,
+                                          fs_type=partition.fs_type)
+                    yield _sample(name, labels, value * 1024)
+
+def _net_lines(net: dict[str, 'domain_net.IfaceInfo']) -> Iterator[str]:
+    """Yield the counters and link metrics of every interface, skipping
+    unknown values"""
+    for metric_type, metrics in (("counter", NET_COUNTERS), ("gauge", NET_GAUGES)):
+        for name, help_text, field in metrics:
+            yield from _header(name, metric_type, help_text)
+            for iface, iface_info in net.items():
+                value: float = getattr(iface_info, field)
+                if value != -1:
+                    yield _sample(name, _labels(iface=iface), value)
+
+    yield from _header("network_up", "gauge", "Whether the interface operational state is up")
+    for iface, iface_info in net.items():
+        if iface_info.oper_state:
+            yield _sample("network_up", _labels(iface=iface), int(iface_info.oper_state == "up"))
+
+DOMAIN_LINES: dict[str, Callable[[Any], Iterator[str]]] = {
+    "cpu": _cpu_lines,
+    "mem": _mem_lines,
+    "disk": _disk_lines,
+    "net": _net_lines
+}
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+class MetricsCache:
+    """Keeps the exposition text of the latest sampling round, so it is only
+    rendered by the first scrape after every round"""
+
+    def __init__(self):
+        self.renders: int = 0
+        self._generation: int = -1
+        self._text: bytes = b""
+
+    def get(self, sampler: app_sampler.Sampler) -> bytes:
+        """Return the exposition text of the latest round of the sampler"""
+        if sampler.generation != self._generation:
+            self._text = render_metrics(sampler.samples, sampler.status)
+            self._generation = sampler.generation
+            self.renders += 1
+
+        return self._text
+
+##############################################################################
+#                              Public Functions                              #
+##############################################################################
+
+def render_metrics(samples: Mapping[str, app_sampler.Sample],
+                   status: Mapping[str, app_sampler.CollectorStatus]) -> bytes:
+    """Render the given samples, and the timing and error of every
+    collector, in the Prometheus text exposition format"""
+    lines: list[str] = []
+    for domain, domain_lines in DOMAIN_LINES.items():
+        if domain in samples:
+            lines.extend(domain_lines(samples[domain].value))
+
+    lines.extend(_header("sample_timestamp_seconds", "gauge", "Time the latest sample was taken"))
+    for domain, sample in samples.items():
+        lines.append(_sample("sample_timestamp_seconds", _labels(domain=domain), sample.timestamp))
+
+    lines.extend(_header("collector_duration_seconds", "gauge", "Duration of the last collection"))
+    for domain, domain_status in status.items():
+        lines.append(_sample("collector_duration_seconds", _labels(domain=domain), domain_status.duration))
+
+    lines.extend(_header("collector_success", "gauge", "Whether the last collection succeeded"))
+    for domain, domain_status in status.items():
+        lines.append(_sample("collector_success", _labels(domain=domain), int(domain_status.error is None)))
+
+    lines.append("")
+    return "\n".join(lines).encode()
+
+##############################################################################
+#                              Shared Instance                               #
+##############################################################################
+
+metrics_cache: MetricsCache = MetricsCache()
@@ -17,9 +17,16 @@ else:
 #                              Public Functions                              #
 ##############################################################################
 
+def format_net_info(net: dict[str, domain_net.IfaceInfo], unit: str,
+                    rates: bool = False) -> dict:
+    """Format the given networking information in dictionary format, in the
+    given unit, optionally including the rates per second of every interface.
+    Ready to be returned as API response."""
+    return {iface: iface_info.as_dict(unit, rates) for iface, iface_info in net.items()}
+
 async def read_net_info(unit: str) -> dict:
     """Read the system networking information and return in dictionary format
     
     Will return an empty dictionary if any error is found"""
     net: dict[str, domain_net.IfaceInfo] = await domain_net.read_net_info()
-    return net.as_dict(unit)
+    return format_net_info(net, unit)
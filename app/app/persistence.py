@@ -0,0 +1,260 @@
+"""Defines the optional persistence of the metrics history, which batches the
+sampled points into an on-disk record store and reloads them on startup.
+
+Batches are written, and synced, from a background task in the default
+executor, so a slow SD card never blocks the event loop"""
+import os
+import time
+import asyncio
+import logging
+from typing import Mapping, Optional
+
+if __name__ == "__main__" or \
+    __name__.startswith("domain") or \
+    __name__.startswith("app.app."):
+    from app.app import sampler as app_sampler
+    from app.app import history as app_history
+    from app.infrastructure import store as infra_store
+
+elif __name__.startswith("tests."):
+    from tests.app import sampler as app_sampler
+    from tests.app import history as app_history
+    from tests.infrastructure import store as infra_store
+
+else:
+    logging.error("Unexpected module load: %s", __name__)
+    exit(1)
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Store file, persistence is disabled when empty
+STORE_PATH: str = os.environ.get("RPI_MON_STORE_PATH", "")
+
+# Records kept in the store, 24 MiB by default
+STORE_CAPACITY: int = int(os.environ.get("RPI_MON_STORE_CAPACITY", str(1024 * 1024)))
+
+# Seconds between two batched writes to the store
+STORE_FLUSH_INTERVAL: float = float(os.environ.get("RPI_MON_STORE_FLUSH_INTERVAL", "60"))
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+class PersistentHistory:
+    """Batches every series point of the sampled data as store records and
+    writes them once per flush interval from a background task. Series keys
+    are kept in a series table next to the store, and records only hold
+    their id.
+
+    The table holds at most max_series keys, as many as the history by
+    default. Once full, the id of a series whose records were all overwritten
+    is reused, and the points of new series are skipped if there is none"""
+
+    def __init__(self, store: infra_store.RecordStore, history: app_history.History,
+                 flush_interval: float = STORE_FLUSH_INTERVAL,
+                 max_series: Optional[int] = None):
+        self.store: infra_store.RecordStore = store
+        self.history: app_history.History = history
+        self.flush_interval: float = flush_interval
+        self.max_series: int = max_series if max_series is not None else history.max_series
+        self.skipped_records: int = 0
+
+        # Series keys by id, None for the ids without records
+        self._table_path: str = store.path + '.series'
+        self._keys: list[Optional[app_history.SeriesKey]] = [
+            tuple(key) if key is not None else None
+            for key in infra_store.load_series_table(self._table_path)
+        ]
+        self._ids: dict[app_history.SeriesKey, int] = {
+            key: i for i, key in enumerate(self._keys) if key is not None
+        }
+        self._table_changed: bool = False
+
+        # Sequence of the last record of every id, counted in records batched
+        # since opened, and records written since opened. Stored records have
+        # negative sequences, so an id has no records left once its last one
+        # is capacity records behind the written ones
+        self._last_sequence: list[int] = [0] * len(self._keys)
+        self._batched: int = 0
+        self._written: int = 0
+
+        self._batch: bytearray = bytearray()
+        self._task: Optional[asyncio.Task] = None
+        # Write running in the executor, waited for before closing the store
+        self._writing: Optional[asyncio.Future] = None
+
+    def _free_id(self) -> Optional[int]:
+        """Return an id without records left, None if there is none"""
+        overwritten: int = self._written - self.store.capacity
+        for series_id, last_sequence in enumerate(self._last_sequence):
+            if self._keys[series_id] is None or last_sequence < overwritten:
+                return series_id
+
+        return None
+
+    def _series_id(self, key: app_history.SeriesKey) -> Optional[int]:
+        """Return the id of the given series, adding it to the table if new.
+
+        Will return None if the table is full and no id can be reused"""
+        series_id: Optional[int] = self._ids.get(key)
+        if series_id is None:
+            if len(self._keys) < self.max_series:
+                series_id = len(self._keys)
+                self._keys.append(key)
+                self._last_sequence.append(0)
+            else:
+                series_id = self._free_id()
+                if series_id is None:
+                    return None
+                if self._keys[series_id] is not None:
+                    logging.info("History store series table full, reusing the id of %s", self._keys[series_id])
+                    del self._ids[self._keys[series_id]]
+                self._keys[series_id] = key
+
+            self._ids[key] = series_id
+            self._table_changed = True
+
+        self._last_sequence[series_id] = self._batched
+        return series_id
+
+    def load(self) -> int:
+        """Replay every stored record into the history, returning how many.
+        Keys without records are then dropped from the series table"""
+        loaded: int = 0
+        used: set[int] = set()
+        for sequence, (timestamp, value, series_id) in enumerate(self.store.records(), -self.store.count):
+            if series_id < len(self._keys) and self._keys[series_id] is not None:
+                self.history.append(self._keys[series_id], timestamp, value)
+                self._last_sequence[series_id] = sequence
+                used.add(series_id)
+                loaded += 1
+
+        for series_id, key in enumerate(self._keys):
+            if key is not None and series_id not in used:
+                del self._ids[key]
+                self._keys[series_id] = None
+                self._table_changed = True
+        while self._keys and self._keys[-1] is None:
+            self._keys.pop()
+            self._last_sequence.pop()
+            self._table_changed = True
+
+        return loaded
+
+    def record(self, samples: Mapping[str, app_sampler.Sample]) -> None:
+        """Add the points of every series in the given samples to the batch"""
+        for domain, sample in samples.items():
+            for key, value in app_history.extract_series(domain, sample.value):
+                series_id: Optional[int] = self._series_id(key)
+                if series_id is None:
+                    self.skipped_records += 1
+                    continue
+                self._batch += infra_store.RECORD_FORMAT.pack(sample.timestamp, value, series_id)
+                self._batched += 1
+
+    def _take(self) -> tuple[Optional[list[Optional[list[str]]]], bytes]:
+        """Take the series table, if changed, and the pending batch, so they
+        can be written while new points are batched"""
+        table: Optional[list[Optional[list[str]]]] = [
+            list(key) if key is not None else None for key in self._keys
+        ] if self._table_changed else None
+        self._table_changed = False
+        batch: bytes = bytes(self._batch)
+        self._batch.clear()
+        return table, batch
+
+    def _write(self, table: Optional[list[Optional[list[str]]]], batch: bytes) -> None:
+        """Write the given series table and batch. The series table is saved
+        first, so committed records never reference unknown series"""
+        try:
+            if table is not None:
+                infra_store.save_series_table(self._table_path, table)
+
+            if batch:
+                self.store.append(batch)
+                self._written += len(batch) // infra_store.RECORD_SIZE
+
+        except Exception as err:
+            logging.error("Unexpected error writing the history store:\n%s", err)
+
+    def flush(self) -> None:
+        """Write the pending batch, blocking until it is synced"""
+        self._write(*self._take())
+
+    async def _run(self) -> None:
+        """Write the pending batch in the executor every flush interval"""
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self._writing = loop.run_in_executor(None, self._write, *self._take())
+            await self._writing
+            self._writing = None
+
+    def start(self) -> None:
+        """Start the background writer in the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background writer, waiting for a write in progress"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._writing is not None:
+            await asyncio.shield(self._writing)
+            self._writing = None
+
+    def stats(self) -> dict:
+        """Return the store write statistics"""
+        return {
+            "enabled": True,
+            "path": self.store.path,
+            "capacity": self.store.capacity,
+            "records": self.store.count,
+            "pending_records": len(self._batch) // infra_store.RECORD_SIZE,
+            "series": len(self._ids),
+            "max_series": self.max_series,
+            "skipped_records": self.skipped_records,
+            "flushes": self.store.flushes,
+            "logical_bytes": self.store.logical_bytes,
+            "physical_bytes": self.store.physical_bytes,
+            "write_amplification": self.store.write_amplification,
+            "bytes_per_hour": self.store.bytes_per_hour
+        }
+
+    def close(self) -> None:
+        """Write the pending batch and close the store. The background writer
+        must be stopped first"""
+        self.flush()
+        self.store.close()
+
+##############################################################################
+#                              Public Functions                              #
+##############################################################################
+
+def open_persistent_history(history: app_history.History,
+                            path: str = STORE_PATH,
+                            capacity: int = STORE_CAPACITY) -> Optional[PersistentHistory]:
+    """Open the history store and reload it into the given history.
+
+    Will return None if persistence is disabled or any error is found"""
+    if not path:
+        return None
+
+    store: Optional[infra_store.RecordStore] = infra_store.open_store(path, capacity)
+    if store is None:
+        return None
+
+    persistent: PersistentHistory = PersistentHistory(store, history)
+    started: float = time.monotonic()
+    loaded: int = persistent.load()
+    logging.info("Reloaded %i history records in %.3fs", loaded, time.monotonic() - started)
+
+    return persistent
@@ -0,0 +1,157 @@
+"""Defines the collector registry. Every collector declares its data sources,
+its sampling interval, its cost class and whether it is enabled, along with
+the domain reader and the app formatter serving it.
+
+Collector modules are only imported when first used, so disabled collectors
+are never imported nor run"""
+import os
+import logging
+import importlib
+import dataclasses as dc
+from types import ModuleType
+from typing import Any, Awaitable, Optional
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Package the collector modules are imported from, app or tests
+PACKAGE: str = __name__.split('.')[0]
+
+COST_LOW: str = "low"
+COST_MEDIUM: str = "medium"
+COST_HIGH: str = "high"
+
+# Comma separated <collector>:<seconds> sampling intervals overriding the
+# declared ones, e.g. disk:60,net:5
+COLLECTOR_INTERVALS: str = os.environ.get("RPI_MON_COLLECTOR_INTERVALS", "")
+
+# Comma separated collectors never imported nor sampled
+COLLECTORS_DISABLED: str = os.environ.get("RPI_MON_COLLECTORS_DISABLED", "")
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+@dc.dataclass(frozen=True, slots=True)
+class Collector:
+    """Models a collector: the domain module reading it, the app module
+    formatting it and the route serving it. interval is in seconds, None
+    for the sampling interval. Formatters take the unit if units is set,
+    and every option as a boolean query parameter"""
+    name        : str
+    path        : str
+    domain      : str
+    reader      : str
+    app         : str
+    formatter   : str
+    sources     : tuple[str, ...]
+    cost        : str
+    interval    : Optional[float] = None
+    enabled     : bool = True
+    units       : bool = True
+    options     : tuple[str, ...] = ()
+    description : str = ""
+
+    def as_dict(self) -> dict:
+        """Return the collector declaration"""
+        return {
+            "path": self.path,
+            "sources": list(self.sources),
+            "cost": self.cost,
+            "interval": self.interval,
+            "enabled": self.enabled,
+            "options": list(self.options)
+        }
+
+BUILTIN_COLLECTORS: list[Collector] = [
+    Collector(
+        "cpu", "/v1/cpu", "domain.cpu", "read_cpu_info", "app.cpu", "format_cpu_info",
+        sources=("/proc/loadavg", "/proc/stat", "/proc/cpuinfo"), cost=COST_LOW, units=False,
+        description="Read the system CPU Load information and return in dictionary format, "
+                    "parsed to float, along with the CPU usage per state and the context switches "
+                    "and forks per second.\n\nWill return -1 for each load average if any error is found"
+    ),
+    Collector(
+        "mem", "/v1/mem", "domain.memory", "read_ram_info", "app.memory", "format_ram_info",
+        sources=("/proc/meminfo",), cost=COST_LOW, options=("detail",),
+        description="Read the system Memory information and return in dictionary format. With "
+                    "detail, buffers, page cache, swap, dirty, writeback and slab memory are "
+                    "included too.\n\nWill return -1 for each memory amount if any error is found"
+    ),
+    Collector(
+        "disk", "/v1/disk", "domain.disk", "read_disks_info", "app.disk", "format_disks_info",
+        sources=("/proc/self/mountinfo", "statvfs"), cost=COST_MEDIUM, interval=60,
+        description="Read the system storage information and return in dictionary format.\n\n"
+                    "Will return an empty dict if any error is found"
+    ),
+    Collector(
+        "net", "/v1/net", "domain.network", "read_net_info", "app.network", "format_net_info",
+        sources=("/proc/net/dev", "/proc/net/wireless", "/sys/class/net", "iwconfig"),
+        cost=COST_HIGH, options=("rates",),
+        description="Read the system network interfaces information and return in dictionary "
+                    "format. With rates, every interface includes its rates per second over the "
+                    "window (seconds) between the last two samples.\n\n"
+                    "Will return an empty dict if any error is found"
+    )
+]
+
+##############################################################################
+#                                 Aux Functions                              #
+##############################################################################
+
+def _configure(collectors: list[Collector], intervals: str, disabled: str) -> dict[str, Collector]:
+    """Apply the configured intervals and disabled collectors to the given
+    declarations. Unknown collectors and invalid intervals are ignored"""
+    configured: dict[str, Collector] = {collector.name: collector for collector in collectors}
+
+    for entry in filter(None, (entry.strip() for entry in intervals.split(','))):
+        name, _, seconds = entry.partition(':')
+        try:
+            configured[name] = dc.replace(configured[name], interval=float(seconds))
+        except (KeyError, ValueError):
+            logging.error("Ignoring invalid collector interval: %s", entry)
+
+    for name in filter(None, (name.strip() for name in disabled.split(','))):
+        if name in configured:
+            configured[name] = dc.replace(configured[name], enabled=False)
+        else:
+            logging.error("Ignoring unknown disabled collector: %s", name)
+
+    return configured
+
+def _module(path: str) -> ModuleType:
+    """Import, on first use, the given module of the package"""
+    return importlib.import_module(f"{PACKAGE}.{path}")
+
+##############################################################################
+#                              Public Functions                              #
+##############################################################################
+
+def enabled() -> dict[str, Collector]:
+    """Return the enabled collectors, by name"""
+    return {name: collector for name, collector in collectors.items() if collector.enabled}
+
+def domain_module(name: str) -> ModuleType:
+    """Return the domain module of the given collector"""
+    return _module(collectors[name].domain)
+
+def read(name: str) -> Awaitable[Any]:
+    """Run the domain reader of the given collector. The reader is looked up
+    on every call, so it can be patched"""
+    return getattr(domain_module(name), collectors[name].reader)()
+
+def format_value(name: str, value: Any, unit: str, **options: bool) -> Any:
+    """Format a value of the given collector with its app formatter, in the
+    given unit if it takes one"""
+    collector: Collector = collectors[name]
+    formatter = getattr(_module(collector.app), collector.formatter)
+    if collector.units:
+        return formatter(value, unit, **options)
+    return formatter(value, **options)
+
+##############################################################################
+#                              Shared Instance                               #
+##############################################################################
+
+collectors: dict[str, Collector] = _configure(BUILTIN_COLLECTORS, COLLECTOR_INTERVALS, COLLECTORS_DISABLED)
@@ -0,0 +1,75 @@
+"""Defines the rendering of the API responses. The bytes of every view (unit
+and options) of a sample are rendered once, with orjson when available, and
+served raw to every request until the next sample"""
+import json
+from typing import Any, Callable, Hashable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+MEDIA_TYPE: str = "application/json"
+
+# Units accepted by the domain models, any other unit is rendered as "B"
+UNITS: list[str] = ["B", "kB", "MB", "GB"]
+
+##############################################################################
+#                                 Aux Functions                              #
+##############################################################################
+
+def dumps(document: Any) -> bytes:
+    """Serialize the given document as compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(document)
+
+    return json.dumps(document, separators=(',', ':')).encode()
+
+def normalize_unit(unit: str) -> str:
+    """Map the given unit to the unit it is rendered in, so unknown units
+    share a single view"""
+    return unit if unit in UNITS else "B"
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+class ResponseCache:
+    """Keeps the rendered bytes of every view of the latest generation of
+    every resource. Views of older generations are dropped as soon as a new
+    generation is rendered, so the cache never holds more than one sample
+    per resource"""
+
+    def __init__(self):
+        self.renders: int = 0
+        self.hits: int = 0
+        self._generations: dict[str, int] = {}
+        self._views: dict[str, dict[Hashable, bytes]] = {}
+
+    def get(self, resource: str, generation: int, view: Hashable,
+            build: Callable[[], Any]) -> bytes:
+        """Return the bytes of the given view of the given generation of the
+        resource, rendering the document returned by build only once"""
+        if self._generations.get(resource) != generation:
+            self._generations[resource] = generation
+            self._views[resource] = {}
+
+        views: dict[Hashable, bytes] = self._views[resource]
+        body: bytes = views.get(view)
+        if body is None:
+            body = views[view] = dumps(build())
+            self.renders += 1
+        else:
+            self.hits += 1
+
+        return body
+
+##############################################################################
+#                              Shared Instance                               #
+##############################################################################
+
+responses: ResponseCache = ResponseCache()
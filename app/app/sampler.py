@@ -0,0 +1,333 @@
+"""Defines the background sampler, which periodically collects every domain
+into immutable samples that are shared by all the API consumers.
+
+Sampling follows the demand: a domain nobody read nor watched for a while is
+only collected on a slow heartbeat, and ramps back to its own interval on the
+first read or subscription"""
+import os
+import math
+import time
+import asyncio
+import logging
+import functools
+import dataclasses as dc
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Iterable, Mapping, Optional
+
+if __name__ == "__main__" or \
+    __name__.startswith("domain") or \
+    __name__.startswith("app.app."):
+    from app.app import registry as app_registry
+
+elif __name__.startswith("tests."):
+    from tests.app import registry as app_registry
+
+else:
+    logging.error("Unexpected module load: %s", __name__)
+    exit(1)
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Seconds between two consecutive samples of every domain
+SAMPLE_INTERVAL: float = float(os.environ.get("RPI_MON_SAMPLE_INTERVAL", "1"))
+
+# Seconds a collector may take before it is abandoned for the current round
+COLLECTOR_DEADLINE: float = float(os.environ.get("RPI_MON_COLLECTOR_DEADLINE", "2"))
+
+# Seconds without any read or watcher before a domain is considered idle,
+# adaptive sampling is disabled when 0
+IDLE_AFTER: float = float(os.environ.get("RPI_MON_IDLE_AFTER", "60"))
+
+# Seconds between two samples of an idle domain
+IDLE_INTERVAL: float = float(os.environ.get("RPI_MON_IDLE_INTERVAL", "30"))
+
+# Readers of the enabled collectors, resolved on each call so they can be
+# patched, and their sampling intervals
+COLLECTORS: dict[str, Callable[[], Awaitable[Any]]] = {
+    name: functools.partial(app_registry.read, name) for name in app_registry.enabled()
+}
+INTERVALS: dict[str, float] = {
+    name: collector.interval or SAMPLE_INTERVAL for name, collector in app_registry.enabled().items()
+}
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+@dc.dataclass(frozen=True)
+class Sample:
+    """Models the immutable result of collecting one domain.
+    timestamp is wall clock time, monotonic is used to compute the age"""
+    domain      : str
+    generation  : int
+    timestamp   : float
+    monotonic   : float
+    value       : Any
+
+    @property
+    def age(self) -> float:
+        """Seconds elapsed since the sample was taken"""
+        return time.monotonic() - self.monotonic
+
+@dc.dataclass(frozen=True)
+class CollectorStatus:
+    """Models how the last collection of one domain went. duration is in
+    seconds and error is None unless the collector failed or timed out"""
+    domain      : str
+    generation  : int
+    duration    : float
+    error       : Optional[str] = None
+
+class Sampler:
+    """Collects every domain on its own interval and publishes the latest
+    samples. Readers never trigger a collection once the first sample exists,
+    so the request cost does not depend on the number of consumers"""
+
+    def __init__(self,
+                 collectors: Optional[dict[str, Callable[[], Awaitable[Any]]]] = None,
+                 interval: float = SAMPLE_INTERVAL,
+                 deadline: float = COLLECTOR_DEADLINE,
+                 intervals: Optional[Mapping[str, float]] = None,
+                 idle_after: float = IDLE_AFTER,
+                 idle_interval: float = IDLE_INTERVAL):
+        self.deadline: float = deadline
+        self.idle_after: float = idle_after
+        self.idle_interval: float = idle_interval
+        self._collectors: dict[str, Callable[[], Awaitable[Any]]] = \
+            dict(collectors if collectors is not None else COLLECTORS)
+        if intervals is None:
+            intervals = INTERVALS if collectors is None else {}
+        # Seconds between two samples of every domain, the given interval
+        # unless the domain has its own
+        self.intervals: dict[str, float] = {
+            name: intervals.get(name, interval) for name in self._collectors
+        }
+        # Shortest interval, the loop never wakes up more often
+        self.interval: float = min(self.intervals.values(), default=interval)
+        self._samples: Mapping[str, Sample] = MappingProxyType({})
+        self._status: Mapping[str, CollectorStatus] = MappingProxyType({})
+        self._generation: int = 0
+        self._lock: asyncio.Lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._listeners: list[Callable[[Mapping[str, Sample]], None]] = []
+        self._watchers: list[Callable[[], Iterable[str]]] = []
+        # Monotonic time of the last read of every domain, and the domains
+        # read while idle, to be sampled right away
+        self._demanded: dict[str, float] = {}
+        self._ramped: set[str] = set()
+        self._wakeup: asyncio.Event = asyncio.Event()
+
+    @property
+    def samples(self) -> Mapping[str, Sample]:
+        """Latest published samples, keyed by domain"""
+        return self._samples
+
+    @property
+    def status(self) -> Mapping[str, CollectorStatus]:
+        """Timing and error of the last collection, keyed by domain"""
+        return self._status
+
+    @property
+    def generation(self) -> int:
+        """Number of sampling rounds published so far"""
+        return self._generation
+
+    def add_listener(self, listener: Callable[[Mapping[str, Sample]], None]) -> None:
+        """Register a function called with the new samples of every round"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def add_watcher(self, watcher: Callable[[], Iterable[str]]) -> None:
+        """Register a function returning the domains it keeps watching, e.g.
+        the streamed ones, which are never considered idle"""
+        if watcher not in self._watchers:
+            self._watchers.append(watcher)
+
+    def _watched(self) -> set[str]:
+        """Return the domains kept watched by any watcher"""
+        watched: set[str] = set()
+        for watcher in self._watchers:
+            try:
+                watched.update(watcher())
+            except Exception as err:
+                logging.error("Unexpected error in sampler watcher:\n%s", err)
+        return watched
+
+    def is_idle(self, domain: str, watched: Optional[set[str]] = None) -> bool:
+        """Whether the given domain was neither read nor watched for the idle
+        period. Never if adaptive sampling is disabled"""
+        if self.idle_after <= 0:
+            return False
+        if domain in (watched if watched is not None else self._watched()):
+            return False
+        return time.monotonic() - self._demanded.get(domain, -math.inf) >= self.idle_after
+
+    def effective_interval(self, domain: str, watched: Optional[set[str]] = None) -> float:
+        """Seconds between two samples of the given domain right now: its own
+        interval, or the idle one if longer while it is idle"""
+        if self.is_idle(domain, watched):
+            return max(self.intervals[domain], self.idle_interval)
+        return self.intervals[domain]
+
+    def demand(self, domains: Optional[Iterable[str]] = None) -> None:
+        """Record a read of the given domains, every one by default. Idle
+        domains are sampled right away and back on their own interval"""
+        now: float = time.monotonic()
+        for domain in (domains if domains is not None else self._collectors):
+            if domain not in self._collectors:
+                continue
+            if self.idle_after > 0 and now - self._demanded.get(domain, -math.inf) >= self.idle_after:
+                self._ramped.add(domain)
+                self._wakeup.set()
+            self._demanded[domain] = now
+
+    def schedule(self) -> dict[str, dict]:
+        """Return the own and effective interval of every domain, whether it
+        is idle or watched, and the seconds since it was last read (-1 if
+        never)"""
+        now: float = time.monotonic()
+        watched: set[str] = self._watched()
+        return {
+            name: {
+                "interval": self.intervals[name],
+                "effective_interval": self.effective_interval(name, watched),
+                "idle": self.is_idle(name, watched),
+                "watched": name in watched,
+                "last_read": now - self._demanded[name] if name in self._demanded else -1
+            }
+            for name in self._collectors
+        }
+
+    @property
+    def running(self) -> bool:
+        """Whether the background loop is active"""
+        return self._task is not None and not self._task.done()
+
+    async def _collect(self, name: str) -> tuple[Any, float, Optional[str]]:
+        """Run one collector within the deadline, returning its value, its
+        duration and its error, if any"""
+        started: float = time.perf_counter()
+        try:
+            value: Any = await asyncio.wait_for(self._collectors[name](), self.deadline)
+            return value, time.perf_counter() - started, None
+        except asyncio.TimeoutError:
+            error: str = f"Deadline of {self.deadline}s exceeded"
+        except Exception as err:
+            error = str(err) or type(err).__name__
+
+        logging.warning("Error sampling %s:\n%s", name, error)
+        return None, time.perf_counter() - started, error
+
+    async def sample(self, names: Optional[list[str]] = None) -> Mapping[str, Sample]:
+        """Collect the given domains, every one by default, concurrently and
+        publish the new samples. A collector exceeding the deadline is
+        cancelled, so it never delays the others any further.
+
+        A failing collector keeps its previous sample"""
+        names = list(self._collectors) if names is None else names
+        results: list[tuple[Any, float, Optional[str]]] = await asyncio.gather(
+            *(self._collect(name) for name in names)
+        )
+
+        timestamp: float = time.time()
+        monotonic: float = time.monotonic()
+        self._generation += 1
+
+        new_samples: dict[str, Sample] = {}
+        status: dict[str, CollectorStatus] = {}
+        for name, (value, duration, error) in zip(names, results):
+            status[name] = CollectorStatus(name, self._generation, duration, error)
+            if error is None:
+                new_samples[name] = Sample(name, self._generation, timestamp, monotonic, value)
+
+        self._samples = MappingProxyType({**self._samples, **new_samples})
+        self._status = MappingProxyType({**self._status, **status})
+        self._notify(new_samples)
+        return self._samples
+
+    def _notify(self, samples: Mapping[str, Sample]) -> None:
+        """Hand the given new samples to every listener"""
+        for listener in self._listeners:
+            try:
+                listener(samples)
+            except Exception as err:
+                logging.error("Unexpected error in sampler listener:\n%s", err)
+
+    async def get(self, domain: str) -> Sample:
+        """Return the latest sample for the given domain, recording the read.
+        Only collects when nothing has been sampled yet, e.g. before the loop
+        first runs"""
+        self.demand((domain,))
+        if domain not in self._samples:
+            async with self._lock:
+                if domain not in self._samples:
+                    await self.sample()
+
+        return self._samples[domain]
+
+    async def get_all(self) -> Mapping[str, Sample]:
+        """Return the latest samples of every domain, recording the read, and
+        collecting them first if nothing has been sampled yet"""
+        self.demand()
+        if self._generation == 0:
+            async with self._lock:
+                if self._generation == 0:
+                    await self.sample()
+
+        return self._samples
+
+    async def _run(self) -> None:
+        """Sampling loop, collects every domain once its effective interval
+        elapsed, regardless of collection time, and idle domains as soon as
+        they are read"""
+        next_due: dict[str, float] = dict.fromkeys(self._collectors, time.monotonic())
+        while True:
+            started: float = time.monotonic()
+            due: list[str] = [name for name, due_at in next_due.items() if due_at <= started]
+            try:
+                if due:
+                    async with self._lock:
+                        await self.sample(due)
+            except Exception as err:
+                logging.error("Unexpected error in sampler loop:\n%s", err)
+
+            watched: set[str] = self._watched()
+            for name in due:
+                # Not drifting with collection time, unless a round was missed
+                next_due[name] = max(next_due[name] + self.effective_interval(name, watched), started)
+
+            delay: float = min(next_due.values(), default=started + self.interval) - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            self._wakeup.clear()
+            now: float = time.monotonic()
+            for name in self._ramped & next_due.keys():
+                next_due[name] = min(next_due[name], now)
+            self._ramped.clear()
+
+    def start(self) -> None:
+        """Start the background sampling loop in the running event loop"""
+        if not self.running:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background sampling loop"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+##############################################################################
+#                              Shared Instance                               #
+##############################################################################
+
+sampler: Sampler = Sampler()
@@ -0,0 +1,183 @@
+"""Defines the live metrics streams. Every subscriber is fed from the shared
+sampler rounds, so the collection cost does not depend on the number of
+open streams"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Mapping, Optional
+
+if __name__ == "__main__" or \
+    __name__.startswith("domain") or \
+    __name__.startswith("app.app."):
+    from app.app import sampler as app_sampler
+    from app.app import summary as app_summary
+
+elif __name__.startswith("tests."):
+    from tests.app import sampler as app_sampler
+    from tests.app import summary as app_summary
+
+else:
+    logging.error("Unexpected module load: %s", __name__)
+    exit(1)
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Maximum number of streams open at the same time
+STREAM_MAX_SUBSCRIBERS: int = int(os.environ.get("RPI_MON_STREAM_MAX_SUBSCRIBERS", "32"))
+
+# Seconds a frame may take to be sent before the subscriber is dropped
+STREAM_SEND_TIMEOUT: float = float(os.environ.get("RPI_MON_STREAM_SEND_TIMEOUT", "5"))
+
+##############################################################################
+#                                 Aux Functions                              #
+##############################################################################
+
+def parse_domains(domains: Optional[str]) -> frozenset[str]:
+    """Parse a comma separated list of domains, all of them when empty.
+
+    Will raise ValueError if any domain is unknown"""
+    if not domains:
+        return frozenset(app_summary.FORMATTERS)
+
+    parsed: frozenset[str] = frozenset(domain.strip() for domain in domains.split(','))
+    unknown: frozenset[str] = parsed - app_summary.FORMATTERS.keys()
+    if unknown:
+        raise ValueError(f"Unknown domains: {', '.join(sorted(unknown))}")
+
+    return parsed
+
+def format_frame(frame: Mapping[str, app_sampler.Sample], unit: str) -> str:
+    """Format the samples of a frame as a JSON document, in the given unit"""
+    document: dict = {
+        "generation": max(sample.generation for sample in frame.values()),
+        "timestamp": max(sample.timestamp for sample in frame.values())
+    }
+    for domain, sample in frame.items():
+        document[domain] = app_summary.FORMATTERS[domain](sample.value, unit)
+
+    return json.dumps(document)
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+class Subscription:
+    """Holds the latest unsent sample of every subscribed domain. Samples
+    published before the previous ones are sent replace them, so a slow
+    subscriber gets coalesced frames and never buffers more than one sample
+    per domain"""
+
+    def __init__(self, domains: frozenset[str], interval: float, unit: str):
+        self.domains: frozenset[str] = domains
+        self.interval: float = interval
+        self.unit: str = unit
+        self.sent: int = 0
+        self.coalesced: int = 0
+
+        self._pending: dict[str, app_sampler.Sample] = {}
+        self._ready: asyncio.Event = asyncio.Event()
+        self._next_due: float = 0
+
+    def update(self, message: dict) -> None:
+        """Change the domains, as a comma separated string or a list, interval
+        or unit from a subscriber message.
+
+        Will raise ValueError if any of them is not valid"""
+        if "domains" in message:
+            domains = message["domains"]
+            if isinstance(domains, list) and all(isinstance(domain, str) for domain in domains):
+                domains = ",".join(domains)
+            if not isinstance(domains, str):
+                raise ValueError(f"Invalid domains: {domains!r}")
+            self.domains = parse_domains(domains)
+        if "interval" in message:
+            interval: float = float(message["interval"])
+            if interval < 0:
+                raise ValueError(f"Invalid interval: {interval}")
+            self.interval = interval
+        if "unit" in message:
+            self.unit = str(message["unit"])
+
+    def offer(self, samples: Mapping[str, app_sampler.Sample]) -> None:
+        """Keep the given samples of the subscribed domains until sent"""
+        for domain in self.domains & samples.keys():
+            if domain in self._pending:
+                self.coalesced += 1
+            self._pending[domain] = samples[domain]
+
+        if self._pending:
+            self._ready.set()
+
+    async def next_frame(self) -> dict[str, app_sampler.Sample]:
+        """Wait for the interval to elapse and for pending samples, and return
+        them as the next frame"""
+        delay: float = self._next_due - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        await self._ready.wait()
+        self._ready.clear()
+
+        frame: dict[str, app_sampler.Sample] = self._pending
+        self._pending = {}
+        self._next_due = time.monotonic() + self.interval
+        self.sent += 1
+        return frame
+
+class StreamHub:
+    """Fans out every sampler round to the open subscriptions"""
+
+    def __init__(self, max_subscribers: int = STREAM_MAX_SUBSCRIBERS):
+        self.max_subscribers: int = max_subscribers
+        self.dropped: int = 0
+        self._subscriptions: set[Subscription] = set()
+        self._latest: dict[str, app_sampler.Sample] = {}
+
+    @property
+    def subscribers(self) -> int:
+        """Number of open subscriptions"""
+        return len(self._subscriptions)
+
+    def domains(self) -> set[str]:
+        """Return the domains streamed by any subscription"""
+        return set().union(*(subscription.domains for subscription in self._subscriptions))
+
+    def subscribe(self, domains: frozenset[str], interval: float,
+                  unit: str) -> Optional[Subscription]:
+        """Open a subscription, starting with the latest samples.
+
+        Will return None if the maximum number of subscribers is reached"""
+        if len(self._subscriptions) >= self.max_subscribers:
+            return None
+
+        subscription: Subscription = Subscription(domains, interval, unit)
+        subscription.offer(self._latest)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Close the given subscription"""
+        self._subscriptions.discard(subscription)
+
+    def drop(self, subscription: Subscription) -> None:
+        """Close the given subscription because it could not keep up"""
+        if subscription in self._subscriptions:
+            logging.warning("Dropping slow stream subscriber")
+            self.dropped += 1
+            self.unsubscribe(subscription)
+
+    def publish(self, samples: Mapping[str, app_sampler.Sample]) -> None:
+        """Offer the given new samples to every subscription"""
+        self._latest.update(samples)
+        for subscription in self._subscriptions:
+            subscription.offer(samples)
+
+##############################################################################
+#                              Shared Instance                               #
+##############################################################################
+
+hub: StreamHub = StreamHub()
@@ -0,0 +1,66 @@
+"""Defines the app level functions for the snapshot of every domain"""
+import logging
+import functools
+from typing import Any, Callable, Mapping, Optional
+
+if __name__ == "__main__" or \
+    __name__.startswith("domain") or \
+    __name__.startswith("app.app."):
+    from app.app import registry as app_registry
+    from app.app import sampler as app_sampler
+
+elif __name__.startswith("tests."):
+    from tests.app import registry as app_registry
+    from tests.app import sampler as app_sampler
+
+else:
+    logging.error("Unexpected module load: %s", __name__)
+    exit(1)
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Formatters of every enabled domain value, given the unit
+FORMATTERS: dict[str, Callable[[Any, str], Any]] = {
+    name: functools.partial(app_registry.format_value, name) for name in app_registry.enabled()
+}
+
+##############################################################################
+#                              Public Functions                              #
+##############################################################################
+
+def format_all_info(samples: Mapping[str, app_sampler.Sample],
+                    status: Mapping[str, app_sampler.CollectorStatus],
+                    generation: int, unit: str) -> dict:
+    """Format the latest sample of every domain in a single document, in the
+    given unit. timestamp is the time of the newest sample, and every
+    collector reports its duration, error and the timestamp of its sample,
+    taken on its own interval, and older when the collector failed.
+
+    Domains without any sample are None"""
+    timestamp: Optional[float] = max((sample.timestamp for sample in samples.values()), default=None)
+    document: dict = {"timestamp": timestamp, "generation": generation}
+    collectors: dict[str, dict] = {}
+
+    for domain, formatter in FORMATTERS.items():
+        sample: Optional[app_sampler.Sample] = samples.get(domain)
+        domain_status: Optional[app_sampler.CollectorStatus] = status.get(domain)
+
+        document[domain] = formatter(sample.value, unit) if sample is not None else None
+        collectors[domain] = {
+            "timestamp": sample.timestamp if sample is not None else None,
+            "duration": domain_status.duration if domain_status is not None else None,
+            "error": domain_status.error if domain_status is not None else None
+        }
+
+    document["collectors"] = collectors
+    return document
+
+async def read_all_info(unit: str) -> dict:
+    """Read the latest sample of every domain, whose collectors run
+    concurrently within the sampler deadline, each on its own interval, and
+    return them in a single document"""
+    sampler: app_sampler.Sampler = app_sampler.sampler
+    samples: Mapping[str, app_sampler.Sample] = await sampler.get_all()
+    return format_all_info(samples, sampler.status, sampler.generation, unit)
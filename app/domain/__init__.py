@@ -1,8 +1,13 @@
 """
-Defines the available submodules
+Defines the available submodules. They are only imported on first access,
+so the modules of disabled collectors are never imported
 """
 
-from . import cpu
-from . import memory
-from . import disk
-from . import network
+import importlib
+
+LAZY_SUBMODULES: list[str] = ["cpu", "memory", "disk", "network"]
+
+def __getattr__(name: str):
+    if name in LAZY_SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,30 +1,115 @@
 """Defines data model and domain entities for CPU domain"""
 
 import json
+import time
 import logging
 import dataclasses as dc
+from typing import Optional
 
 import app.infrastructure.files as infra_files
+import app.infrastructure.timing as infra_timing
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+USAGE_FIELDS: list[str] = infra_files.CPU_STAT_FIELDS
+
+# Name of the total of all the cores in /proc/stat
+CPU_TOTAL: str = "cpu"
 
 ##############################################################################
 #                                Data Model                                  #
 ##############################################################################
 
-@dc.dataclass
+@dc.dataclass(frozen=True, slots=True)
+class CPUUsage:
+    """Models the CPU time percentage spent on every state over the window
+    (seconds) between two samples"""
+    user:       float = -1
+    nice:       float = -1
+    system:     float = -1
+    idle:       float = -1
+    iowait:     float = -1
+    irq:        float = -1
+    softirq:    float = -1
+    steal:      float = -1
+    window:     float = -1
+
+@dc.dataclass(slots=True)
 class CPULoadAvgs:
-    """Models CPU Load Averages"""
+    """Models CPU Load Averages, along with the CPU usage in total and per
+    core, and the context switches and forks per second, since the previous
+    sample"""
     m1:     float = -1
     m5:     float = -1
     m15:    float = -1
+    usage:      Optional[CPUUsage] = None
+    cores:      dict[str, CPUUsage] = dc.field(default_factory=dict)
+    ctxt_rate:  float = -1
+    fork_rate:  float = -1
 
     def __str__(self) -> str:
         """Overwrite class representation"""
         return json.dumps(dc.asdict(self))
 
+class CPUStatTracker:
+    """Keeps the previous /proc/stat sample to compute the CPU usage and the
+    context switches and forks rates. Cores not present in a sample (e.g.
+    gone offline) are forgotten, and get usage from their second sample on"""
+
+    def __init__(self):
+        self._previous: Optional[tuple[float, dict]] = None
+
+    def update(self, load_avgs: CPULoadAvgs, cpu_stat: dict, monotonic: float) -> None:
+        """Set the usage and rates of the given load averages from the given
+        /proc/stat sample, taken at the given monotonic time, against the
+        previous one"""
+        previous: Optional[tuple[float, dict]] = self._previous
+        self._previous = (monotonic, cpu_stat)
+        if previous is None or monotonic <= previous[0]:
+            return
+
+        window: float = monotonic - previous[0]
+        prev_stat: dict = previous[1]
+
+        for cpu, ticks in cpu_stat.get("cpus", {}).items():
+            prev_ticks: Optional[dict[str, int]] = prev_stat.get("cpus", {}).get(cpu)
+            if prev_ticks is None:
+                continue
+
+            usage: CPUUsage = gen_usage(prev_ticks, ticks, window)
+            if cpu == CPU_TOTAL:
+                load_avgs.usage = usage
+            else:
+                load_avgs.cores[cpu] = usage
+
+        load_avgs.ctxt_rate = _rate(prev_stat.get("ctxt", -1), cpu_stat.get("ctxt", -1), window)
+        load_avgs.fork_rate = _rate(prev_stat.get("forks", -1), cpu_stat.get("forks", -1), window)
+
 ##############################################################################
 #                               Aux Functions                                #
 ##############################################################################
 
+def _rate(previous: int, current: int, window: float) -> float:
+    """Return the increase per second of a counter over the given window.
+    Returns -1 if any of the readings is unknown or the counter was reset"""
+    if previous < 0 or current < previous:
+        return -1
+
+    return (current - previous) / window
+
+def gen_usage(previous: dict[str, int], current: dict[str, int], window: float) -> CPUUsage:
+    """Generate a CPUUsage object from two /proc/stat samples of the same cpu
+    taken window seconds apart, as the percentage of the elapsed ticks spent
+    on every state"""
+    deltas: dict[str, int] = {field: current[field] - previous[field] for field in USAGE_FIELDS}
+    total: int = sum(deltas.values())
+    if total <= 0 or min(deltas.values()) < 0:
+        return CPUUsage(window=window)
+
+    return CPUUsage(window=window, **{field: delta * 100 / total for field, delta in deltas.items()})
+
 def _transform_cpu_load_percentage(load: str, cores: int) -> float:
     """Returns the CPU load as percentage based on the number of cores
     
@@ -39,13 +124,16 @@ def _transform_cpu_load_percentage(load: str, cores: int) -> float:
 
     return float_load
 
+_stat_tracker: CPUStatTracker = CPUStatTracker()
+
 ##############################################################################
 #                              Public Functions                              #
 ##############################################################################
 
+@infra_timing.timed("domain.cpu.read_cpu_info")
 async def read_cpu_info() -> CPULoadAvgs:
     """Read the system CPU Load information and return in dictionary format,
-    parsed to float.
+    parsed to float, along with the CPU usage since the previous call.
     
     Will return -1 for each load average if any error is found"""
     load_avgs: CPULoadAvgs = CPULoadAvgs()
@@ -58,6 +146,9 @@ async def read_cpu_info() -> CPULoadAvgs:
         load_avgs.m5 = _transform_cpu_load_percentage(cpu_avg_loads["5m"], cpu_cores)
         load_avgs.m15 = _transform_cpu_load_percentage(cpu_avg_loads["15m"], cpu_cores)
 
+        cpu_stat: dict = await infra_files.get_cpu_stat()
+        _stat_tracker.update(load_avgs, cpu_stat, time.monotonic())
+
     except Exception as err:
         logging.warning("Unexpected error reading CPU info:\n%s", str(err))
 
@@ -5,13 +5,14 @@ import logging
 import dataclasses as dc
 from typing import Union
 
-import app.infrastructure.cmd as infra_cmd
+import app.infrastructure.files as infra_files
+import app.infrastructure.timing as infra_timing
 
 ###############################################################################
 #                                Data Model                                  #
 ###############################################################################
 
-@dc.dataclass
+@dc.dataclass(frozen=True, slots=True)
 class PartitionInfo:
     """Models Disk Partition Information. Storage unit is bytes"""
     mount_point : str = ""
@@ -44,7 +45,7 @@ class PartitionInfo:
             "free": free_gb
         }
 
-@dc.dataclass
+@dc.dataclass(slots=True)
 class DeviceInfo:
     """Models Disk Device Information.
     The key for the partitions dictionary is the mount point."""
@@ -80,20 +81,19 @@ def _get_base_device_name(device_name: str) -> str:
 
 def gen_partition(dev_data: dict[str, str]) -> PartitionInfo:
     """Parse the device information from a dictionary to a DeviceInfo object"""
-    partition: PartitionInfo = PartitionInfo()
-
-    partition.mount_point = dev_data['mount']
-    # partition.fs_type = dev_data['fs_type']
-    partition.total = dev_data['total']
-    partition.used = dev_data['used']
-    partition.free = dev_data['free']
-
-    return partition
+    return PartitionInfo(
+        mount_point = dev_data['mount'],
+        fs_type = dev_data.get('fs_type', ""),
+        total = dev_data['total'],
+        used = dev_data['used'],
+        free = dev_data['free']
+    )
 
 ###############################################################################
 #                              Public Functions                              #
 ###############################################################################
 
+@infra_timing.timed("domain.disk.read_disks_info")
 async def read_disks_info() -> dict[DeviceInfo]:
     """Read the system disks information and return in dictionary format.
     
@@ -102,7 +102,7 @@ async def read_disks_info() -> dict[DeviceInfo]:
 
     try:
         raw_filesystem_data: dict[str, dict[str, Union[int, str]]] = \
-            infra_cmd.get_disk_usage()
+            await infra_files.get_disk_usage()
 
         for device, dev_data in raw_filesystem_data.items():
             base_device = _get_base_device_name(device)
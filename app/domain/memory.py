@@ -5,30 +5,58 @@ import logging
 import dataclasses as dc
 
 import app.infrastructure.files as infra_files
+import app.infrastructure.timing as infra_timing
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Fields only included in the detailed view
+DETAIL_FIELDS: list[str] = [
+    "buffers", "cached", "swap_total", "swap_free", "swap_used", "dirty", "writeback", "slab"
+]
+
+# Fields read from /proc/meminfo, which are kB
+MEM_INFO_FIELDS: list[str] = [
+    "mem_total", "mem_free", "mem_ava", "buffers", "cached",
+    "swap_total", "swap_free", "dirty", "writeback", "slab"
+]
 
 ##############################################################################
 #                                Data Model                                  #
 ##############################################################################
 
-@dc.dataclass
+@dc.dataclass(frozen=True, slots=True)
 class RAMRawInfo:
-    """Models Raw RAM Info. Storage unit is bytes"""
+    """Models Raw RAM Info. Storage unit is bytes.
+    mem_used and swap_used are derived at construction"""
     mem_total    : int = -1
     mem_free     : int = -1
     mem_ava      : int = -1
-    mem_used     : int = -1
+    buffers      : int = -1
+    cached       : int = -1
+    swap_total   : int = -1
+    swap_free    : int = -1
+    dirty        : int = -1
+    writeback    : int = -1
+    slab         : int = -1
+    mem_used     : int = dc.field(init=False, default=-1)
+    swap_used    : int = dc.field(init=False, default=-1)
+
+    def __post_init__(self):
+        if self.mem_total >= 0 and self.mem_ava >= 0:
+            object.__setattr__(self, "mem_used", self.mem_total - self.mem_ava)
+        if self.swap_total >= 0 and self.swap_free >= 0:
+            object.__setattr__(self, "swap_used", self.swap_total - self.swap_free)
 
     def __str__(self) -> str:
         """Overwrite class representation"""
         return json.dumps(self.as_dict())
 
-    def __setattr__(self, name, value):
-        super().__setattr__(name, value)
-        if name in ['mem_total', 'mem_ava']:
-            self.mem_used = self.mem_total - self.mem_ava
-
-    def as_dict(self, unit: str = "B") -> dict:
-        """Return the class as a dictionary. The unit can be changed"""
+    def as_dict(self, unit: str = "B", detail: bool = False) -> dict:
+        """Return the class as a dictionary. The unit can be changed.
+        With detail, buffers, page cache, swap, dirty, writeback and slab
+        memory are included too"""
 
         unit_order: int = 1
         available_units: list[str] = ["B", "kB", "MB", "GB"]
@@ -36,17 +64,20 @@ class RAMRawInfo:
         if unit in available_units:
             unit_order += available_units.index(unit)
 
-        total = self.mem_total / (1024 ** unit_order)
-        free = self.mem_free / (1024 ** unit_order)
-        ava = self.mem_ava / (1024 ** unit_order)
-        used = self.mem_used / (1024 ** unit_order)
-        return {
-            "total": total,
-            "free": free,
-            "ava": ava,
-            "used": used
+        divisor: int = 1024 ** unit_order
+        ram_dict: dict[str, float] = {
+            "total": self.mem_total / divisor,
+            "free": self.mem_free / divisor,
+            "ava": self.mem_ava / divisor,
+            "used": self.mem_used / divisor
         }
 
+        if detail:
+            for field in DETAIL_FIELDS:
+                ram_dict[field] = getattr(self, field) / divisor
+
+        return ram_dict
+
 ##############################################################################
 #                               Aux Functions                                #
 ##############################################################################
@@ -55,6 +86,7 @@ class RAMRawInfo:
 #                              Public Functions                              #
 ##############################################################################
 
+@infra_timing.timed("domain.memory.read_ram_info")
 async def read_ram_info() -> RAMRawInfo:
     """Read the system Memory information and return in dictionary format,
     in kbi parsed to integer.
@@ -65,9 +97,10 @@ async def read_ram_info() -> RAMRawInfo:
     try:
         ram_raw: dict[str, int] = await infra_files.get_mem_info()
 
-        ram.mem_total = ram_raw['mem_total'] * 1024
-        ram.mem_free = ram_raw['mem_free'] * 1024
-        ram.mem_ava = ram_raw['mem_ava'] * 1024
+        ram = RAMRawInfo(**{
+            field: ram_raw[field] * 1024 if ram_raw.get(field, -1) >= 0 else -1
+            for field in MEM_INFO_FIELDS
+        })
 
     except Exception as err:
         logging.warning("Unexpected error:\n%s", err)
@@ -1,19 +1,90 @@
 """Defines data model and domain entities for Network domain"""
 
+import os
 import json
+import time
 import logging
 import dataclasses as dc
+from typing import Optional
 
 import app.infrastructure.cmd as infra_cmd
 import app.infrastructure.files as infra_files
+import app.infrastructure.timing as infra_timing
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Use iwconfig to get the bit rate of wireless interfaces when sysfs lacks it
+IWCONFIG_FALLBACK: bool = os.environ.get("RPI_MON_IWCONFIG_FALLBACK", "1") == "1"
+
+# Seconds the iwconfig data of an interface is reused before forking again
+IWCONFIG_TTL: float = float(os.environ.get("RPI_MON_IWCONFIG_TTL", "30"))
+
+# /proc/net/dev counters are unsigned long, 32 bits wide on armhf kernels.
+# 64 bits counters never wrap in practice, so any decrease is a reset
+COUNTER_WRAP_32: int = 2 ** 32
+
+# Bytes per second a link can carry when its speed is unknown (10 Gb/s), and
+# smallest frame, bounding the packets per second
+MAX_LINK_BYTES_RATE: float = 10e9 / 8
+MIN_FRAME_BYTES: int = 64
+
+# Slack over the link capacity before a decrease is not a plausible wrap
+WRAP_MARGIN: float = 2
+
+RATE_FIELDS: list[str] = [
+    "rx_pack", "rx_bytes", "rx_err", "rx_drop",
+    "tx_pack", "tx_bytes", "tx_err", "tx_drop"
+]
 
 ##############################################################################
 #                                Data Model                                  #
 ##############################################################################
 
-@dc.dataclass
+@dc.dataclass(frozen=True, slots=True)
+class IfaceRates:
+    """Models Net Rates per second over the window (seconds) between two
+    samples. Storage unit is bytes"""
+    rx_pack      : float = -1
+    rx_bytes     : float = -1
+    rx_err       : float = -1
+    rx_drop      : float = -1
+    tx_pack      : float = -1
+    tx_bytes     : float = -1
+    tx_err       : float = -1
+    tx_drop      : float = -1
+    window       : float = -1
+
+    def __str__(self) -> str:
+        """Overwrite class representation"""
+        return json.dumps(self.as_dict())
+
+    def as_dict(self, unit: str = "B") -> dict:
+        """Return the class as a dictionary. The unit can be changed"""
+
+        unit_order: int = 1
+        available_units: list[str] = ["B", "kB", "MB", "GB"]
+
+        if unit in available_units:
+            unit_order += available_units.index(unit)
+
+        return {
+            "rx_pack": self.rx_pack,
+            "rx_bytes": self.rx_bytes / (1024 ** unit_order),
+            "rx_err": self.rx_err,
+            "rx_drop": self.rx_drop,
+            "tx_pack": self.tx_pack,
+            "tx_bytes": self.tx_bytes / (1024 ** unit_order),
+            "tx_err": self.tx_err,
+            "tx_drop": self.tx_drop,
+            "window": self.window
+        }
+
+@dc.dataclass(slots=True)
 class IfaceInfo:
-    """Models Raw Net Info. Storage unit is bytes"""
+    """Models Raw Net Info. Storage unit is bytes.
+    Link quality and signal level (dBm) are only set for wireless interfaces"""
     rx_pack      : int = -1
     rx_bytes     : int = -1
     rx_err       : int = -1
@@ -23,13 +94,19 @@ class IfaceInfo:
     tx_err       : int = -1
     tx_drop      : int = -1
     bit_rate      : str = "- Mb/s"
+    link_quality : float = -1
+    signal_level : float = -1
+    oper_state   : str = ""
+    rates        : Optional[IfaceRates] = None
 
     def __str__(self) -> str:
         """Overwrite class representation"""
         return json.dumps(self.as_dict())
 
-    def as_dict(self, unit: str = "B") -> dict:
-        """Return the class as a dictionary. The unit can be changed"""
+    def as_dict(self, unit: str = "B", rates: bool = False) -> dict:
+        """Return the class as a dictionary. The unit can be changed.
+        Rates are only included when requested, None until the interface has
+        been sampled twice"""
 
         unit_order: int = 1
         available_units: list[str] = ["B", "kB", "MB", "GB"]
@@ -47,7 +124,7 @@ class IfaceInfo:
         tx_drop    : int = self.tx_drop
         tx_err     : int = self.tx_err
 
-        return {
+        iface_dict: dict = {
             "rx_pack": rx_pack,
             "rx_bytes": rx_bytes,
             "rx_err": rx_err,
@@ -56,13 +133,82 @@ class IfaceInfo:
             "tx_bytes": tx_bytes,
             "tx_err": tx_err,
             "tx_drop": tx_drop,
-            "bit_rate": self.bit_rate
+            "bit_rate": self.bit_rate,
+            "link_quality": self.link_quality,
+            "signal_level": self.signal_level,
+            "oper_state": self.oper_state
         }
 
+        if rates:
+            iface_dict["rates"] = self.rates.as_dict(unit) if self.rates is not None else None
+
+        return iface_dict
+
+class RatesTracker:
+    """Keeps the previous sample of every interface to compute its rates.
+    Interfaces not present in a sample are forgotten, and new ones get
+    rates from their second sample on"""
+
+    def __init__(self):
+        self._previous: dict[str, tuple[float, IfaceInfo]] = {}
+
+    def update(self, ifaces: dict[str, IfaceInfo], monotonic: float) -> None:
+        """Set the rates of the given interfaces, sampled at the given
+        monotonic time, against their previous sample"""
+        previous: dict[str, tuple[float, IfaceInfo]] = self._previous
+        self._previous = {}
+
+        for name, iface in ifaces.items():
+            if name in previous:
+                prev_monotonic, prev_iface = previous[name]
+                if monotonic > prev_monotonic:
+                    iface.rates = gen_rates(prev_iface, iface, monotonic - prev_monotonic)
+
+            self._previous[name] = (monotonic, iface)
+
 ##############################################################################
 #                               Aux Functions                                #
 ##############################################################################
 
+def _link_bytes_rate(bit_rate: str) -> float:
+    """Return the bytes per second of a link from its bit rate, e.g. 72.2
+    Mb/s, or the maximum link rate if unknown"""
+    try:
+        rate: float = float(bit_rate.split()[0]) * 1e6 / 8
+        return rate if rate > 0 else MAX_LINK_BYTES_RATE
+    except (IndexError, ValueError):
+        return MAX_LINK_BYTES_RATE
+
+def _counter_delta(previous: int, current: int, max_delta: float) -> int:
+    """Return the increase between two readings of a counter. A decrease is
+    a 32 bits wraparound if the increase it implies is within the given
+    maximum, and a counter reset otherwise, e.g. a driver reload or an
+    interface recreated, counting from 0. Returns -1 if any of the readings
+    is unknown"""
+    if previous < 0 or current < 0:
+        return -1
+
+    if current >= previous:
+        return current - previous
+
+    if previous < COUNTER_WRAP_32 and current + COUNTER_WRAP_32 - previous <= max_delta:
+        return current + COUNTER_WRAP_32 - previous
+
+    return current
+
+def gen_rates(previous: IfaceInfo, current: IfaceInfo, window: float) -> IfaceRates:
+    """Generate a IfaceRates object from two samples of the same interface
+    taken window seconds apart"""
+    values: dict[str, float] = {}
+    max_bytes: float = _link_bytes_rate(current.bit_rate) * window * WRAP_MARGIN
+
+    for field in RATE_FIELDS:
+        max_delta: float = max_bytes if field.endswith("_bytes") else max_bytes / MIN_FRAME_BYTES
+        delta: int = _counter_delta(getattr(previous, field), getattr(current, field), max_delta)
+        values[field] = delta / window if delta >= 0 else -1
+
+    return IfaceRates(window=window, **values)
+
 def gen_iface(raw_data: dict[str, int]) -> IfaceInfo:
     """Generate a IfaceInfo object from a dictionary"""
     return IfaceInfo(
@@ -73,13 +219,35 @@ def gen_iface(raw_data: dict[str, int]) -> IfaceInfo:
         tx_pack  = raw_data.get("tx_pack", -1),
         tx_bytes = raw_data.get("tx_bytes", -1),
         tx_err   = raw_data.get("tx_err", -1),
-        tx_drop  = raw_data.get("tx_drop", -1)
+        tx_drop  = raw_data.get("tx_drop", -1),
+        bit_rate = raw_data.get("bit_rate", "- Mb/s"),
+        link_quality = raw_data.get("link_quality", -1),
+        signal_level = raw_data.get("signal_level", -1),
+        oper_state = raw_data.get("oper_state", "")
     )
 
+async def _get_iwconfig_info(iface: str) -> dict[str, str]:
+    """Return the iwconfig data of the given interface, running it at most
+    once per TTL, as wireless bit rates are rarely reported by sysfs"""
+    now: float = time.monotonic()
+    cached: Optional[tuple[float, dict[str, str]]] = _iwconfig_cache.get(iface)
+    if cached is not None and now - cached[0] < IWCONFIG_TTL:
+        return cached[1]
+
+    iface_data: dict[str, str] = await infra_cmd.get_net_info(iface)
+    _iwconfig_cache[iface] = (now, iface_data)
+    return iface_data
+
+_rates_tracker: RatesTracker = RatesTracker()
+
+# Monotonic time and iwconfig data of every wireless interface
+_iwconfig_cache: dict[str, tuple[float, dict[str, str]]] = {}
+
 ##############################################################################
 #                              Public Functions                              #
 ##############################################################################
 
+@infra_timing.timed("domain.network.read_net_info")
 async def read_net_info() -> dict[str, IfaceInfo]:
     """Read the system network interfaces information and return in dictionary format,
     in kbi parsed to integer.
@@ -89,14 +257,26 @@ async def read_net_info() -> dict[str, IfaceInfo]:
 
     try:
         raw_ifaces_data: dict[str, int] = await infra_files.get_net_info()
+        link_data: dict[str, dict] = await infra_files.get_link_info(list(raw_ifaces_data))
 
         for iface in raw_ifaces_data:
-            # Enrich iface data with other datasource data (iwconfig)
-            extra_data: dict[str, str] = await infra_cmd.get_net_info(iface)
-            raw_ifaces_data[iface].update(extra_data)
+            # Enrich iface data with link data (/proc/net/wireless and sysfs)
+            iface_link_data: dict = link_data.get(iface, {})
+            raw_ifaces_data[iface].update(iface_link_data)
+
+            # Only wireless interfaces without known bit rate fall back to iwconfig
+            if IWCONFIG_FALLBACK and iface_link_data.get("wireless", False) and \
+                "bit_rate" not in iface_link_data:
+                extra_data: dict[str, str] = await _get_iwconfig_info(iface)
+                raw_ifaces_data[iface].update(extra_data)
 
             ifaces[iface] = gen_iface(raw_ifaces_data[iface])
 
+        for iface in _iwconfig_cache.keys() - raw_ifaces_data.keys():
+            del _iwconfig_cache[iface]
+
+        _rates_tracker.update(ifaces, time.monotonic())
+
     except Exception as err:
         logging.warning("Unexpected error:\n%s", err)
 
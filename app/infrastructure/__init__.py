@@ -4,3 +4,8 @@ Defines the available submodules
 
 from . import files
 from . import cmd
+from . import store
+from . import fixtures
+from . import spool
+from . import timing
+from . import profiler
@@ -1,12 +1,19 @@
 """Handles the execution of external commands to retrieve information,
-allowing to execute only a subset of commands for security"""
+allowing to execute only a subset of commands for security.
+
+Commands are spawned from an argument list without a shell, asynchronously,
+so a slow command never blocks the event loop"""
 
 import os
 import re
+import shlex
+import asyncio
 import logging
 
 from typing import Optional, Union
 
+import app.infrastructure.timing as infra_timing
+
 ##############################################################################
 #                                 Constants                                  #
 ##############################################################################
@@ -17,39 +24,87 @@ ALLOWED_OS_COMMANDS: list[str] = [
     'iwconfig'
 ]
 
-# Forbidden syntax for security reasons
-FORBIDDEN_SYNTAX: list[str] = [
-    ';', '&&', '||', '`', '$', '(', ')', '{', '}', '<', '>'
-]
+# Seconds a command is allowed to run before being killed
+COMMAND_TIMEOUT: float = float(os.environ.get("RPI_MON_CMD_TIMEOUT", "5"))
+
+# Maximum number of commands running at the same time
+MAX_CONCURRENT_COMMANDS: int = int(os.environ.get("RPI_MON_CMD_CONCURRENCY", "2"))
+
+_commands_semaphore: asyncio.Semaphore = asyncio.Semaphore(MAX_CONCURRENT_COMMANDS)
 
 ##############################################################################
 #                                 Aux Functions                              #
 ##############################################################################
 
-def _is_command_allowed(command: str) -> bool:
-    """Checks if a command is allowed to be executed"""
-    not_allowed: bool = True
+def _split_command(command: Union[str, list[str]]) -> list[str]:
+    """Return the argument list for the given command"""
+    if isinstance(command, str):
+        return shlex.split(command)
 
-    not_allowed = any([character in command for character in FORBIDDEN_SYNTAX])
+    return list(command)
 
-    if not not_allowed:
-        not_allowed = command.split()[0] not in ALLOWED_OS_COMMANDS
-
-    return not not_allowed
-
-def exec_cmd(command: str) -> Optional[str]:
-    """Execute the given command and return the output"""
+def _is_command_allowed(command: Union[str, list[str]]) -> bool:
+    """Checks if a command is allowed to be executed. As commands are never
+    run through a shell, only the executable needs to be checked"""
+    try:
+        argv: list[str] = _split_command(command)
+    except ValueError:
+        return False
+
+    return len(argv) > 0 and argv[0] in ALLOWED_OS_COMMANDS
+
+async def _kill(process: asyncio.subprocess.Process) -> None:
+    """Kill the given process if still running and reap it"""
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+
+@infra_timing.timed("cmd.exec_cmd")
+async def exec_cmd(command: Union[str, list[str]],
+                   timeout: float = COMMAND_TIMEOUT) -> Optional[str]:
+    """Execute the given command and return the output.
+
+    The process is killed if it exceeds the timeout or if the awaiting task
+    is cancelled, e.g. because the client disconnected.
+
+    Will return None if the command is not allowed or any error is found"""
     result: Optional[str] = None
     if not _is_command_allowed(command):
         logging.error("Command not allowed: %s", command)
-
-    try:
-        result = os.popen(command).read()
-    except Exception as err:
-        logging.error("Error executing command: %s", str(err))
+        return result
+
+    argv: list[str] = _split_command(command)
+
+    async with _commands_semaphore:
+        try:
+            process: asyncio.subprocess.Process = await asyncio.create_subprocess_exec(
+                *argv,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                stdin=asyncio.subprocess.DEVNULL
+            )
+        except Exception as err:
+            logging.error("Error executing command: %s", str(err))
+            return result
+
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+            result = stdout.decode('utf8', errors='replace')
+
+        except asyncio.TimeoutError:
+            logging.error("Command timed out after %ss: %s", timeout, command)
+            await _kill(process)
+
+        except asyncio.CancelledError:
+            await _kill(process)
+            raise
 
     return result
 
+@infra_timing.timed("cmd.parse_df_output")
 def parse_df_output(output: str) -> dict[str, dict[str, Union[int, str]]]:
     """Parse the output from the df command"""
     disk_data: dict[str, dict[str, Union[int, str]]] = {}
@@ -73,6 +128,7 @@ def parse_df_output(output: str) -> dict[str, dict[str, Union[int, str]]]:
 
     return disk_data
 
+@infra_timing.timed("cmd.parse_net_output")
 def parse_net_output(output: str) -> dict[str, str]:
     """Parse the output from the iwconfig command"""
     net_data: dict[str, int] = {}
@@ -95,24 +151,26 @@ def parse_net_output(output: str) -> dict[str, str]:
 #                              Public Functions                              #
 ##############################################################################
 
-def get_disk_usage() -> dict[str, dict[str, Union[int, str]]]:
+@infra_timing.timed("cmd.get_disk_usage")
+async def get_disk_usage() -> dict[str, dict[str, Union[int, str]]]:
     """Retrieve file system disk space usage using df command"""
     disk_data: dict[str, dict[str, Union[int, str]]] = {}
 
-    cmd: str = 'df'
-    raw_disk_data: Optional[str] = exec_cmd(cmd)
+    cmd: list[str] = ['df']
+    raw_disk_data: Optional[str] = await exec_cmd(cmd)
 
     if raw_disk_data is not None:
         disk_data = parse_df_output(raw_disk_data)
 
     return disk_data
 
-def get_net_info(iface_name: str) -> dict[str, str]:
+@infra_timing.timed("cmd.get_net_info")
+async def get_net_info(iface_name: str) -> dict[str, str]:
     """Retrieve network interfaces information using iwconfig command"""
     net_data: dict[str, int] = {}
 
-    cmd: str = 'iwconfig ' + iface_name
-    raw_net_data: Optional[str] = exec_cmd(cmd)
+    cmd: list[str] = ['iwconfig', iface_name]
+    raw_net_data: Optional[str] = await exec_cmd(cmd)
 
     if raw_net_data is not None:
         net_data = parse_net_output(raw_net_data)
@@ -1,47 +1,210 @@
 """Handles all the SO file data extraction, taking into consideration any
-relative information required, like number of cores"""
+relative information required, like number of cores.
 
+Files are kept open and reread into reusable buffers, parsing the bytes
+directly, so high frequency sampling does not open or decode files.
+
+Every procfs/sysfs path is resolved under a configurable root, so recorded
+fixtures of other hosts can be read instead of the live system"""
+
+import os
 import re
+import json
+import errno
+import select
 import logging
 
-from typing import Optional
+from typing import Optional, Union
+
+import app.infrastructure.timing as infra_timing
 
 ##############################################################################
 #                                 Constants                                  #
 ##############################################################################
 
+# Root under which every procfs/sysfs path is resolved
+FS_ROOT: str = os.environ.get("RPI_MON_FS_ROOT", "/")
+
+# statvfs results of every mount point, recorded in fixtures next to proc/sys
+STATVFS_FILENAME: str = 'statvfs.json'
+
 CPU_INFO_FILEPATH: str = '/proc/cpuinfo'
 CPU_PROC_FILEPATH: str = '/proc/loadavg'
+CPU_STAT_FILEPATH: str = '/proc/stat'
+
+# Columns of every cpu line of /proc/stat, in order. Guest times are already
+# accounted in user and nice
+CPU_STAT_FIELDS: list[str] = [
+    "user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal"
+]
 
 MEM_INFO_FILEPATH: str = '/proc/meminfo'
 
 NET_INFO_FILEPATH: str = '/proc/net/dev'
 NET_INFO_HEADER_SIZE: int = 2
 
+NET_WIRELESS_FILEPATH: str = '/proc/net/wireless'
+NET_WIRELESS_HEADER_SIZE: int = 2
+NET_SYSFS_DIRPATH: str = '/sys/class/net'
+
+MOUNT_INFO_FILEPATH: str = '/proc/self/mountinfo'
+# Fields after the optional fields separator: fs type and mount source
+MOUNT_INFO_SEPARATOR: bytes = b'-'
+
+# Initial size of the reusable buffer of each procfs reader
+PROC_FILE_BUFFER_SIZE: int = 4096
+
+# Key in the returned dictionary of the /proc/meminfo fields used by the
+# domain layer, any other field keeps its name
+MEM_INFO_FIELDS: dict[bytes, str] = {
+    b'MemTotal': 'mem_total',
+    b'MemFree': 'mem_free',
+    b'MemAvailable': 'mem_ava',
+    b'Buffers': 'buffers',
+    b'Cached': 'cached',
+    b'SwapTotal': 'swap_total',
+    b'SwapFree': 'swap_free',
+    b'Dirty': 'dirty',
+    b'Writeback': 'writeback',
+    b'Slab': 'slab'
+}
+
+##############################################################################
+#                              ProcFS Readers                                #
+##############################################################################
+
+class ProcFileReader:
+    """Keeps a procfs/sysfs file open and rereads it with seek(0) and readinto
+    on a preallocated buffer, which grows whenever the file does not fit"""
+
+    def __init__(self, path: str, size: int = PROC_FILE_BUFFER_SIZE):
+        self.path: str = path
+        self._buffer: bytearray = bytearray(size)
+        self._reader = None
+
+    def fileno(self) -> int:
+        """File descriptor of the kept open file, opening it if needed"""
+        if self._reader is None:
+            self._reader = open(self.path, 'rb', buffering=0)
+        return self._reader.fileno()
+
+    def read(self) -> bytes:
+        """Read the whole file content from the beginning. procfs seq files
+        return about a page per call, so it is read until end of file"""
+        self.fileno()
+        self._reader.seek(0)
+
+        size: int = 0
+        while True:
+            if size == len(self._buffer):
+                # Buffer filled up, the content may continue
+                self._buffer.extend(bytes(len(self._buffer)))
+
+            with memoryview(self._buffer) as buffer_view:
+                read: int = self._reader.readinto(buffer_view[size:])
+            if not read:
+                return bytes(self._buffer[:size])
+            size += read
+
+    def close(self) -> None:
+        """Release the kept open file"""
+        if self._reader is not None:
+            self._reader.close()
+        self._reader = None
+
+_fs_root: str = FS_ROOT
+# Whether the root is a recorded snapshot, with its statvfs results
+_fs_recorded: bool = False
+_proc_readers: dict[str, ProcFileReader] = {}
+_recorded_statvfs: Optional[dict[str, list[int]]] = None
+
+def _resolve(path: str) -> str:
+    """Resolve the given absolute procfs/sysfs path under the current root"""
+    if _fs_root == '/':
+        return path
+    return os.path.join(_fs_root, path.lstrip('/'))
+
+def _get_proc_reader(path: str) -> ProcFileReader:
+    """Return the persistent reader for the given path"""
+    reader: Optional[ProcFileReader] = _proc_readers.get(path)
+    if reader is None:
+        reader = _proc_readers[path] = ProcFileReader(_resolve(path))
+    return reader
+
+@infra_timing.timed("files._read_proc_file")
+def _read_proc_file(path: str) -> bytes:
+    """Read the given procfs/sysfs file through its persistent reader. This is
+    the single I/O path for every file read by this module.
+
+    Readers failing to read are dropped, so the file is reopened next time,
+    e.g. after a network interface is recreated. Invalid argument errors, as
+    the speed of a link down, are expected to be transient and keep it open"""
+    reader: ProcFileReader = _get_proc_reader(path)
+    try:
+        return reader.read()
+    except OSError as err:
+        if err.errno != errno.EINVAL:
+            reader.close()
+            _proc_readers.pop(path, None)
+        raise
+
+def set_fs_root(root: str, recorded: bool = False) -> None:
+    """Resolve every procfs/sysfs path under the given root from now on, e.g.
+    a mounted host filesystem, or a recorded fixture snapshot, whose statvfs
+    results are read too. Kept open files and the parsed mount table are
+    released, so they are read again from the new root"""
+    global _fs_root, _fs_recorded, _mount_table, _recorded_statvfs
+
+    for reader in _proc_readers.values():
+        reader.close()
+    _proc_readers.clear()
+
+    _fs_root = root
+    _fs_recorded = recorded
+    _mount_table = _MountTable()
+    _recorded_statvfs = None
+
+def _statvfs(mount_point: str) -> os.statvfs_result:
+    """Return the statvfs of the given mount point under the current root.
+    Under a recorded snapshot the results recorded with it are used instead"""
+    global _recorded_statvfs
+
+    if not _fs_recorded:
+        return os.statvfs(_resolve(mount_point))
+
+    if _recorded_statvfs is None:
+        try:
+            with open(os.path.join(_fs_root, STATVFS_FILENAME), 'r', encoding='utf8') as statvfs_reader:
+                _recorded_statvfs = json.load(statvfs_reader)
+        except FileNotFoundError:
+            _recorded_statvfs = {}
+
+    if mount_point not in _recorded_statvfs:
+        raise FileNotFoundError(errno.ENOENT, "No recorded statvfs", mount_point)
+
+    return os.statvfs_result(_recorded_statvfs[mount_point])
+
 ##############################################################################
 #                                 Aux Functions                              #
 ##############################################################################
 
-def _process_mem_string(line: str) -> int:
+def _process_mem_string(line: bytes) -> int:
     """Process the given line expecting the format from /proc/meminfo file lines,
     and returns the given Ki as int
     e.g.
     MemTotal:        7795016 kB
-    """
-    kibit: int = -1
-    memregex: str = r'Mem[\w]+:[\s]*([\d]+) kB$'
 
-    result: Optional[re.Match] = re.match(memregex, line)
+    Returns -1 if any error is found"""
+    kibit: int = -1
 
-    if result is not None:
-        try:
-            kibit = int(result.groups()[0])
-        except Exception:
-            logging.error("Error trying to convert mem info into integer: %s", result[0])
+    try:
+        kibit = int(line.split(b':', 1)[1].split()[0])
+    except Exception:
+        logging.error("Error trying to convert mem info into integer: %s", line)
 
     return kibit
 
-def _proc_net_string(line: str) -> tuple[str, dict[str, int]]:
+def _proc_net_string(line: bytes) -> tuple[str, dict[str, int]]:
     """Process the given line expecting the format from /proc/net/dev file lines,
     returning a tuple with the interface name and the data for that interface.
     
@@ -50,35 +213,167 @@ def _proc_net_string(line: str) -> tuple[str, dict[str, int]]:
     iface_data: dict[str, int] = {}
 
     try:
+        name, stats = line.split(b':', 1)
+        parts: list[bytes] = stats.split()
+
+        iface_data = {
+            "rx_pack"  : int(parts[1]),
+            "rx_bytes" : int(parts[0]),
+            "rx_err"   : int(parts[2]),
+            "rx_drop"  : int(parts[3]),
+
+            "tx_pack"  : int(parts[9]),
+            "tx_bytes" : int(parts[8]),
+            "tx_err"   : int(parts[10]),
+            "tx_drop"  : int(parts[11])
+        }
+        iface = name.strip().decode('utf8')
+
+    except Exception as err:
+        logging.error("Error trying to process net info: %s", err)
+        iface_data = {}
+
+    return iface, iface_data
+
+def _proc_stat_cpu_string(line: bytes) -> tuple[str, dict[str, int]]:
+    """Process the given line expecting the format from /proc/stat cpu lines,
+    returning a tuple with the cpu name and its ticks per state. Columns
+    missing in older kernels are 0.
+    e.g.
+    cpu0 4705 356 584 3699 23 23 0 0 0 0
+
+    Returns a tuple with empty string and empty dict if any error is found"""
+    cpu: str = ""
+    cpu_data: dict[str, int] = {}
+
+    try:
+        parts: list[bytes] = line.split()
+        ticks: list[int] = [int(part) for part in parts[1:len(CPU_STAT_FIELDS) + 1]]
+        ticks += [0] * (len(CPU_STAT_FIELDS) - len(ticks))
+
+        cpu_data = dict(zip(CPU_STAT_FIELDS, ticks))
+        cpu = parts[0].decode('utf8')
+
+    except Exception as err:
+        logging.error("Error trying to process cpu stat: %s", err)
+        cpu_data = {}
 
-        # Collapse spaces
-        line = ' '.join(line.split())
+    return cpu, cpu_data
 
-        parts: list[str] = line.split(" ")
+def _proc_wireless_string(line: bytes) -> tuple[str, dict[str, float]]:
+    """Process the given line expecting the format from /proc/net/wireless
+    file lines, returning a tuple with the interface name and its link quality
+    and signal level (dBm).
+    e.g.
+     wlan0: 0000   70.  -40.  -256        0      0      0    317      0        0
+
+    Returns a tuple with empty string and empty dict if any error is found"""
+    iface: str = ""
+    iface_data: dict[str, float] = {}
+
+    try:
+        name, stats = line.split(b':', 1)
+        parts: list[bytes] = stats.split()
 
-        iface = parts[0].replace(":", "")
         iface_data = {
-            "rec_pack"  : int([parts[2]]),
-            "rec_bytes" : int([parts[1]]),
-            "rec_err"   : int([parts[3]]),
-            "rec_drop"  : int([parts[4]]),
-
-            "snd_pack"  : int([parts[10]]),
-            "snd_bytes" : int([parts[9]]),
-            "snd_err"   : int([parts[11]]),
-            "snd_drop"  : int([parts[12]])
+            "link_quality": float(parts[1].rstrip(b'.')),
+            "signal_level": float(parts[2].rstrip(b'.'))
         }
-
+        iface = name.strip().decode('utf8')
 
     except Exception as err:
-        logging.error("Error trying to process net info: %s", err)
+        logging.error("Error trying to process wireless info: %s", err)
+        iface_data = {}
 
     return iface, iface_data
 
+def _read_sysfs_value(iface: str, attribute: str) -> Optional[str]:
+    """Read a single value from /sys/class/net/<iface>/<attribute>.
+
+    Returns None if the attribute can't be read, e.g. speed of a link down"""
+    try:
+        return _read_proc_file(os.path.join(NET_SYSFS_DIRPATH, iface, attribute)).strip().decode('utf8')
+    except OSError:
+        return None
+
+def _prune_sysfs_readers(ifaces: set[str]) -> None:
+    """Close the readers of the sysfs attributes of the interfaces no longer
+    listed, e.g. the veth of a stopped container, so their files are not kept
+    open forever"""
+    for path in [path for path in _proc_readers if path.startswith(NET_SYSFS_DIRPATH + '/')]:
+        if path[len(NET_SYSFS_DIRPATH) + 1:].split('/', 1)[0] not in ifaces:
+            _proc_readers.pop(path).close()
+
+def _unescape_mount_field(field: bytes) -> str:
+    """Undo the octal escaping (e.g. \\040 for spaces) used by the kernel
+    for paths in /proc/self/mountinfo"""
+    if b'\\' in field:
+        field = re.sub(rb'\\([0-7]{3})', lambda match: bytes([int(match.group(1), 8)]), field)
+
+    return os.fsdecode(field)
+
+def _proc_mount_string(line: bytes) -> Optional[tuple[str, str, str]]:
+    """Process the given line expecting the format from /proc/self/mountinfo
+    file lines, returning a tuple with the mount source, mount point and
+    file system type.
+    e.g.
+    36 35 98:0 / /boot rw,noatime shared:1 - vfat /dev/mmcblk0p1 rw
+
+    Returns None if the line can't be processed"""
+    parts: list[bytes] = line.split()
+
+    try:
+        separator: int = parts.index(MOUNT_INFO_SEPARATOR, 6)
+        return (
+            _unescape_mount_field(parts[separator + 2]),
+            _unescape_mount_field(parts[4]),
+            parts[separator + 1].decode('utf8')
+        )
+
+    except (ValueError, IndexError):
+        logging.error("Error trying to process mount info: %s", line)
+
+    return None
+
+class _MountTable:
+    """Keeps /proc/self/mountinfo open and only parses it again when the
+    kernel reports a change in the mount table through poll()"""
+
+    def __init__(self, path: str = MOUNT_INFO_FILEPATH):
+        self.path: str = path
+        self._poller = None
+        self._mounts: Optional[list[tuple[str, str, str]]] = None
+
+    def _load(self) -> None:
+        """Parse the whole mount table from the kept open file"""
+        mounts: list[tuple[str, str, str]] = []
+        for line in _read_proc_file(self.path).splitlines():
+            mount: Optional[tuple[str, str, str]] = _proc_mount_string(line)
+            if mount is not None:
+                mounts.append(mount)
+
+        self._mounts = mounts
+
+    def mounts(self) -> list[tuple[str, str, str]]:
+        """Return the mount table as (source, mount point, fs type) tuples"""
+        if self._mounts is None:
+            if hasattr(select, 'poll'):
+                self._poller = select.poll()
+                self._poller.register(_get_proc_reader(self.path), select.POLLPRI | select.POLLERR)
+            self._load()
+
+        elif self._poller is None or self._poller.poll(0):
+            self._load()
+
+        return self._mounts
+
+_mount_table: _MountTable = _MountTable()
+
 ##############################################################################
 #                              Public Functions                              #
 ##############################################################################
 
+@infra_timing.timed("files.get_cpu_cores")
 async def get_cpu_cores() -> int:
     """Check number of cores available in the CPU.
     
@@ -87,10 +382,8 @@ async def get_cpu_cores() -> int:
 
     try:
 
-        with open(CPU_INFO_FILEPATH, 'r', encoding='utf8') as cpu_reader:
-            for line in cpu_reader:
-                if 'processor' in line:
-                    cores += 1
+        cpu_data: bytes = _read_proc_file(CPU_INFO_FILEPATH)
+        cores = cpu_data.count(b'\nprocessor') + cpu_data.startswith(b'processor')
 
     except FileNotFoundError:
         logging.warning("Can't find expected CPU INFO file at: %s", CPU_INFO_FILEPATH)
@@ -102,6 +395,7 @@ async def get_cpu_cores() -> int:
     logging.debug("Detected CPU Cores: %i", cores)
     return cores
 
+@infra_timing.timed("files.get_cpu_load_avg")
 async def get_cpu_load_avg() -> dict[str, str]:
     """Read the system CPU Load information and return in dictionary format,
     parsed to float.
@@ -111,58 +405,173 @@ async def get_cpu_load_avg() -> dict[str, str]:
 
     try:
 
-        with open(CPU_PROC_FILEPATH, 'r', encoding='utf8') as load_reader:
-            loads: list[str] = load_reader.readline().split(" ")[0:3]
+        loads: list[bytes] = _read_proc_file(CPU_PROC_FILEPATH).split(None, 3)[0:3]
 
-            load_avg["1m"] = loads[0]
-            load_avg["5m"] = loads[1]
-            load_avg["15m"] = loads[2]
+        load_avg["1m"] = loads[0].decode('utf8')
+        load_avg["5m"] = loads[1].decode('utf8')
+        load_avg["15m"] = loads[2].decode('utf8')
 
     except Exception as err:
         logging.warning("Unexpected error:\n%s", err)
 
     return load_avg
 
+@infra_timing.timed("files.get_cpu_stat")
+async def get_cpu_stat() -> dict:
+    """Read the system CPU statistics from /proc/stat and return in dictionary
+    format: the ticks per state of every cpu under "cpus", being "cpu" the
+    total of all the cores, and the context switches ("ctxt") and forks
+    ("forks") since boot.
+
+    Will return an empty dict if any error is found"""
+    cpu_stat: dict = {}
+
+    try:
+        cpus: dict[str, dict[str, int]] = {}
+        for line in _read_proc_file(CPU_STAT_FILEPATH).splitlines():
+            if line.startswith(b'cpu'):
+                cpu, cpu_data = _proc_stat_cpu_string(line)
+                if cpu:
+                    cpus[cpu] = cpu_data
+            elif line.startswith(b'ctxt '):
+                cpu_stat["ctxt"] = int(line[5:])
+            elif line.startswith(b'processes '):
+                cpu_stat["forks"] = int(line[10:])
+
+        cpu_stat["cpus"] = cpus
+
+    except Exception as err:
+        logging.warning("Unexpected error:\n%s", err)
+        cpu_stat = {}
+
+    return cpu_stat
+
+@infra_timing.timed("files.get_mem_info")
 async def get_mem_info() -> dict[str, int]:
-    """Read the system Memory information and return in dictionary format,
-    in kbi parsed to integer.
+    """Read every /proc/meminfo field in a single pass and return in
+    dictionary format, in kbi parsed to integer. Fields without unit, e.g.
+    HugePages_Total, are counts.
     
-    Will return -1 for each memory amount if any error is found"""
+    Will return an empty dict if any error is found"""
     mem_info: dict[str, int] = {}
 
     try:
 
-        with open(MEM_INFO_FILEPATH, 'r', encoding='utf8') as mem_reader:
-            mem_info['mem_total'] = _process_mem_string(mem_reader.readline())
-            mem_info['mem_free'] = _process_mem_string(mem_reader.readline())
-            mem_info['mem_ava']  = _process_mem_string(mem_reader.readline())
+        for line in _read_proc_file(MEM_INFO_FILEPATH).splitlines():
+            name: bytes = line.split(b':', 1)[0]
+            key: Optional[str] = MEM_INFO_FIELDS.get(name)
+            mem_info[key if key is not None else name.decode('utf8')] = _process_mem_string(line)
 
     except Exception as err:
         logging.warning("Unexpected error:\n%s", err)
+        mem_info = {}
 
     return mem_info
 
+@infra_timing.timed("files.get_net_info")
 async def get_net_info() -> dict[str, dict[str, int]]:
     """Read the system network interfaces information and return in dictionary format.
-    
+    The sysfs readers of the interfaces no longer listed are closed.
+
     Will return an empty dict if any error is found."""
     net_info: dict[str, dict[str, int]] = {}
 
     try:
-        header: int = 0
-        with open(NET_INFO_FILEPATH, 'r', encoding='utf8') as net_reader:
-            iface_name: str
-            iface_data: dict[str, int]
-
-            for line in net_reader:
-                if header < NET_INFO_HEADER_SIZE:
-                    header += 1
-                    continue
+        iface_name: str
+        iface_data: dict[str, int]
 
-                iface_name, iface_data = _proc_net_string(line)
+        for line in _read_proc_file(NET_INFO_FILEPATH).splitlines()[NET_INFO_HEADER_SIZE:]:
+            iface_name, iface_data = _proc_net_string(line)
+            if iface_name:
                 net_info[iface_name] = iface_data
 
+        _prune_sysfs_readers(set(net_info))
+
     except Exception as err:
         logging.warning("Unexpected error:\n%s", err)
 
     return net_info
+
+@infra_timing.timed("files.get_disk_usage")
+async def get_disk_usage() -> dict[str, dict[str, Union[int, str]]]:
+    """Retrieve file system disk space usage from the mount table and statvfs,
+    in kbi parsed to integer, like the df command does by default.
+
+    Mounts without blocks (proc, sysfs...) are skipped and, when a device is
+    mounted more than once, the first mount point is kept.
+
+    Will return an empty dict if any error is found."""
+    disk_data: dict[str, dict[str, Union[int, str]]] = {}
+
+    try:
+        for device, mount_point, fs_type in _mount_table.mounts():
+            if device in disk_data:
+                continue
+
+            try:
+                stats: os.statvfs_result = _statvfs(mount_point)
+            except OSError as err:
+                logging.debug("Can't stat mount point %s: %s", mount_point, err)
+                continue
+
+            if stats.f_blocks == 0:
+                continue
+
+            disk_data[device] = {
+                "total": stats.f_blocks * stats.f_frsize // 1024,
+                "used": (stats.f_blocks - stats.f_bfree) * stats.f_frsize // 1024,
+                "free": stats.f_bavail * stats.f_frsize // 1024,
+                "mount": mount_point,
+                "fs_type": fs_type
+            }
+
+    except Exception as err:
+        logging.warning("Unexpected error:\n%s", err)
+
+    return disk_data
+
+@infra_timing.timed("files.get_link_info")
+async def get_link_info(ifaces: list[str]) -> dict[str, dict[str, Union[bool, float, str]]]:
+    """Read the link information of the given network interfaces in a single
+    pass over /proc/net/wireless and /sys/class/net, without forking.
+
+    Every interface gets its operational state and, when known, its bit rate.
+    Only wireless interfaces get link quality and signal level.
+
+    Will return an empty dict if any error is found."""
+    link_info: dict[str, dict[str, Union[bool, float, str]]] = {}
+
+    try:
+        wireless_info: dict[str, dict[str, float]] = {}
+        try:
+            for line in _read_proc_file(NET_WIRELESS_FILEPATH).splitlines()[NET_WIRELESS_HEADER_SIZE:]:
+                iface_name, iface_data = _proc_wireless_string(line)
+                if iface_name:
+                    wireless_info[iface_name] = iface_data
+
+        except FileNotFoundError:
+            logging.debug("No wireless extensions available at: %s", NET_WIRELESS_FILEPATH)
+
+        for iface in ifaces:
+            iface_data: dict[str, Union[bool, float, str]] = {
+                "wireless": iface in wireless_info or
+                            os.path.isdir(_resolve(os.path.join(NET_SYSFS_DIRPATH, iface, 'wireless')))
+            }
+
+            oper_state: Optional[str] = _read_sysfs_value(iface, 'operstate')
+            if oper_state is not None:
+                iface_data["oper_state"] = oper_state
+
+            speed: Optional[str] = _read_sysfs_value(iface, 'speed')
+            if speed is not None and speed.lstrip('-').isdigit() and int(speed) > 0:
+                iface_data["bit_rate"] = f"{speed} Mb/s"
+
+            if iface_data["wireless"]:
+                iface_data.update(wireless_info.get(iface, {}))
+
+            link_info[iface] = iface_data
+
+    except Exception as err:
+        logging.warning("Unexpected error:\n%s", err)
+
+    return link_info
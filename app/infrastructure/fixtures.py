@@ -0,0 +1,224 @@
+"""Handles the procfs/sysfs fixtures: a recorder that snapshots every file
+read by the files module from a live host into a fixture directory, and a
+replay that steps through those snapshots by moving the files module root,
+on the cadence they were recorded at.
+
+A fixture directory holds one snapshot directory per step, each of them with
+the proc and sys trees, the statvfs results of every mount point and the time
+it was recorded at.
+
+e.g.
+    python benchmarks/record_fixture.py /tmp/fixture --count 60 --interval 1
+    RPI_MON_REPLAY_DIR=/tmp/fixture uvicorn app.main:rpi_mon_api"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+
+from typing import Optional
+
+import app.infrastructure.files as infra_files
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Fixture directory replayed instead of the live system, disabled if empty
+REPLAY_DIR: str = os.environ.get("RPI_MON_REPLAY_DIR", "")
+
+# Seconds between the snapshots recorded without their time
+REPLAY_INTERVAL: float = float(os.environ.get("RPI_MON_REPLAY_INTERVAL", "1"))
+
+RECORDED_FILES: list[str] = [
+    infra_files.CPU_INFO_FILEPATH,
+    infra_files.CPU_PROC_FILEPATH,
+    infra_files.CPU_STAT_FILEPATH,
+    infra_files.MEM_INFO_FILEPATH,
+    infra_files.NET_INFO_FILEPATH,
+    infra_files.NET_WIRELESS_FILEPATH,
+    infra_files.MOUNT_INFO_FILEPATH
+]
+
+# Attributes recorded for every network interface
+NET_SYSFS_ATTRIBUTES: list[str] = ['operstate', 'speed']
+
+SNAPSHOT_NAME_FORMAT: str = '{:06d}'
+
+TIMESTAMP_FILENAME: str = 'timestamp'
+
+##############################################################################
+#                                 Aux Functions                              #
+##############################################################################
+
+def _copy(source: str, destination: str) -> bool:
+    """Copy a procfs/sysfs file, which reports no size, reading it whole.
+    Returns False if the file can't be read"""
+    try:
+        with open(source, 'rb') as source_reader:
+            content: bytes = source_reader.read()
+    except OSError:
+        return False
+
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    with open(destination, 'wb') as destination_writer:
+        destination_writer.write(content)
+
+    return True
+
+def record_snapshot(snapshot_dir: str, source_root: str = '/') -> None:
+    """Record every file read by the files module, the sysfs attributes of
+    every network interface, the statvfs of every mount point and the time"""
+    timestamp: float = time.time()
+
+    def source(path: str) -> str:
+        return os.path.join(source_root, path.lstrip('/'))
+
+    def destination(path: str) -> str:
+        return os.path.join(snapshot_dir, path.lstrip('/'))
+
+    for path in RECORDED_FILES:
+        _copy(source(path), destination(path))
+
+    net_dirpath: str = source(infra_files.NET_SYSFS_DIRPATH)
+    for iface in sorted(os.listdir(net_dirpath)) if os.path.isdir(net_dirpath) else []:
+        iface_path: str = os.path.join(infra_files.NET_SYSFS_DIRPATH, iface)
+        for attribute in NET_SYSFS_ATTRIBUTES:
+            _copy(source(os.path.join(iface_path, attribute)), destination(os.path.join(iface_path, attribute)))
+        if os.path.isdir(source(os.path.join(iface_path, 'wireless'))):
+            os.makedirs(destination(os.path.join(iface_path, 'wireless')), exist_ok=True)
+
+    statvfs: dict[str, list[int]] = {}
+    try:
+        with open(source(infra_files.MOUNT_INFO_FILEPATH), 'rb') as mounts_reader:
+            for line in mounts_reader.read().splitlines():
+                mount: Optional[tuple[str, str, str]] = infra_files._proc_mount_string(line)
+                if mount is not None and mount[1] not in statvfs:
+                    try:
+                        statvfs[mount[1]] = list(os.statvfs(source(mount[1])))
+                    except OSError:
+                        pass
+    except OSError as err:
+        logging.warning("Can't record the mount points statvfs:\n%s", err)
+
+    with open(os.path.join(snapshot_dir, infra_files.STATVFS_FILENAME), 'w', encoding='utf8') as statvfs_writer:
+        json.dump(statvfs, statvfs_writer)
+
+    with open(os.path.join(snapshot_dir, TIMESTAMP_FILENAME), 'w', encoding='utf8') as timestamp_writer:
+        timestamp_writer.write(repr(timestamp))
+
+def record(fixture_dir: str, count: int, interval: float, source_root: str = '/') -> int:
+    """Record count snapshots, interval seconds apart, after any snapshot
+    already in the fixture directory. Returns the number of snapshots"""
+    os.makedirs(fixture_dir, exist_ok=True)
+    first: int = len(list_snapshots(fixture_dir))
+
+    for index in range(first, first + count):
+        started: float = time.monotonic()
+        record_snapshot(os.path.join(fixture_dir, SNAPSHOT_NAME_FORMAT.format(index)), source_root)
+        if index < first + count - 1:
+            time.sleep(max(interval - (time.monotonic() - started), 0))
+
+    return first + count
+
+def list_snapshots(fixture_dir: str) -> list[str]:
+    """Return the snapshot directories of the given fixture, in order"""
+    if not os.path.isdir(fixture_dir):
+        return []
+
+    return [
+        os.path.join(fixture_dir, name) for name in sorted(os.listdir(fixture_dir))
+        if os.path.isdir(os.path.join(fixture_dir, name))
+    ]
+
+def _read_timestamp(snapshot_dir: str) -> Optional[float]:
+    """Return the time the given snapshot was recorded at, None if unknown"""
+    try:
+        with open(os.path.join(snapshot_dir, TIMESTAMP_FILENAME), 'r', encoding='utf8') as timestamp_reader:
+            return float(timestamp_reader.read())
+    except (OSError, ValueError):
+        return None
+
+def snapshot_delays(snapshots: list[str], interval: float = REPLAY_INTERVAL) -> list[float]:
+    """Return the seconds between every snapshot and the next one, the last
+    one being followed by the first one after the mean delay. Snapshots
+    recorded without their time are interval seconds apart"""
+    timestamps: list[Optional[float]] = [_read_timestamp(snapshot) for snapshot in snapshots]
+    delays: list[float] = [
+        current - previous if previous is not None and current is not None and current > previous else interval
+        for previous, current in zip(timestamps, timestamps[1:])
+    ]
+    delays.append(sum(delays) / len(delays) if delays else interval)
+    return delays
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+class Replay:
+    """Steps the files module root through the snapshots of a fixture,
+    starting over after the last one, either on demand or from a background
+    task on the recorded cadence"""
+
+    def __init__(self, snapshots: list[str], interval: float = REPLAY_INTERVAL):
+        self.snapshots: list[str] = snapshots
+        self.delays: list[float] = snapshot_delays(snapshots, interval)
+        self.index: int = 0
+        self._task: Optional[asyncio.Task] = None
+        infra_files.set_fs_root(self.snapshots[0], recorded=True)
+
+    @property
+    def snapshot(self) -> str:
+        """Snapshot directory currently read"""
+        return self.snapshots[self.index]
+
+    def step(self) -> str:
+        """Move to the next snapshot, returning it"""
+        self.index = (self.index + 1) % len(self.snapshots)
+        infra_files.set_fs_root(self.snapshots[self.index], recorded=True)
+        return self.snapshot
+
+    async def _run(self) -> None:
+        """Step to the next snapshot once the recorded delay has elapsed"""
+        while True:
+            await asyncio.sleep(self.delays[self.index])
+            self.step()
+
+    def start(self) -> None:
+        """Start stepping in the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop stepping, staying on the current snapshot"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def close(self) -> None:
+        """Read the live system again"""
+        infra_files.set_fs_root(infra_files.FS_ROOT)
+
+##############################################################################
+#                              Public Functions                              #
+##############################################################################
+
+def open_replay(fixture_dir: str = REPLAY_DIR) -> Optional[Replay]:
+    """Start replaying the given fixture directory.
+
+    Will return None if replay is disabled or the fixture has no snapshots"""
+    if not fixture_dir:
+        return None
+
+    snapshots: list[str] = list_snapshots(fixture_dir)
+    if not snapshots:
+        logging.error("No snapshots to replay at: %s", fixture_dir)
+        return None
+
+    logging.info("Replaying %i snapshots from: %s", len(snapshots), fixture_dir)
+    return Replay(snapshots)
@@ -0,0 +1,190 @@
+"""Handles the on-demand sampling profiler of the running service.
+
+A background thread periodically takes the Python stack of the event loop
+thread and counts it in collapsed format (root;...;leaf count), ready for
+flamegraph tools. Every stack is rooted at its category: time spent in the
+collectors (domain read_* functions), in the rest of the event loop, or idle
+waiting for events.
+
+Sampling only reads the frames of the profiled thread. Its cost is measured
+on every sample and the rate is lowered whenever needed to stay within the
+overhead budget"""
+
+import os
+import sys
+import hmac
+import time
+import asyncio
+import threading
+import collections
+import dataclasses as dc
+
+from types import FrameType
+from typing import Optional
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Bearer token required to take a profile, profiling is disabled when empty
+ADMIN_TOKEN: str = os.environ.get("RPI_MON_ADMIN_TOKEN", "")
+
+PROFILE_MAX_SECONDS: float = 60
+PROFILE_MAX_FREQUENCY: float = 1000
+
+# Fraction of a core the sampling thread may use
+PROFILE_OVERHEAD_BUDGET: float = 0.05
+
+# Frames kept per stack, from the leaf
+PROFILE_MAX_DEPTH: int = 64
+
+CATEGORY_COLLECTOR: str = "collector"
+CATEGORY_EVENT_LOOP: str = "event_loop"
+CATEGORY_IDLE: str = "idle"
+
+# Modules whose read_* functions are the collectors
+COLLECTOR_MODULE_PREFIX: str = "app.domain."
+
+# Frames running the event loop. Loops implemented in C, as uvloop, wait for
+# events without any Python frame above them
+LOOP_ENTRY_POINTS: frozenset[str] = frozenset({
+    "asyncio.runners.run", "asyncio.runners.Runner.run", "uvloop.run", "uvicorn.server.Server.run"
+})
+LOOP_RUN_METHODS: tuple[str, ...] = (".run_forever", ".run_until_complete")
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+@dc.dataclass(slots=True)
+class Profile:
+    """Models the result of a profiling session. stacks counts the samples
+    of every collapsed stack, categories the samples of every category and
+    overhead is the CPU time of the sampling thread over the duration"""
+    frequency : float
+    duration  : float = 0
+    samples   : int = 0
+    overhead  : float = 0
+    stacks    : collections.Counter = dc.field(default_factory=collections.Counter)
+    categories: collections.Counter = dc.field(default_factory=collections.Counter)
+
+    def collapsed(self) -> str:
+        """Return the stacks in collapsed format, one per line"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def as_dict(self) -> dict:
+        """Return the profile summary along with its stacks"""
+        return {
+            "frequency": self.frequency,
+            "duration": self.duration,
+            "samples": self.samples,
+            "overhead": self.overhead,
+            "categories": dict(self.categories),
+            "stacks": dict(self.stacks.most_common())
+        }
+
+##############################################################################
+#                                 Aux Functions                              #
+##############################################################################
+
+def _frame_name(frame: FrameType) -> str:
+    """Return the module qualified name of the function of a frame"""
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}"
+
+def _stack(frame: Optional[FrameType], max_depth: int = PROFILE_MAX_DEPTH) -> list[str]:
+    """Return the frame names of a stack, from the root to the leaf. Stacks
+    deeper than the maximum depth lose their root frames"""
+    names: list[str] = []
+    while frame is not None and len(names) < max_depth:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    if frame is not None:
+        names.append("...")
+
+    names.reverse()
+    return names
+
+def categorize(stack: list[str]) -> str:
+    """Return the category of a stack: collector if it runs a domain read_*
+    function, idle if the event loop waits for events, i.e. in selectors or
+    with no task running above the loop entry point, event loop otherwise"""
+    for name in stack:
+        module, _, function = name.rpartition('.')
+        if module.startswith(COLLECTOR_MODULE_PREFIX) and function.startswith("read_"):
+            return CATEGORY_COLLECTOR
+
+    if stack and (stack[-1].startswith("selectors.") or stack[-1] in LOOP_ENTRY_POINTS or
+                  stack[-1].endswith(LOOP_RUN_METHODS)):
+        return CATEGORY_IDLE
+
+    return CATEGORY_EVENT_LOOP
+
+def _sample_thread(profile: Profile, thread_id: int, stop: threading.Event) -> None:
+    """Sample the stack of the given thread until stopped, sleeping between
+    samples so the sampling cost stays within the overhead budget"""
+    interval: float = 1 / profile.frequency
+    started: float = time.monotonic()
+    cpu_started: float = time.thread_time()
+
+    while not stop.is_set():
+        sample_started: float = time.perf_counter()
+
+        frame: Optional[FrameType] = sys._current_frames().get(thread_id)
+        if frame is not None:
+            stack: list[str] = _stack(frame)
+            category: str = categorize(stack)
+            profile.stacks[";".join([category, *stack])] += 1
+            profile.categories[category] += 1
+            profile.samples += 1
+        del frame
+
+        cost: float = time.perf_counter() - sample_started
+        stop.wait(max(interval - cost, cost / PROFILE_OVERHEAD_BUDGET - cost))
+
+    profile.duration = time.monotonic() - started
+    profile.overhead = (time.thread_time() - cpu_started) / profile.duration if profile.duration else 0
+
+_profiling: threading.Lock = threading.Lock()
+
+##############################################################################
+#                              Public Functions                              #
+##############################################################################
+
+def is_authorized(authorization: Optional[str], token: str = ADMIN_TOKEN) -> bool:
+    """Whether the given Authorization header carries the admin bearer
+    token. Always False if no token is configured"""
+    if not token or not authorization:
+        return False
+
+    scheme, _, credentials = authorization.partition(' ')
+    return scheme.lower() == "bearer" and hmac.compare_digest(credentials.strip().encode(), token.encode())
+
+async def profile(seconds: float, frequency: float,
+                  thread_id: Optional[int] = None) -> Profile:
+    """Sample the given thread, the event loop one by default, for the given
+    seconds at the given frequency (Hz), both capped. Only one profile can
+    be taken at a time.
+
+    Will raise RuntimeError if another profile is being taken"""
+    if not _profiling.acquire(blocking=False):
+        raise RuntimeError("A profile is already being taken")
+
+    try:
+        result: Profile = Profile(min(max(frequency, 1), PROFILE_MAX_FREQUENCY))
+        stop: threading.Event = threading.Event()
+        sampler: threading.Thread = threading.Thread(
+            target=_sample_thread, name="rpi-mon-profiler", daemon=True,
+            args=(result, thread_id if thread_id is not None else threading.get_ident(), stop)
+        )
+
+        sampler.start()
+        try:
+            await asyncio.sleep(min(max(seconds, 0), PROFILE_MAX_SECONDS))
+        finally:
+            stop.set()
+            await asyncio.get_running_loop().run_in_executor(None, sampler.join)
+
+        return result
+
+    finally:
+        _profiling.release()
@@ -0,0 +1,142 @@
+"""Handles the on-disk spool of opaque batches, kept as one file per batch in
+a directory under a size ceiling.
+
+Batches are written to a temporary file, synced and renamed, so a crash never
+leaves a partially written batch. File names keep the order of the batches
+and the number of lines they hold. Batches that can't be read are moved aside
+with the corrupt suffix, kept for inspection but never read again"""
+
+import os
+import logging
+import threading
+
+from typing import Optional
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+BATCH_SUFFIX: str = '.batch'
+CORRUPT_SUFFIX: str = '.corrupt'
+
+# <sequence>-<lines>.batch
+BATCH_NAME_FORMAT: str = '{:012d}-{:d}' + BATCH_SUFFIX
+
+##############################################################################
+#                                 Aux Functions                              #
+##############################################################################
+
+def _parse_name(name: str) -> Optional[tuple[int, int]]:
+    """Return the (sequence, lines) of a batch file name, None if it is not
+    a batch"""
+    if not name.endswith(BATCH_SUFFIX):
+        return None
+
+    try:
+        sequence, lines = name[:-len(BATCH_SUFFIX)].split('-')
+        return int(sequence), int(lines)
+    except ValueError:
+        return None
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+class Spool:
+    """Directory of batch files, oldest first, holding at most max_bytes.
+    Batches can be pushed and removed from different executor threads"""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path: str = path
+        self.max_bytes: int = max_bytes
+        self.bytes: int = 0
+        self._names: list[str] = []
+        self._lock: threading.Lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if _parse_name(name) is not None:
+                self._names.append(name)
+                self.bytes += os.path.getsize(os.path.join(path, name))
+            elif name.endswith('.tmp'):
+                os.remove(os.path.join(path, name))
+        self._names.sort()
+
+        last: Optional[tuple[int, int]] = _parse_name(self._names[-1]) if self._names else None
+        self._sequence: int = last[0] + 1 if last is not None else 0
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def push(self, batch: bytes, lines: int) -> bool:
+        """Write a batch after the newest one. Returns False if it does not
+        fit under the size ceiling"""
+        if self.bytes + len(batch) > self.max_bytes:
+            return False
+
+        name: str = BATCH_NAME_FORMAT.format(self._sequence, lines)
+        tmp_path: str = os.path.join(self.path, name + '.tmp')
+        with open(tmp_path, 'wb') as batch_writer:
+            batch_writer.write(batch)
+            batch_writer.flush()
+            os.fsync(batch_writer.fileno())
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+        with self._lock:
+            self._names.append(name)
+            self._sequence += 1
+            self.bytes += len(batch)
+        return True
+
+    def peek(self) -> Optional[tuple[str, bytes, int]]:
+        """Return the (name, batch, lines) of the oldest batch, None if the
+        spool is empty"""
+        if not self._names:
+            return None
+
+        name: str = self._names[0]
+        with open(os.path.join(self.path, name), 'rb') as batch_reader:
+            return name, batch_reader.read(), _parse_name(name)[1]
+
+    def remove(self, name: str) -> None:
+        """Delete the given batch"""
+        path: str = os.path.join(self.path, name)
+        size: int = os.path.getsize(path)
+        os.remove(path)
+        with self._lock:
+            self.bytes -= size
+            self._names.remove(name)
+
+    def quarantine(self) -> int:
+        """Move the oldest batch aside, so it is never read again, and return
+        its lines. It is forgotten even if it can't be moved"""
+        with self._lock:
+            name: str = self._names.pop(0)
+
+        path: str = os.path.join(self.path, name)
+        try:
+            size: int = os.path.getsize(path)
+            os.replace(path, path + CORRUPT_SUFFIX)
+            with self._lock:
+                self.bytes -= size
+        except OSError as err:
+            logging.error("Can't move the spool batch %s aside:\n%s", name, err)
+
+        return _parse_name(name)[1]
+
+##############################################################################
+#                              Public Functions                              #
+##############################################################################
+
+def open_spool(path: str, max_bytes: int) -> Optional[Spool]:
+    """Open, or create, the spool at the given directory.
+
+    Will return None if any error is found"""
+    spool: Optional[Spool] = None
+
+    try:
+        spool = Spool(path, max_bytes)
+    except Exception as err:
+        logging.error("Can't open the spool at %s:\n%s", path, err)
+
+    return spool
@@ -0,0 +1,199 @@
+"""Handles the on-disk store of fixed width binary records, kept in a memory
+mapped circular file.
+
+Records are only written in batches: every batch dirties the minimum number
+of pages and is synced once, then the header is updated and synced. Records
+about to be overwritten are released in the header beforehand, so a crash
+in between never exposes partially written records. Reloading maps the
+file and unpacks the records in place, without any text parsing"""
+
+import os
+import json
+import mmap
+import time
+import struct
+import logging
+
+from typing import Iterator, Optional
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+STORE_MAGIC: bytes = b'RPIMON01'
+STORE_VERSION: int = 1
+
+# magic, version, record size, capacity, head (next slot), count
+HEADER_FORMAT: struct.Struct = struct.Struct('<8sIIQQQ')
+# The header takes a whole page so records start page aligned
+HEADER_SIZE: int = mmap.PAGESIZE
+
+# timestamp, value, series id
+RECORD_FORMAT: struct.Struct = struct.Struct('<ddI4x')
+RECORD_SIZE: int = RECORD_FORMAT.size
+
+##############################################################################
+#                                 Aux Functions                              #
+##############################################################################
+
+def _page_range(offset: int, size: int) -> tuple[int, int]:
+    """Return the page aligned (offset, size) covering the given range"""
+    start: int = offset - offset % mmap.PAGESIZE
+    end: int = offset + size
+    end += -end % mmap.PAGESIZE
+    return start, end - start
+
+def load_series_table(path: str) -> list[list[str]]:
+    """Read the series table (series id to key) stored next to a store.
+
+    Returns an empty list if it does not exist or any error is found"""
+    try:
+        with open(path, 'r', encoding='utf8') as table_reader:
+            return json.load(table_reader)
+    except FileNotFoundError:
+        pass
+    except Exception as err:
+        logging.warning("Unexpected error reading series table:\n%s", err)
+
+    return []
+
+def save_series_table(path: str, table: list[list[str]]) -> None:
+    """Atomically replace the series table stored next to a store"""
+    tmp_path: str = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as table_writer:
+        json.dump(table, table_writer)
+        table_writer.flush()
+        os.fsync(table_writer.fileno())
+    os.replace(tmp_path, path)
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+class RecordStore:
+    """Memory mapped circular file of (timestamp, value, series id) records.
+    Once full, every new record overwrites the oldest one"""
+
+    def __init__(self, path: str, capacity: int):
+        self.path: str = path
+        self.capacity: int = capacity
+        self.head: int = 0
+        self.count: int = 0
+
+        self.logical_bytes: int = 0
+        self.physical_bytes: int = 0
+        self.flushes: int = 0
+        self._started: float = time.monotonic()
+
+        size: int = HEADER_SIZE + capacity * RECORD_SIZE
+        fd: int = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._map: mmap.mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        magic, version, record_size, stored_capacity, head, count = \
+            HEADER_FORMAT.unpack_from(self._map, 0)
+
+        if (magic, version, record_size, stored_capacity) == \
+            (STORE_MAGIC, STORE_VERSION, RECORD_SIZE, capacity) and head < capacity and count <= capacity:
+            self.head, self.count = head, count
+        else:
+            if magic != b'\0' * len(STORE_MAGIC):
+                logging.warning("Discarding incompatible store at: %s", path)
+            self._write_header()
+
+    @property
+    def bytes_per_hour(self) -> float:
+        """Bytes synced to disk per hour since the store was opened"""
+        elapsed: float = time.monotonic() - self._started
+        return self.physical_bytes * 3600 / elapsed if elapsed > 0 else 0
+
+    @property
+    def write_amplification(self) -> float:
+        """Ratio between the bytes synced to disk and the record bytes"""
+        return self.physical_bytes / self.logical_bytes if self.logical_bytes else 0
+
+    def _write_header(self) -> None:
+        """Write and sync the header page"""
+        HEADER_FORMAT.pack_into(self._map, 0, STORE_MAGIC, STORE_VERSION,
+                                RECORD_SIZE, self.capacity, self.head, self.count)
+        self._map.flush(0, HEADER_SIZE)
+        self.physical_bytes += HEADER_SIZE
+
+    def _write_records(self, slot: int, records: memoryview) -> None:
+        """Write and sync consecutive records starting at the given slot"""
+        offset: int = HEADER_SIZE + slot * RECORD_SIZE
+        self._map[offset:offset + len(records)] = records
+
+        page_offset, page_size = _page_range(offset, len(records))
+        page_size = min(page_size, len(self._map) - page_offset)
+        self._map.flush(page_offset, page_size)
+        self.physical_bytes += page_size
+
+    def append(self, records: bytes) -> None:
+        """Write a batch of packed records, wrapping around when the end of
+        the file is reached, and then commit them in the header"""
+        view: memoryview = memoryview(records)
+        total: int = len(view) // RECORD_SIZE
+
+        # Only the newest records fit if the batch exceeds the capacity
+        if total > self.capacity:
+            view = view[(total - self.capacity) * RECORD_SIZE:]
+            total = self.capacity
+
+        # Stop exposing the oldest records before overwriting them
+        overwritten: int = self.count + total - self.capacity
+        if overwritten > 0:
+            self.count -= overwritten
+            self._write_header()
+
+        first: int = min(total, self.capacity - self.head)
+        self._write_records(self.head, view[:first * RECORD_SIZE])
+        if total > first:
+            self._write_records(0, view[first * RECORD_SIZE:])
+
+        self.head = (self.head + total) % self.capacity
+        self.count = min(self.count + total, self.capacity)
+        self._write_header()
+
+        self.logical_bytes += total * RECORD_SIZE
+        self.flushes += 1
+
+    def records(self) -> Iterator[tuple[float, float, int]]:
+        """Iterate the committed records, from the oldest to the newest"""
+        start: int = (self.head - self.count) % self.capacity
+        segments: list[tuple[int, int]] = [(start, min(self.count, self.capacity - start))]
+        if segments[0][1] < self.count:
+            segments.append((0, self.count - segments[0][1]))
+
+        view: memoryview = memoryview(self._map)
+        try:
+            for slot, size in segments:
+                offset: int = HEADER_SIZE + slot * RECORD_SIZE
+                yield from RECORD_FORMAT.iter_unpack(view[offset:offset + size * RECORD_SIZE])
+        finally:
+            view.release()
+
+    def close(self) -> None:
+        """Unmap the store file"""
+        self._map.close()
+
+##############################################################################
+#                              Public Functions                              #
+##############################################################################
+
+def open_store(path: str, capacity: int) -> Optional[RecordStore]:
+    """Open, or create, the record store at the given path.
+
+    Will return None if any error is found"""
+    store: Optional[RecordStore] = None
+
+    try:
+        store = RecordStore(path, capacity)
+    except Exception as err:
+        logging.error("Can't open the record store at %s:\n%s", path, err)
+
+    return store
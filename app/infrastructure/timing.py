@@ -0,0 +1,218 @@
+"""Handles the hot path instrumentation: latency histograms of the
+infrastructure calls, the domain readers and the API routes, and the CPU
+time spent by the service itself.
+
+Histograms have fixed logarithmic buckets, so recording a latency is a
+bisection and three additions, and percentiles are estimated from the
+buckets. Instrumentation can be switched off at runtime, leaving a single
+flag check per call"""
+
+import os
+import time
+import bisect
+import functools
+import collections
+import inspect
+
+from typing import Any, Callable, Optional
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+# Whether the latencies are recorded from startup
+TIMINGS_ENABLED: bool = os.environ.get("RPI_MON_TIMINGS", "1") == "1"
+
+# Upper bounds (seconds) of the buckets: 4 per power of 2, from 1us to ~70s
+BUCKET_BOUNDS: list[float] = [1e-6 * 2 ** (i / 4) for i in range(105)]
+
+PERCENTILES: list[int] = [50, 90, 99]
+
+# Seconds the CPU time rate is measured over, and seconds it must span before
+# being reported, as shorter spans are dominated by the startup
+CPU_WINDOW: float = 60
+CPU_MIN_SPAN: float = 10
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+class Histogram:
+    """Counts latencies (seconds) in fixed logarithmic buckets, along with
+    their sum and maximum. Latencies beyond the last bound go to an overflow
+    bucket"""
+
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts: list[int] = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count: int = 0
+        self.sum: float = 0
+        self.max: float = 0
+
+    def record(self, latency: float) -> None:
+        """Add a latency"""
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, latency)] += 1
+        self.count += 1
+        self.sum += latency
+        if latency > self.max:
+            self.max = latency
+
+    def percentile(self, percentile: int) -> float:
+        """Estimate the given percentile as the upper bound of its bucket,
+        never beyond the maximum. Returns -1 if nothing was recorded"""
+        if self.count == 0:
+            return -1
+
+        rank: float = percentile / 100 * self.count
+        seen: int = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(BUCKET_BOUNDS[index], self.max) if index < len(BUCKET_BOUNDS) else self.max
+
+        return self.max
+
+    def as_dict(self) -> dict[str, float]:
+        """Return the count, and the sum, percentiles and maximum in ms"""
+        summary: dict[str, float] = {"count": self.count, "sum_ms": self.sum * 1000}
+        for percentile in PERCENTILES:
+            summary[f"p{percentile}_ms"] = self.percentile(percentile) * 1000 if self.count else -1
+        summary["max_ms"] = self.max * 1000
+        return summary
+
+class TimingMiddleware:
+    """ASGI middleware recording the latency of every HTTP request, until
+    its response starts, keyed by method and route path. Streaming bodies
+    and the client transfer are not included"""
+
+    def __init__(self, app: Callable):
+        self.app: Callable = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if not _enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started: float = time.perf_counter()
+
+        async def timed_send(message: dict) -> None:
+            if message["type"] == "http.response.start":
+                route: Any = scope.get("route")
+                path: str = route.path if route is not None else "unmatched"
+                get_histogram(f"route {scope['method']} {path}").record(time.perf_counter() - started)
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+class CPUMeter:
+    """Measures the CPU time (seconds) of the process, forked commands
+    included, over a sliding window of marks"""
+
+    def __init__(self, window: float = CPU_WINDOW, min_span: float = CPU_MIN_SPAN):
+        self.window: float = window
+        self.min_span: float = min_span
+        self._marks: collections.deque[tuple[float, float]] = collections.deque()
+
+    def mark(self) -> None:
+        """Add the current CPU time, discarding the marks that are no longer
+        needed to cover the window"""
+        now: float = time.monotonic()
+        self._marks.append((now, process_cpu_time()))
+        while len(self._marks) > 2 and self._marks[1][0] <= now - self.window:
+            self._marks.popleft()
+
+    def per_minute(self) -> float:
+        """Return the CPU seconds spent per minute since the oldest mark.
+        Returns -1 until the marks span the minimum span"""
+        if not self._marks:
+            return -1
+
+        started, cpu_started = self._marks[0]
+        elapsed: float = time.monotonic() - started
+        if elapsed < self.min_span or elapsed <= 0:
+            return -1
+        return (process_cpu_time() - cpu_started) / elapsed * 60
+
+_enabled: bool = TIMINGS_ENABLED
+_histograms: dict[str, Histogram] = {}
+
+##############################################################################
+#                              Public Functions                              #
+##############################################################################
+
+def process_cpu_time() -> float:
+    """Return the user and system CPU seconds of the process and of its
+    terminated children"""
+    times: os.times_result = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+def enabled() -> bool:
+    """Whether latencies are being recorded"""
+    return _enabled
+
+def set_enabled(enable: bool) -> None:
+    """Switch the recording of latencies on or off"""
+    global _enabled
+    _enabled = enable
+
+def reset() -> None:
+    """Discard every recorded latency. Histograms are emptied in place, as
+    timed functions keep a reference to theirs"""
+    for histogram in _histograms.values():
+        histogram.__init__()
+
+def get_histogram(name: str) -> Histogram:
+    """Return the histogram of the given name, creating it if new"""
+    histogram: Optional[Histogram] = _histograms.get(name)
+    if histogram is None:
+        histogram = _histograms[name] = Histogram()
+    return histogram
+
+def summary() -> dict[str, dict[str, float]]:
+    """Return the summary of every histogram with latencies, by name"""
+    return {
+        name: histogram.as_dict()
+        for name, histogram in sorted(_histograms.items()) if histogram.count
+    }
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """Decorate a function, sync or async, recording its latency under the
+    given name while instrumentation is enabled, failures included"""
+    def decorator(func: Callable) -> Callable:
+        histogram: Histogram = get_histogram(name)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await func(*args, **kwargs)
+
+                started: float = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.record(time.perf_counter() - started)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+
+            started: float = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.record(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+##############################################################################
+#                              Shared Instance                               #
+##############################################################################
+
+cpu_meter: CPUMeter = CPUMeter()
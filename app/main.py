@@ -1,51 +1,422 @@
 """App main module"""
 
+import time
+import asyncio
+import inspect
 import logging
-from typing import Optional
-from fastapi import FastAPI, Query
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Hashable, Optional
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
-import app.app.cpu as app_cpu
-import app.app.memory as app_mem
-import app.app.disk as app_disk
-import app.app.network as app_net
+import app.app.registry as app_registry
+import app.app.sampler as app_sampler
+import app.app.history as app_history
+import app.app.persistence as app_persistence
+import app.app.summary as app_summary
+import app.app.streaming as app_streaming
+import app.app.metrics as app_metrics
+import app.app.caching as app_caching
+import app.app.rendering as app_rendering
+import app.app.fleet as app_fleet
+import app.app.export as app_export
+import app.infrastructure.fixtures as infra_fixtures
+import app.infrastructure.timing as infra_timing
+import app.infrastructure.profiler as infra_profiler
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 
-rpi_mon_api: FastAPI = FastAPI()
+persistent_history: Optional[app_persistence.PersistentHistory] = None
+replay: Optional[infra_fixtures.Replay] = None
+fleet: Optional[app_fleet.Fleet] = None
+exporter: Optional[app_export.PushExporter] = None
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """Run the background sampler while the API is being served, reloading and
+    persisting the history when a store is configured. When a fixture is
+    configured, its snapshots are stepped through on their recorded cadence.
+    When upstream instances are configured, they are scraped in the
+    background, and when a collector is configured, every sample is pushed to
+    it. Streamed and exported domains are never sampled as idle"""
+    global persistent_history, replay, fleet, exporter
+
+    replay = infra_fixtures.open_replay()
+    if replay is not None:
+        replay.start()
+
+    persistent_history = app_persistence.open_persistent_history(app_history.history)
+    if persistent_history is not None:
+        app_sampler.sampler.add_listener(persistent_history.record)
+        persistent_history.start()
+
+    app_sampler.sampler.add_listener(app_history.history.record)
+    app_sampler.sampler.add_listener(app_streaming.hub.publish)
+    app_sampler.sampler.add_listener(lambda _: infra_timing.cpu_meter.mark())
+    app_sampler.sampler.add_watcher(app_streaming.hub.domains)
+
+    exporter = app_export.open_exporter()
+    if exporter is not None:
+        app_sampler.sampler.add_listener(exporter.record)
+        app_sampler.sampler.add_watcher(app_sampler.sampler.intervals.keys)
+        exporter.start()
+
+    app_sampler.sampler.start()
+
+    fleet = app_fleet.open_fleet()
+    if fleet is not None:
+        fleet.start()
+
+    yield
+
+    if fleet is not None:
+        await fleet.stop()
+
+    await app_sampler.sampler.stop()
+
+    if exporter is not None:
+        await exporter.stop()
+
+    if persistent_history is not None:
+        await persistent_history.stop()
+        persistent_history.close()
+
+    if replay is not None:
+        await replay.stop()
+        replay.close()
+
+rpi_mon_api: FastAPI = FastAPI(lifespan=lifespan)
+rpi_mon_api.add_middleware(infra_timing.TimingMiddleware)
+
+def _sample_headers(sample: app_sampler.Sample) -> dict[str, str]:
+    """Expose when the served sample was taken and how old it is"""
+    return {
+        "X-Sample-Timestamp": f"{sample.timestamp:.3f}",
+        "X-Sample-Age": f"{sample.age:.3f}"
+    }
+
+def _cached_response(request: Request, resource: str, generation: int, timestamp: float,
+                     view: Hashable, build: Callable[[], Any],
+                     headers: Optional[dict[str, str]] = None) -> Response:
+    """Return the given view of a sample generation as raw JSON bytes, only
+    rendered by the first request, along with its caching headers. Returns
+    a 304 response if the client copy is already that generation"""
+    interval: float = app_sampler.sampler.intervals.get(resource, app_sampler.sampler.interval)
+    headers = {
+        **app_caching.cache_headers(generation, timestamp, interval),
+        **(headers or {})
+    }
+    if app_caching.is_not_modified(generation, timestamp,
+                                   request.headers.get("if-none-match"),
+                                   request.headers.get("if-modified-since")):
+        return Response(status_code=304, headers=headers)
+
+    body: bytes = app_rendering.responses.get(resource, generation, view, build)
+    return Response(body, media_type=app_rendering.MEDIA_TYPE, headers=headers)
 
 @rpi_mon_api.get("/")
 async def root():
     return {"message": "Not implemented"}
 
-@rpi_mon_api.get("/v1/cpu")
-async def cpu_avg():
-    """Read the system CPU Load information and return in dictionary format,
-    parsed to float. Ready to be returned as API response.
-    
-    Will return -1 for each load average if any error is found"""
-    return await app_cpu.read_cpu_info()
-
-@rpi_mon_api.get("/v1/mem")
-async def ram_info(unit: Optional[str] = Query('kB')):
-    """Read the system Memory information and return in dictionary format.
-    
-    Will return -1 for each memory amount if any error is found"""
-    return await app_mem.read_ram_info(unit)
-
-@rpi_mon_api.get("/v1/disk")
-async def disk_info(unit: Optional[str] = Query('kB')):
-    """Read the system storage information and return in dictionary format.
-    
-    Will return an empty dict if any error is found"""
-    return await app_disk.read_disks_info(unit)
-
-@rpi_mon_api.get("/v1/net")
-async def net_info(unit: Optional[str] = Query('kB')):
-    """Read the system network interfaces information and return in dictionary
-    format.
-    
-    Will return an empty dict if any error is found"""
-    return await app_net.read_net_info(unit)
+def _collector_endpoint(collector: app_registry.Collector) -> Callable:
+    """Build the route serving the latest sample of the given collector, with
+    a unit query parameter if it takes one, and a boolean query parameter
+    per option"""
+    async def endpoint(request: Request, unit: Optional[str] = None, **options: bool):
+        unit = app_rendering.normalize_unit(unit) if collector.units else None
+        sample: app_sampler.Sample = await app_sampler.sampler.get(collector.name)
+        return _cached_response(request, collector.name, sample.generation, sample.timestamp,
+                                (unit, *options.values()),
+                                lambda: app_registry.format_value(collector.name, sample.value, unit, **options),
+                                _sample_headers(sample))
+
+    parameters: list[inspect.Parameter] = [
+        inspect.Parameter("request", inspect.Parameter.POSITIONAL_OR_KEYWORD, annotation=Request)
+    ]
+    if collector.units:
+        parameters.append(inspect.Parameter("unit", inspect.Parameter.KEYWORD_ONLY,
+                                            default=Query('kB'), annotation=Optional[str]))
+    parameters.extend(
+        inspect.Parameter(option, inspect.Parameter.KEYWORD_ONLY, default=Query(False), annotation=bool)
+        for option in collector.options
+    )
+    endpoint.__signature__ = inspect.Signature(parameters)
+    endpoint.__name__ = f"{collector.name}_info"
+    return endpoint
+
+for _collector in app_registry.enabled().values():
+    rpi_mon_api.add_api_route(_collector.path, _collector_endpoint(_collector), methods=["GET"],
+                              description=_collector.description)
+
+@rpi_mon_api.get("/v1/collectors")
+async def collectors():
+    """Read the collector registry: the data sources, cost class and whether
+    every collector is enabled, along with its sampling interval and its
+    effective one, longer while nobody reads it (seconds)"""
+    sampler: app_sampler.Sampler = app_sampler.sampler
+    return {
+        name: {
+            **collector.as_dict(),
+            "interval": sampler.intervals.get(name),
+            "effective_interval": sampler.effective_interval(name) if name in sampler.intervals else None
+        }
+        for name, collector in app_registry.collectors.items()
+    }
+
+@rpi_mon_api.get("/v1/sampler")
+async def sampler_info():
+    """Read the sampling schedule: the own and effective interval of every
+    domain, whether it is idle or watched and the seconds since its last read,
+    along with the CPU seconds the service spends per minute"""
+    sampler: app_sampler.Sampler = app_sampler.sampler
+    return {
+        "idle_after": sampler.idle_after,
+        "idle_interval": sampler.idle_interval,
+        "cpu_seconds_per_minute": infra_timing.cpu_meter.per_minute(),
+        "collectors": sampler.schedule()
+    }
+
+@rpi_mon_api.get("/v1/all")
+async def all_info(request: Request, unit: Optional[str] = Query('kB')):
+    """Read the latest CPU, Memory, storage and network samples in a single
+    document, with the timestamp, timing and error of every collector. Every
+    collector is sampled on its own interval, so the samples may be taken
+    up to the longest interval apart. A collector slower than the deadline
+    is abandoned and reports its previous sample, if any.
+
+    Will return None for a domain that was never collected"""
+    unit = app_rendering.normalize_unit(unit)
+    sampler: app_sampler.Sampler = app_sampler.sampler
+    samples = await sampler.get_all()
+    generation: int = sampler.generation
+    status = sampler.status
+    timestamp: float = max((sample.timestamp for sample in samples.values()), default=0)
+
+    return _cached_response(request, "all", generation, timestamp, unit,
+                            lambda: app_summary.format_all_info(samples, status, generation, unit))
+
+def _subscribe(domains: Optional[str], interval: float,
+               unit: str) -> app_streaming.Subscription:
+    """Open a stream subscription from the request parameters.
+
+    Will raise HTTPException if the domains are unknown or the maximum
+    number of subscribers is reached"""
+    try:
+        parsed: frozenset[str] = app_streaming.parse_domains(domains)
+    except ValueError as err:
+        raise HTTPException(status_code=422, detail=str(err)) from err
+
+    subscription: Optional[app_streaming.Subscription] = \
+        app_streaming.hub.subscribe(parsed, interval, unit)
+    if subscription is None:
+        raise HTTPException(status_code=503, detail="Too many stream subscribers")
+
+    app_sampler.sampler.demand(subscription.domains)
+    return subscription
+
+async def _sse_events(subscription: app_streaming.Subscription) -> AsyncIterator[str]:
+    """Yield every frame of the given subscription as a Server-Sent Event"""
+    try:
+        while True:
+            frame = await subscription.next_frame()
+            yield f"event: metrics\ndata: {app_streaming.format_frame(frame, subscription.unit)}\n\n"
+    finally:
+        app_streaming.hub.unsubscribe(subscription)
+
+@rpi_mon_api.get("/v1/stream")
+async def stream_sse(domains: Optional[str] = Query(None),
+                     interval: float = Query(app_sampler.SAMPLE_INTERVAL, ge=0),
+                     unit: Optional[str] = Query('kB')):
+    """Stream the given comma separated domains (all by default) as
+    Server-Sent Events, at most once per interval (seconds). Samples taken
+    while the client is behind are coalesced into the next event"""
+    subscription: app_streaming.Subscription = _subscribe(domains, interval, unit)
+    return StreamingResponse(_sse_events(subscription), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+async def _ws_receive_updates(websocket: WebSocket,
+                              subscription: app_streaming.Subscription) -> None:
+    """Apply the subscription changes sent by the client until it disconnects.
+    Invalid messages, e.g. not JSON or binary, are answered with an error"""
+    while True:
+        try:
+            message = await websocket.receive_json()
+            subscription.update(message if isinstance(message, dict) else {})
+            app_sampler.sampler.demand(subscription.domains)
+        except (KeyError, TypeError, ValueError) as err:
+            await websocket.send_json({"error": f"Invalid message: {err}"})
+
+@rpi_mon_api.websocket("/v1/ws")
+async def stream_ws(websocket: WebSocket, domains: Optional[str] = Query(None),
+                    interval: float = Query(app_sampler.SAMPLE_INTERVAL, ge=0),
+                    unit: Optional[str] = Query('kB')):
+    """Stream the given comma separated domains (all by default) over a
+    WebSocket, at most once per interval (seconds). The client can change
+    them by sending {"domains": [...], "interval": ..., "unit": ...}. A client
+    not receiving a frame within the send timeout is disconnected"""
+    try:
+        subscription: app_streaming.Subscription = _subscribe(domains, interval, unit)
+    except HTTPException as err:
+        await websocket.close(code=1008 if err.status_code == 422 else 1013, reason=err.detail)
+        return
+
+    await websocket.accept()
+    receiver: asyncio.Task = asyncio.create_task(_ws_receive_updates(websocket, subscription))
+    try:
+        while True:
+            next_frame: asyncio.Task = asyncio.create_task(subscription.next_frame())
+            await asyncio.wait({receiver, next_frame}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                next_frame.cancel()
+                error: Optional[BaseException] = receiver.exception()
+                if error is not None and not isinstance(error, WebSocketDisconnect):
+                    logging.error("Unexpected error receiving stream updates:\n%s", error)
+                    await websocket.close(code=1011, reason="Internal error")
+                break
+
+            payload: str = app_streaming.format_frame(next_frame.result(), subscription.unit)
+            await asyncio.wait_for(websocket.send_text(payload), app_streaming.STREAM_SEND_TIMEOUT)
+
+    except asyncio.TimeoutError:
+        app_streaming.hub.drop(subscription)
+        await websocket.close(code=1008, reason="Too slow")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        # Retrieve the receiver outcome, e.g. the client disconnection
+        await asyncio.gather(receiver, return_exceptions=True)
+        app_streaming.hub.unsubscribe(subscription)
+
+@rpi_mon_api.get("/v1/{domain}/history")
+async def history(domain: str, since: Optional[float] = Query(None),
+                  until: Optional[float] = Query(None), step: float = Query(0, ge=0),
+                  unit: Optional[str] = Query('kB'), agg: str = Query('avg')):
+    """Read the history of every series of the given domain (cpu, mem, disk or
+    net) between since and until, as epoch seconds, defaulting to the last
+    hour. With a step in seconds, points are aggregated (avg, min, max or
+    last) per step, from the coarsest rollup tier satisfying it.
+
+    Will return an empty series list if nothing has been sampled yet"""
+    if domain not in app_history.SERIES_FIELDS:
+        raise HTTPException(status_code=404, detail=f"Unknown domain: {domain}")
+    if agg not in app_history.AGGREGATIONS:
+        raise HTTPException(status_code=422, detail=f"Unknown aggregation: {agg}")
+
+    until = until if until is not None else time.time()
+    since = since if since is not None else until - 3600
+
+    return {
+        "since": since,
+        "until": until,
+        "step": step,
+        "agg": agg,
+        "series": app_history.history.query(domain, since, until, step, unit, agg)
+    }
+
+@rpi_mon_api.get("/metrics")
+async def metrics(request: Request):
+    """Expose the latest sample of every domain in the Prometheus text
+    format. The text is rendered once per sampling round"""
+    sampler: app_sampler.Sampler = app_sampler.sampler
+    samples = await sampler.get_all()
+    timestamp: float = max((sample.timestamp for sample in samples.values()), default=0)
+
+    headers: dict[str, str] = app_caching.cache_headers(sampler.generation, timestamp, sampler.interval)
+    if app_caching.is_not_modified(sampler.generation, timestamp,
+                                   request.headers.get("if-none-match"),
+                                   request.headers.get("if-modified-since")):
+        return Response(status_code=304, headers=headers)
+
+    return Response(app_metrics.metrics_cache.get(sampler),
+                    media_type=app_metrics.CONTENT_TYPE, headers=headers)
+
+@rpi_mon_api.get("/v1/fleet")
+async def fleet_info(domains: Optional[str] = Query(None)):
+    """Read the last /v1/all document scraped from every upstream instance,
+    only with the given comma separated domains (all by default), labelled
+    with the host, whether it is up, the scrape latency and the staleness
+    (seconds since the last successful scrape).
+
+    Will return data None for a host never scraped successfully"""
+    if fleet is None:
+        return {"enabled": False}
+
+    try:
+        parsed: frozenset[str] = app_streaming.parse_domains(domains)
+    except ValueError as err:
+        raise HTTPException(status_code=422, detail=str(err)) from err
+
+    return fleet.view(parsed)
+
+@rpi_mon_api.get("/v1/export")
+async def export_stats():
+    """Read the push exporter queue depth and delivery counters: lines and
+    batches pending, queued, spooled, sent and dropped"""
+    if exporter is None:
+        return {"enabled": False}
+
+    return exporter.stats()
+
+def _timings() -> dict:
+    """Return whether instrumentation is enabled and every histogram"""
+    return {"enabled": infra_timing.enabled(), "timings": infra_timing.summary()}
+
+@rpi_mon_api.get("/debug/timings")
+async def timings():
+    """Read the latency histograms (count, sum, p50, p90, p99 and max in
+    milliseconds) of every infrastructure call, domain reader and route"""
+    return _timings()
+
+@rpi_mon_api.put("/debug/timings")
+async def switch_timings(enabled: bool = Query(...)):
+    """Switch the recording of latencies on or off, keeping the histograms"""
+    infra_timing.set_enabled(enabled)
+    return _timings()
+
+@rpi_mon_api.delete("/debug/timings")
+async def reset_timings():
+    """Discard every recorded latency"""
+    infra_timing.reset()
+    return _timings()
+
+@rpi_mon_api.get("/debug/profile")
+async def profile(request: Request,
+                  seconds: float = Query(5, gt=0, le=infra_profiler.PROFILE_MAX_SECONDS),
+                  frequency: float = Query(100, gt=0, le=infra_profiler.PROFILE_MAX_FREQUENCY),
+                  format: str = Query('collapsed')):
+    """Sample the event loop stacks for the given seconds at the given
+    frequency (Hz), returning them in collapsed format for flamegraph tools,
+    or as a JSON summary. Stacks are rooted at collector, event_loop or idle.
+    Requires the admin bearer token"""
+    if not infra_profiler.is_authorized(request.headers.get("authorization")):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    if format not in ("collapsed", "json"):
+        raise HTTPException(status_code=422, detail=f"Unknown format: {format}")
+
+    try:
+        result: infra_profiler.Profile = await infra_profiler.profile(seconds, frequency)
+    except RuntimeError as err:
+        raise HTTPException(status_code=409, detail=str(err)) from err
+
+    if format == "json":
+        return result.as_dict()
+
+    return PlainTextResponse(result.collapsed(), headers={
+        "X-Profile-Samples": str(result.samples),
+        "X-Profile-Overhead": f"{result.overhead:.4f}",
+        **{f"X-Profile-{category.replace('_', '-').title()}": str(count)
+           for category, count in result.categories.items()}
+    })
+
+@rpi_mon_api.get("/v1/store")
+async def store_stats():
+    """Read the history store write statistics: bytes written, bytes synced
+    to disk, write amplification and bytes synced per hour"""
+    if persistent_history is None:
+        return {"enabled": False}
+
+    return persistent_history.stats()
@@ -0,0 +1,35 @@
+"""
+This module benchmarks the disk usage collection, comparing the df command
+based path against the native mount table and statvfs one
+"""
+import asyncio
+import timeit
+
+import context
+
+ROUNDS: int = 200
+
+loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+
+def bench_df() -> None:
+    """Collect and parse disk usage through the df command"""
+    loop.run_until_complete(context.app.infrastructure.cmd.get_disk_usage())
+
+def bench_native() -> None:
+    """Collect disk usage through the mount table and statvfs"""
+    loop.run_until_complete(context.app.infrastructure.files.get_disk_usage())
+
+def main() -> None:
+    """Run every benchmark and print the mean time per collection"""
+    results: dict[str, float] = {
+        "df": min(timeit.repeat(bench_df, number=ROUNDS, repeat=3)) / ROUNDS,
+        "native": min(timeit.repeat(bench_native, number=ROUNDS, repeat=3)) / ROUNDS
+    }
+
+    for name, seconds in results.items():
+        print(f"{name:<8} {seconds * 1e6:>10.1f} us/collection")
+
+    print(f"speedup  {results['df'] / results['native']:>10.1f}x")
+
+if __name__ == "__main__":
+    main()
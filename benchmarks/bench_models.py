@@ -0,0 +1,117 @@
+"""
+This module benchmarks the memory and construction time of 100k instances of
+every domain model, comparing the previous dataclasses, with a per instance
+__dict__ and the RAMRawInfo assignment hook, against the slotted models
+"""
+import timeit
+import tracemalloc
+import dataclasses as dc
+from typing import Callable, Optional
+
+import context
+
+INSTANCES: int = 100_000
+
+domain = context.app.domain
+
+##############################################################################
+#                              Previous Models                               #
+##############################################################################
+
+@dc.dataclass
+class LegacyRAMRawInfo:
+    mem_total    : int = -1
+    mem_free     : int = -1
+    mem_ava      : int = -1
+    buffers      : int = -1
+    cached       : int = -1
+    swap_total   : int = -1
+    swap_free    : int = -1
+    dirty        : int = -1
+    writeback    : int = -1
+    slab         : int = -1
+    mem_used     : int = -1
+    swap_used    : int = -1
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in ['mem_total', 'mem_ava']:
+            self.mem_used = self.mem_total - self.mem_ava
+
+@dc.dataclass
+class LegacyPartitionInfo:
+    mount_point : str = ""
+    fs_type     : str = ""
+    total       : int = -1
+    used        : int = -1
+    free        : int = -1
+
+@dc.dataclass
+class LegacyIfaceInfo:
+    rx_pack      : int = -1
+    rx_bytes     : int = -1
+    rx_err       : int = -1
+    rx_drop      : int = -1
+    tx_pack      : int = -1
+    tx_bytes     : int = -1
+    tx_err       : int = -1
+    tx_drop      : int = -1
+    bit_rate     : str = "- Mb/s"
+    link_quality : float = -1
+    signal_level : float = -1
+    oper_state   : str = ""
+    rates        : Optional[object] = None
+
+@dc.dataclass
+class LegacyCPULoadAvgs:
+    m1:     float = -1
+    m5:     float = -1
+    m15:    float = -1
+    usage:      Optional[object] = None
+    cores:      dict = dc.field(default_factory=dict)
+    ctxt_rate:  float = -1
+    fork_rate:  float = -1
+
+# Field values are shared by every instance, so only the instances are measured
+MODELS: dict[str, tuple[Callable[[], object], Callable[[], object]]] = {
+    "RAMRawInfo": (
+        lambda: LegacyRAMRawInfo(mem_total=4096, mem_free=1024, mem_ava=2048),
+        lambda: domain.memory.RAMRawInfo(mem_total=4096, mem_free=1024, mem_ava=2048)
+    ),
+    "PartitionInfo": (
+        lambda: LegacyPartitionInfo("/", "ext4", 4096, 1024, 3072),
+        lambda: domain.disk.PartitionInfo("/", "ext4", 4096, 1024, 3072)
+    ),
+    "IfaceInfo": (
+        lambda: LegacyIfaceInfo(1024, 1024, 0, 0, 1024, 1024, 0, 0),
+        lambda: domain.network.IfaceInfo(1024, 1024, 0, 0, 1024, 1024, 0, 0)
+    ),
+    "CPULoadAvgs": (
+        lambda: LegacyCPULoadAvgs(0.25, 0.5, 0.75),
+        lambda: domain.cpu.CPULoadAvgs(0.25, 0.5, 0.75)
+    )
+}
+
+def _memory(factory: Callable[[], object]) -> float:
+    """Memory in MiB held by the instances built by the given factory"""
+    tracemalloc.start()
+    instances: list[object] = [factory() for _ in range(INSTANCES)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del instances
+    return size / 1024 ** 2
+
+def _time(factory: Callable[[], object]) -> float:
+    """Best time in milliseconds to build the instances"""
+    return min(timeit.repeat(lambda: [factory() for _ in range(INSTANCES)], number=1, repeat=3)) * 1e3
+
+def main() -> None:
+    """Run every benchmark and print the memory and time of every model"""
+    print(f"{INSTANCES} instances")
+    print(f"{'model':<14} {'dict MiB':>9} {'slots MiB':>10} {'dict ms':>8} {'slots ms':>9}")
+    for model, (legacy, slotted) in MODELS.items():
+        print(f"{model:<14} {_memory(legacy):>9.1f} {_memory(slotted):>10.1f} "
+              f"{_time(legacy):>8.1f} {_time(slotted):>9.1f}")
+
+if __name__ == "__main__":
+    main()
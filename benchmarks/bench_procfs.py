@@ -0,0 +1,58 @@
+"""
+This module micro benchmarks every procfs file read by the infrastructure
+layer, comparing opening and decoding the file on each read against the
+persistent readers rereading into a reusable buffer
+"""
+import asyncio
+import timeit
+from typing import Awaitable, Callable
+
+import context
+
+ROUNDS: int = 2000
+
+loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+
+files = context.app.infrastructure.files
+
+PROC_FILES: dict[str, Callable[[], Awaitable]] = {
+    files.CPU_INFO_FILEPATH: files.get_cpu_cores,
+    files.CPU_PROC_FILEPATH: files.get_cpu_load_avg,
+    files.MEM_INFO_FILEPATH: files.get_mem_info,
+    files.NET_INFO_FILEPATH: files.get_net_info
+}
+
+def _reopen(path: str) -> Callable[[], None]:
+    """Read the file as text, opening it on every read"""
+    def bench() -> None:
+        with open(path, 'r', encoding='utf8') as reader:
+            for _ in reader:
+                pass
+    return bench
+
+def _persistent(path: str) -> Callable[[], None]:
+    """Read the file through its persistent reader"""
+    reader = files.ProcFileReader(path)
+    def bench() -> None:
+        reader.read()
+    return bench
+
+def _collect(reader: Callable[[], Awaitable]) -> Callable[[], None]:
+    """Read and parse the file through the public infrastructure function"""
+    def bench() -> None:
+        loop.run_until_complete(reader())
+    return bench
+
+def _time(bench: Callable[[], None]) -> float:
+    """Best mean time in microseconds of the given benchmark"""
+    return min(timeit.repeat(bench, number=ROUNDS, repeat=3)) / ROUNDS * 1e6
+
+def main() -> None:
+    """Run every benchmark and print the mean time per read"""
+    print(f"{'file':<16} {'reopen':>10} {'persistent':>12} {'parsed':>10}  (us/read)")
+    for path, reader in PROC_FILES.items():
+        print(f"{path:<16} {_time(_reopen(path)):>10.1f} "
+              f"{_time(_persistent(path)):>12.1f} {_time(_collect(reader)):>10.1f}")
+
+if __name__ == "__main__":
+    main()
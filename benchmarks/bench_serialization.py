@@ -0,0 +1,69 @@
+"""
+This module benchmarks the per request serialization of every endpoint,
+comparing FastAPI encoding the formatted dictionaries against rendering them
+once with the fast JSON encoder and serving the cached bytes
+"""
+import asyncio
+import timeit
+from typing import Any, Callable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import context
+
+ROUNDS: int = 2000
+
+loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+
+app_layer = context.app.app
+rendering = app_layer.rendering
+
+def _endpoints(samples: dict) -> dict[str, Callable[[str], Any]]:
+    """Document builders of every endpoint, given the unit"""
+    return {
+        "/v1/cpu": lambda _: app_layer.cpu.format_cpu_info(samples["cpu"].value),
+        "/v1/mem": lambda unit: app_layer.memory.format_ram_info(samples["mem"].value, unit),
+        "/v1/disk": lambda unit: app_layer.disk.format_disks_info(samples["disk"].value, unit),
+        "/v1/net": lambda unit: app_layer.network.format_net_info(samples["net"].value, unit, True)
+    }
+
+def _fastapi(build: Callable[[str], Any]) -> Callable[[], None]:
+    """Format, encode and render the response as FastAPI does for a dict"""
+    def bench() -> None:
+        for unit in rendering.UNITS:
+            JSONResponse(jsonable_encoder(build(unit)))
+    return bench
+
+def _render(build: Callable[[str], Any]) -> Callable[[], None]:
+    """Format and render the response with the fast JSON encoder"""
+    def bench() -> None:
+        for unit in rendering.UNITS:
+            rendering.dumps(build(unit))
+    return bench
+
+def _cached(build: Callable[[str], Any]) -> Callable[[], None]:
+    """Serve the cached bytes of an already rendered sample"""
+    cache = rendering.ResponseCache()
+    def bench() -> None:
+        for unit in rendering.UNITS:
+            cache.get("bench", 1, unit, lambda: build(unit))
+    return bench
+
+def _time(bench: Callable[[], None]) -> float:
+    """Best mean time in microseconds per request of the given benchmark"""
+    return min(timeit.repeat(bench, number=ROUNDS, repeat=3)) / ROUNDS / len(rendering.UNITS) * 1e6
+
+def main() -> None:
+    """Run every benchmark and print the mean time per request"""
+    sampler = app_layer.sampler.Sampler(interval=60)
+    samples: dict = dict(loop.run_until_complete(sampler.get_all()))
+
+    print(f"JSON encoder: {'orjson' if rendering.orjson is not None else 'json'}")
+    print(f"{'endpoint':<10} {'fastapi':>10} {'render':>10} {'cached':>10}  (us/request)")
+    for endpoint, build in _endpoints(samples).items():
+        print(f"{endpoint:<10} {_time(_fastapi(build)):>10.1f} "
+              f"{_time(_render(build)):>10.1f} {_time(_cached(build)):>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+This module runs the benchmark suite of the infrastructure readers, the
+parsers and the API endpoints, the latter through an in-process ASGI client.
+
+Every benchmark reports its latency percentiles and the memory it allocates
+per call. Results are saved as JSON and compared against a stored baseline,
+flagging every benchmark whose median latency regressed beyond a threshold.
+
+e.g.
+    python benchmarks/bench_suite.py --save-baseline
+    python benchmarks/bench_suite.py --filter parser
+    python benchmarks/bench_suite.py --fixture /tmp/fixture
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tracemalloc
+import dataclasses as dc
+from typing import Any, Awaitable, Callable, Optional, Union
+
+import httpx
+
+import context
+
+import app.main as main
+
+##############################################################################
+#                                 Constants                                  #
+##############################################################################
+
+RESULTS_DIRPATH: str = os.path.join(os.path.dirname(__file__), "results")
+BASELINE_FILEPATH: str = os.path.join(RESULTS_DIRPATH, "baseline.json")
+
+ITERATIONS: int = 500
+WARMUP: int = 20
+# Calls traced to measure the allocations, tracing slows every call down
+ALLOCATION_CALLS: int = 20
+# Relative increase of the median latency reported as a regression
+THRESHOLD: float = 0.2
+
+DF_OUTPUT: str = """Filesystem     1K-blocks     Used Available Use% Mounted on
+/dev/root       30450732 12345678  16818954  43% /
+devtmpfs          340460        0    340460   0% /dev
+tmpfs             472684        0    472684   0% /dev/shm
+tmpfs             189076     1000    188076   1% /run
+/dev/mmcblk0p1    261108    51390    209718  20% /boot
+/dev/sda1      976285652 34567890 941717762   4% /media/usb
+"""
+
+IWCONFIG_OUTPUT: str = """wlan0     IEEE 802.11  ESSID:"network"
+          Mode:Managed  Frequency:5.18 GHz  Access Point: 00:11:22:33:44:55
+          Bit Rate=433.3 Mb/s   Tx-Power=31 dBm
+          Retry short limit:7   RTS thr:off   Fragment thr:off
+          Power Management:on
+          Link Quality=70/70  Signal level=-40 dBm
+"""
+
+PROC_NET_LINE: bytes = \
+    b"  eth0: 123456789  654321    0    3    0     0          0      1234 987654321  456789    0    0    0     0       0          0"
+
+PROC_MEM_LINE: bytes = b"MemAvailable:     717680 kB"
+
+##############################################################################
+#                                Data Model                                  #
+##############################################################################
+
+@dc.dataclass
+class Benchmark:
+    """Models a benchmark, a sync or async function without arguments"""
+    name    : str
+    group   : str
+    call    : Callable[[], Union[Any, Awaitable[Any]]]
+    is_async: bool = False
+
+@dc.dataclass
+class Result:
+    """Models the latency percentiles (microseconds) of a benchmark, and the
+    peak memory (bytes) and retained memory blocks it allocates per call"""
+    name            : str
+    group           : str
+    iterations      : int
+    mean_us         : float
+    min_us          : float
+    max_us          : float
+    p50_us          : float
+    p90_us          : float
+    p99_us          : float
+    alloc_peak_bytes: float
+    alloc_blocks    : float
+
+##############################################################################
+#                                 Aux Functions                              #
+##############################################################################
+
+def _percentile(sorted_values: list[float], percentile: int) -> float:
+    """Return the given percentile of the sorted values, nearest rank"""
+    rank: int = max(round(percentile / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+async def _call(benchmark: Benchmark) -> None:
+    """Run the benchmark once"""
+    if benchmark.is_async:
+        await benchmark.call()
+    else:
+        benchmark.call()
+
+async def _allocations(benchmark: Benchmark) -> tuple[float, float]:
+    """Trace a few calls of the benchmark and return the peak bytes and the
+    retained blocks allocated per call"""
+    peak: int = 0
+    blocks: int = 0
+
+    tracemalloc.start()
+    for _ in range(ALLOCATION_CALLS):
+        before: tracemalloc.Snapshot = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        await _call(benchmark)
+        _, call_peak = tracemalloc.get_traced_memory()
+        peak += call_peak - baseline
+        blocks += sum(stat.count_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    tracemalloc.stop()
+
+    return peak / ALLOCATION_CALLS, blocks / ALLOCATION_CALLS
+
+async def _measure(benchmark: Benchmark, iterations: int,
+                   overhead: tuple[float, float] = (0, 0)) -> Result:
+    """Time every call of the benchmark, and trace the allocations of a few
+    calls apart, so tracing does not distort the latencies. The tracing
+    overhead is subtracted from the allocations"""
+    for _ in range(WARMUP):
+        await _call(benchmark)
+
+    latencies: list[float] = []
+    for _ in range(iterations):
+        started: int = time.perf_counter_ns()
+        await _call(benchmark)
+        latencies.append((time.perf_counter_ns() - started) / 1000)
+
+    peak, blocks = await _allocations(benchmark)
+
+    latencies.sort()
+    return Result(
+        name=benchmark.name,
+        group=benchmark.group,
+        iterations=iterations,
+        mean_us=sum(latencies) / len(latencies),
+        min_us=latencies[0],
+        max_us=latencies[-1],
+        p50_us=_percentile(latencies, 50),
+        p90_us=_percentile(latencies, 90),
+        p99_us=_percentile(latencies, 99),
+        alloc_peak_bytes=max(peak - overhead[0], 0),
+        alloc_blocks=max(blocks - overhead[1], 0)
+    )
+
+def _benchmarks(client: httpx.AsyncClient) -> list[Benchmark]:
+    """Build the benchmarks of every infrastructure reader, parser and
+    endpoint"""
+    files = context.app.infrastructure.files
+    cmd = context.app.infrastructure.cmd
+
+    benchmarks: list[Benchmark] = [
+        Benchmark("files.get_cpu_load_avg", "reader", files.get_cpu_load_avg, True),
+        Benchmark("files.get_cpu_stat", "reader", files.get_cpu_stat, True),
+        Benchmark("files.get_mem_info", "reader", files.get_mem_info, True),
+        Benchmark("files.get_net_info", "reader", files.get_net_info, True),
+        Benchmark("files.get_disk_usage", "reader", files.get_disk_usage, True),
+        Benchmark("cmd.get_disk_usage", "reader", cmd.get_disk_usage, True),
+        Benchmark("cmd.parse_df_output", "parser", lambda: cmd.parse_df_output(DF_OUTPUT)),
+        Benchmark("cmd.parse_net_output", "parser", lambda: cmd.parse_net_output(IWCONFIG_OUTPUT)),
+        Benchmark("files._proc_net_string", "parser", lambda: files._proc_net_string(PROC_NET_LINE)),
+        Benchmark("files._process_mem_string", "parser", lambda: files._process_mem_string(PROC_MEM_LINE))
+    ]
+
+    for path in ["/v1/cpu", "/v1/mem", "/v1/disk", "/v1/net?rates=true", "/v1/all", "/metrics"]:
+        benchmarks.append(Benchmark(f"GET {path}", "endpoint", lambda path=path: client.get(path), True))
+
+    return benchmarks
+
+def _load(path: str) -> Optional[dict]:
+    """Load saved results, returning None if they do not exist"""
+    try:
+        with open(path, 'r', encoding='utf8') as results_reader:
+            return json.load(results_reader)
+    except FileNotFoundError:
+        return None
+
+def _save(path: str, results: list[Result]) -> None:
+    """Save the results along with the machine they were taken on"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf8') as results_writer:
+        json.dump({
+            "timestamp": time.time(),
+            "machine": platform.machine(),
+            "python": platform.python_version(),
+            "results": [dc.asdict(result) for result in results]
+        }, results_writer, indent=2)
+
+def _report(results: list[Result], baseline: Optional[dict], threshold: float) -> list[str]:
+    """Print the results, compared against the baseline if any, and return
+    the names of the benchmarks that regressed"""
+    previous: dict[str, dict] = {
+        result["name"]: result for result in (baseline or {}).get("results", [])
+    }
+    regressions: list[str] = []
+
+    print(f"{'benchmark':<28} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} "
+          f"{'peak B':>9} {'blocks':>7} {'vs base':>8}")
+    for result in results:
+        change: str = ""
+        if result.name in previous and previous[result.name]["p50_us"] > 0:
+            ratio: float = result.p50_us / previous[result.name]["p50_us"] - 1
+            change = f"{ratio:+.0%}"
+            if ratio > threshold:
+                change += " !"
+                regressions.append(result.name)
+
+        print(f"{result.name:<28} {result.p50_us:>9.1f} {result.p90_us:>9.1f} {result.p99_us:>9.1f} "
+              f"{result.alloc_peak_bytes:>9.0f} {result.alloc_blocks:>7.1f} {change:>8}")
+
+    return regressions
+
+##############################################################################
+#                              Public Functions                              #
+##############################################################################
+
+async def run(iterations: int = ITERATIONS, name_filter: str = "",
+              fixture_dir: str = "") -> list[Result]:
+    """Run every benchmark matching the filter, with the API served in
+    process, and return their results. With a fixture directory, its first
+    snapshot is read instead of the live system.
+
+    The background sampler is stopped while measuring, so its rounds do not
+    compete with the benchmarks: endpoints serve the samples taken on their
+    first read, as they do between two rounds"""
+    results: list[Result] = []
+    replay = context.app.infrastructure.fixtures.open_replay(fixture_dir)
+    transport: httpx.ASGITransport = httpx.ASGITransport(app=main.rpi_mon_api)
+    overhead: tuple[float, float] = await _allocations(Benchmark("noop", "", lambda: None))
+
+    async with main.lifespan(main.rpi_mon_api):
+        await main.app_sampler.sampler.stop()
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for benchmark in _benchmarks(client):
+                if name_filter in benchmark.name or name_filter == benchmark.group:
+                    results.append(await _measure(benchmark, iterations, overhead))
+
+    if replay is not None:
+        replay.close()
+
+    return results
+
+def main_cli() -> int:
+    """Run the suite, save the results and compare them against the
+    baseline. Returns 1 if any benchmark regressed"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--filter", default="", help="benchmark name substring or group")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIRPATH, "latest.json"))
+    parser.add_argument("--baseline", default=BASELINE_FILEPATH)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="relative p50 increase reported as a regression")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--fixture", default="", help="recorded fixture directory read instead of /proc and /sys")
+    args = parser.parse_args()
+
+    results: list[Result] = asyncio.run(run(args.iterations, args.filter, args.fixture))
+
+    baseline: Optional[dict] = None if args.save_baseline else _load(args.baseline)
+    regressions: list[str] = _report(results, baseline, args.threshold)
+
+    _save(args.output, results)
+    if args.save_baseline:
+        _save(args.baseline, results)
+        print(f"Baseline saved at {args.baseline}")
+    elif baseline is None:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to store one")
+
+    if regressions:
+        print(f"Regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,31 @@
+"""
+This module records procfs/sysfs snapshots of the live system into a fixture
+directory, to be replayed later by the API or the benchmark suite on any
+machine.
+
+e.g.
+    python benchmarks/record_fixture.py /tmp/fixture --count 60 --interval 1
+    python benchmarks/bench_suite.py --fixture /tmp/fixture
+"""
+import sys
+import argparse
+
+import context
+
+fixtures = context.app.infrastructure.fixtures
+
+def main() -> int:
+    """Record the fixture given on the command line"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixture_dir")
+    parser.add_argument("--count", type=int, default=60, help="snapshots to record")
+    parser.add_argument("--interval", type=float, default=1, help="seconds between snapshots")
+    parser.add_argument("--source-root", default="/", help="root of the recorded proc and sys trees")
+    args = parser.parse_args()
+
+    total: int = fixtures.record(args.fixture_dir, args.count, args.interval, args.source_root)
+    print(f"{total} snapshots at {args.fixture_dir}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,10 @@
 """
 This module contains the tests for the App layer
 """
+import os
+import json
+import time
+import asyncio
 import unittest
 from unittest.mock import patch
 
@@ -51,10 +55,11 @@ class TestAppLayer(unittest.IsolatedAsyncioTestCase):
                 "mem_ava": 95 * (1024 ** unit_order),
                 "mem_used": 5 * (1024 ** unit_order)
             }
-            ram: context.app.domain.memory.RAMRawInfo = context.app.domain.memory.RAMRawInfo()
-            ram.mem_total = ram_raw['mem_total']
-            ram.mem_free = ram_raw['mem_free']
-            ram.mem_ava = ram_raw['mem_ava']
+            ram: context.app.domain.memory.RAMRawInfo = context.app.domain.memory.RAMRawInfo(
+                mem_total=ram_raw['mem_total'],
+                mem_free=ram_raw['mem_free'],
+                mem_ava=ram_raw['mem_ava']
+            )
 
             return ram
 
@@ -154,3 +159,617 @@ class TestAppLayer(unittest.IsolatedAsyncioTestCase):
                 for iface_name, iface_data in raw_network_data.items():
                     for key in expected_keys:
                         assert key in iface_data
+
+    async def test_sampler_shares_snapshot(self):
+        """
+        This method tests that the sampler collects once and serves every
+        reader from the same immutable sample
+        """
+        calls: dict[str, int] = {"cpu": 0, "mem": 0}
+
+        async def read_cpu_mock() -> context.app.domain.cpu.CPULoadAvgs:
+            calls["cpu"] += 1
+            return context.app.domain.cpu.CPULoadAvgs(m1=1, m5=2, m15=3)
+
+        async def read_mem_mock() -> context.app.domain.memory.RAMRawInfo:
+            calls["mem"] += 1
+            raise RuntimeError("mem not available")
+
+        sampler = context.app.app.sampler.Sampler(
+            collectors={"cpu": read_cpu_mock, "mem": read_mem_mock},
+            interval=60
+        )
+
+        first = await sampler.get("cpu")
+        for _ in range(40):
+            sample = await sampler.get("cpu")
+            assert sample is first, "Readers should share the same sample"
+
+        assert calls["cpu"] == 1, f"Unexpected number of collections: {calls['cpu']}"
+        assert first.generation == 1, f"Unexpected generation: {first.generation}"
+        assert first.value.m5 == 2, f"Unexpected sampled value: {first.value}"
+        assert first.age >= 0, f"Unexpected sample age: {first.age}"
+        assert "mem" not in sampler.samples, "Failing collectors must not publish"
+
+        await sampler.sample()
+        assert sampler.samples["cpu"].generation == 2, "Generation should increase"
+
+    async def test_collector_registry(self):
+        """
+        This method tests the collector declarations overrides and that every
+        collector is sampled on its own interval
+        """
+        registry = context.app.app.registry
+        collectors = registry._configure(registry.BUILTIN_COLLECTORS, "disk:120, net:x, gpu:1", "mem,gpu")
+        assert collectors["disk"].interval == 120, f"Unexpected disk interval: {collectors['disk']}"
+        assert collectors["net"].interval is None, f"Invalid intervals should be ignored: {collectors['net']}"
+        assert not collectors["mem"].enabled and collectors["cpu"].enabled, "Unexpected enabled collectors"
+        assert "gpu" not in collectors, "Unknown collectors should be ignored"
+
+        value = context.app.domain.memory.RAMRawInfo(mem_total=2048, mem_free=1024, mem_ava=1536)
+        formatted = registry.format_value("mem", value, "MB", detail=False)
+        assert formatted == context.app.app.memory.format_ram_info(value, "MB"), \
+            f"Unexpected formatted value: {formatted}"
+
+        calls: dict[str, int] = {"cpu": 0, "disk": 0}
+
+        async def read_cpu_mock() -> context.app.domain.cpu.CPULoadAvgs:
+            calls["cpu"] += 1
+            return context.app.domain.cpu.CPULoadAvgs(m1=1, m5=2, m15=3)
+
+        async def read_disk_mock() -> dict:
+            calls["disk"] += 1
+            return {}
+
+        sampler = context.app.app.sampler.Sampler(
+            collectors={"cpu": read_cpu_mock, "disk": read_disk_mock},
+            interval=0.01, intervals={"disk": 60}, idle_after=0
+        )
+        assert sampler.interval == 0.01, f"Unexpected sampler interval: {sampler.interval}"
+
+        sampler.start()
+        await asyncio.sleep(0.2)
+        await sampler.stop()
+
+        assert calls["cpu"] > 3, f"Unexpected number of cpu collections: {calls['cpu']}"
+        assert calls["disk"] == 1, f"Unexpected number of disk collections: {calls['disk']}"
+
+    async def test_replay_cadence(self):
+        """
+        This method tests fixtures are replayed on their recorded cadence,
+        whatever the intervals of the collectors reading them
+        """
+        import os
+        import tempfile
+
+        fixtures = context.app.infrastructure.fixtures
+        files = context.app.infrastructure.files
+
+        with tempfile.TemporaryDirectory() as fixture_dir:
+            fixtures.record(fixture_dir, count=3, interval=0)
+            for index, snapshot in enumerate(fixtures.list_snapshots(fixture_dir)):
+                with open(os.path.join(snapshot, "proc/loadavg"), "w") as loadavg:
+                    loadavg.write(f"{index}.50 0.60 0.62 1/156 27996\n")
+                with open(os.path.join(snapshot, fixtures.TIMESTAMP_FILENAME), "w") as timestamp:
+                    timestamp.write(str(1000 + index * 0.2))
+
+            async def read_disk_mock() -> dict:
+                return {}
+
+            replay = fixtures.open_replay(fixture_dir)
+            sampler = context.app.app.sampler.Sampler(
+                collectors={"cpu": files.get_cpu_load_avg, "disk": read_disk_mock},
+                interval=0.01, intervals={"disk": 60}, idle_after=0
+            )
+            try:
+                replay.start()
+                sampler.start()
+                await asyncio.sleep(0.3)
+                await sampler.stop()
+                await replay.stop()
+                assert replay.index == 1, f"Replay must follow the recording, not the sampler: {replay.index}"
+                assert sampler.samples["cpu"].value["1m"] == "1.50", \
+                    f"Unexpected replayed load: {sampler.samples['cpu'].value}"
+            finally:
+                replay.close()
+
+    async def test_adaptive_sampling(self):
+        """
+        This method tests that idle domains are sampled on the heartbeat, and
+        back on their own interval once read or watched
+        """
+        calls: dict[str, int] = {"cpu": 0}
+
+        async def read_cpu_mock() -> context.app.domain.cpu.CPULoadAvgs:
+            calls["cpu"] += 1
+            return context.app.domain.cpu.CPULoadAvgs(m1=1, m5=2, m15=3)
+
+        sampler = context.app.app.sampler.Sampler(
+            collectors={"cpu": read_cpu_mock}, interval=0.01, idle_after=0.1, idle_interval=60
+        )
+        assert sampler.effective_interval("cpu") == 60, "Never read domains must be idle"
+
+        sampler.start()
+        try:
+            await asyncio.sleep(0.05)
+            assert calls["cpu"] == 1, f"Idle domains must wait for the heartbeat: {calls['cpu']}"
+
+            await sampler.get("cpu")
+            await asyncio.sleep(0.05)
+            assert calls["cpu"] > 2, f"Read domains must ramp up right away: {calls['cpu']}"
+            assert sampler.schedule()["cpu"]["effective_interval"] == 0.01, \
+                f"Unexpected schedule: {sampler.schedule()}"
+
+            await asyncio.sleep(0.15)
+            idle_calls: int = calls["cpu"]
+            await asyncio.sleep(0.05)
+            assert calls["cpu"] == idle_calls, "Unread domains must back off"
+            assert sampler.is_idle("cpu"), f"Unexpected schedule: {sampler.schedule()}"
+
+            sampler.add_watcher(lambda: {"cpu"})
+            sampler.demand(["cpu"])
+            await asyncio.sleep(0.15)
+            assert not sampler.is_idle("cpu"), "Watched domains must never be idle"
+            assert calls["cpu"] > idle_calls + 5, f"Watched domains must be sampled: {calls['cpu']}"
+        finally:
+            await sampler.stop()
+
+    async def test_all_info(self):
+        """
+        This method tests that a slow or failing collector does not delay the
+        others beyond the deadline and that every domain is reported together
+        """
+        async def read_cpu_mock() -> context.app.domain.cpu.CPULoadAvgs:
+            return context.app.domain.cpu.CPULoadAvgs(m1=1, m5=2, m15=3)
+
+        async def read_mem_slow() -> context.app.domain.memory.RAMRawInfo:
+            await asyncio.sleep(10)
+
+        async def read_net_mock() -> dict:
+            raise RuntimeError("net not available")
+
+        sampler = context.app.app.sampler.Sampler(
+            collectors={"cpu": read_cpu_mock, "mem": read_mem_slow, "net": read_net_mock},
+            interval=60, deadline=0.05
+        )
+
+        started: float = time.monotonic()
+        samples = await sampler.get_all()
+        elapsed: float = time.monotonic() - started
+        assert elapsed < 1, f"Slow collector blocked the round: {elapsed:.3f}s"
+        assert list(samples) == ["cpu"], f"Unexpected sampled domains: {list(samples)}"
+
+        all_info: dict = context.app.app.summary.format_all_info(
+            samples, sampler.status, sampler.generation, "MB")
+        collectors: dict = all_info["collectors"]
+
+        assert all_info["timestamp"] == samples["cpu"].timestamp, "Unexpected common timestamp"
+        assert all_info["cpu"]["m5"] == 2, f"Unexpected cpu: {all_info['cpu']}"
+        assert all_info["mem"] is None and all_info["disk"] is None, "Missing domains should be None"
+        assert collectors["cpu"]["error"] is None, f"Unexpected cpu error: {collectors['cpu']}"
+        assert "Deadline" in collectors["mem"]["error"], f"Unexpected mem error: {collectors['mem']}"
+        assert collectors["net"]["error"] == "net not available", f"Unexpected net error: {collectors['net']}"
+        assert collectors["disk"]["duration"] is None, f"Unexpected disk timing: {collectors['disk']}"
+
+    async def test_stream_hub(self):
+        """
+        This method tests that streams are fanned out from the sampler rounds,
+        that slow subscribers get coalesced frames and the subscriber limit
+        """
+        streaming = context.app.app.streaming
+        sample_cls = context.app.app.sampler.Sample
+        cpu = context.app.domain.cpu.CPULoadAvgs(m1=1, m5=2, m15=3)
+
+        hub = streaming.StreamHub(max_subscribers=2)
+        hub.publish({"cpu": sample_cls("cpu", 1, 1.0, 1.0, cpu)})
+
+        fast = hub.subscribe(streaming.parse_domains("cpu"), 0, "kB")
+        slow = hub.subscribe(streaming.parse_domains(None), 60, "kB")
+        assert hub.subscribe(frozenset({"cpu"}), 0, "kB") is None, "Subscriber limit not enforced"
+
+        frame = await fast.next_frame()
+        assert frame["cpu"].generation == 1, "Subscribers should start from the latest sample"
+        await slow.next_frame()
+
+        for generation in range(2, 12):
+            hub.publish({"cpu": sample_cls("cpu", generation, float(generation), generation, cpu)})
+            frame = await fast.next_frame()
+            assert frame["cpu"].generation == generation, f"Unexpected fast frame: {frame}"
+
+        assert slow.coalesced == 9, f"Unexpected coalesced samples: {slow.coalesced}"
+        assert len(slow._pending) == 1, "Slow subscribers must only keep the latest sample"
+
+        document: dict = json.loads(streaming.format_frame(frame, "kB"))
+        assert document["cpu"]["m15"] == 3, f"Unexpected frame: {document}"
+
+        with self.assertRaises(ValueError):
+            streaming.parse_domains("cpu,gpu")
+
+        hub.drop(slow)
+        assert hub.subscribers == 1 and hub.dropped == 1, "Dropped subscriber still open"
+
+    async def test_metrics(self):
+        """
+        This method tests the Prometheus exposition and that it is only
+        rendered once per sampling round
+        """
+        domain = context.app.domain
+        iface = domain.network.IfaceInfo(rx_bytes=1000, tx_bytes=2000, oper_state="up")
+        partition = domain.disk.PartitionInfo(mount_point='/media/"usb"', fs_type="vfat",
+                                              total=4, used=1, free=3)
+
+        async def read_disk_mock() -> dict:
+            return {"sda": domain.disk.DeviceInfo(device="sda", partitions={"/media": partition})}
+
+        async def read_net_mock() -> dict:
+            return {"wlan0": iface}
+
+        sampler = context.app.app.sampler.Sampler(
+            collectors={"disk": read_disk_mock, "net": read_net_mock}, interval=60)
+        await sampler.get_all()
+
+        cache = context.app.app.metrics.MetricsCache()
+        text: str = cache.get(sampler).decode()
+        assert cache.get(sampler) is cache.get(sampler), "Scrapes should reuse the rendered text"
+        assert cache.renders == 1, f"Unexpected number of renders: {cache.renders}"
+
+        expected_lines: list[str] = [
+            "# TYPE rpi_mon_network_receive_bytes_total counter",
+            'rpi_mon_network_receive_bytes_total{iface="wlan0"} 1000',
+            'rpi_mon_network_up{iface="wlan0"} 1',
+            'rpi_mon_disk_used_bytes{device="sda",fs_type="vfat",mount_point="/media/\\"usb\\""} 1024',
+            'rpi_mon_collector_success{domain="disk"} 1'
+        ]
+        for line in expected_lines:
+            assert line in text.splitlines(), f"Missing line: {line}"
+        assert "rpi_mon_network_link_quality{" not in text, "Unknown values must be skipped"
+
+        await sampler.sample()
+        cache.get(sampler)
+        assert cache.renders == 2, "A new round should be rendered again"
+
+    def test_conditional_requests(self):
+        """
+        This method tests the ETag and If-Modified-Since validation of the
+        sample generations
+        """
+        caching = context.app.app.caching
+        headers: dict[str, str] = caching.cache_headers(7, 1700000000.5, 5)
+        etag: str = headers["ETag"]
+
+        assert headers["Cache-Control"] == "max-age=5", f"Unexpected Cache-Control: {headers}"
+        assert caching.is_not_modified(7, 1700000000.5, etag), "Same generation should not be modified"
+        assert caching.is_not_modified(7, 1700000000.5, f'"x", W/{etag}'), "Weak ETags should match"
+        assert caching.is_not_modified(7, 1700000000.5, "*"), "Wildcard should match"
+        assert not caching.is_not_modified(8, 1700000000.5, etag), "New generation should be modified"
+        assert not caching.is_not_modified(7, 1700000000.5), "Unconditional requests should be modified"
+
+        last_modified: str = headers["Last-Modified"]
+        assert caching.is_not_modified(7, 1700000000.5, None, last_modified), "Same second should not be modified"
+        assert not caching.is_not_modified(8, 1700000001.5, None, last_modified), "Later sample should be modified"
+        assert not caching.is_not_modified(8, 1700000001.5, etag, last_modified), "If-None-Match takes precedence"
+        assert not caching.is_not_modified(7, 1700000000.5, None, "not a date"), "Invalid dates should be modified"
+
+    def test_response_cache(self):
+        """
+        This method tests that every view of a sample is rendered once and
+        dropped on the next generation
+        """
+        rendering = context.app.app.rendering
+        cache = rendering.ResponseCache()
+        ram = context.app.domain.memory.RAMRawInfo(mem_total=2 * 1024 ** 3, mem_free=1024 ** 3,
+                                                  mem_ava=1024 ** 3)
+
+        for _ in range(10):
+            for unit in rendering.UNITS:
+                body: bytes = cache.get("mem", 1, unit, lambda: context.app.app.memory.format_ram_info(ram, unit))
+                assert json.loads(body) == context.app.app.memory.format_ram_info(ram, unit), \
+                    f"Unexpected {unit} body: {body}"
+
+        assert cache.renders == 4, f"Every view should be rendered once: {cache.renders}"
+        assert cache.hits == 36, f"Unexpected cache hits: {cache.hits}"
+
+        cache.get("mem", 2, "kB", lambda: {"total": 0})
+        assert cache.renders == 5 and len(cache._views["mem"]) == 1, "Old generations should be dropped"
+        assert rendering.normalize_unit("TB") == "B", "Unknown units should share the B view"
+
+    def test_history(self):
+        """
+        This method tests the history ring buffers, queries and memory ceiling
+        """
+        history_module = context.app.app.history
+        sampler_module = context.app.app.sampler
+
+        history = history_module.History(capacity=4, max_bytes=0, rollups=[], intervals={"cpu": 1, "mem": 1})
+        history.max_bytes = 3 * history.series_size
+        assert history.max_series == 3, f"Unexpected max series: {history.max_series}"
+
+        for second in range(6):
+            cpu = context.app.domain.cpu.CPULoadAvgs(m1=second, m5=second, m15=second)
+            history.record({"cpu": sampler_module.Sample("cpu", second, 100.0 + second, second, cpu)})
+
+        series: list[dict] = history.query("cpu", 0, 1000)
+        assert [serie["name"] for serie in series] == ["m1", "m5", "m15"], f"Unexpected series: {series}"
+        assert series[0]["points"] == [[102.0, 2], [103.0, 3], [104.0, 4], [105.0, 5]], \
+            f"Oldest points must be overwritten: {series[0]['points']}"
+
+        series = history.query("cpu", 103, 104)
+        assert series[0]["points"] == [[103.0, 3], [104.0, 4]], f"Unexpected range: {series[0]['points']}"
+
+        series = history.query("cpu", 0, 1000, step=2)
+        assert series[0]["points"] == [[102.0, 2.5], [104.0, 4.5]], f"Unexpected buckets: {series[0]['points']}"
+
+        ram = context.app.domain.memory.RAMRawInfo(mem_total=2048, mem_free=1024, mem_ava=1024)
+        history.record({"mem": sampler_module.Sample("mem", 7, 200.0, 7, ram)})
+        assert history.nbytes <= history.max_bytes, f"Memory ceiling exceeded: {history.nbytes}"
+        assert len(history.query("mem", 0, 1000)) == 3, "Newest series must evict the oldest ones"
+        assert len(history.query("cpu", 0, 1000)) == 0, "Oldest series must be evicted"
+
+        ram = context.app.domain.memory.RAMRawInfo(mem_total=2048, mem_free=-1, mem_ava=1024)
+        history.record({"mem": sampler_module.Sample("mem", 8, 201.0, 8, ram)})
+        cpu = context.app.domain.cpu.CPULoadAvgs(m1=1, m5=1, m15=1)
+        history.record({"cpu": sampler_module.Sample("cpu", 9, 202.0, 9, cpu)})
+        series = history.query("mem", 0, 1000)
+        assert len(series) == 3 and not history.query("cpu", 0, 1000), \
+            f"Healthy series must not be evicted: {series}"
+        assert [len(serie["points"]) for serie in series] == [2, 1, 2], \
+            f"Unknown values must be skipped: {series}"
+
+    def test_history_rollups(self):
+        """
+        This method tests the rollup tiers and the tier selection by step
+        """
+        series = context.app.app.history.Series(capacity=30, rollups=[(3600, 2), (60, 10)])
+
+        for second in range(0, 7200):
+            series.append(float(second), float(second % 120))
+
+        resolution, tier = series.tier(0)
+        assert resolution == 0 and len(tier) == 30, "Raw points must be used without step"
+
+        resolution, tier = series.tier(300)
+        assert resolution == 60, f"Unexpected tier for 5 min step: {resolution}"
+        assert len(tier) == 10, f"Rollup tier must be bounded: {len(tier)}"
+
+        resolution, tier = series.tier(7200)
+        assert resolution == 3600, f"Unexpected tier for 2 h step: {resolution}"
+        assert list(tier.buckets()) == [
+            (0.0, 0.0, 119.0, 59.5 * 3600, 3600.0, 119.0),
+            (3600.0, 0.0, 119.0, 59.5 * 3600, 3600.0, 119.0)
+        ], f"Unexpected hourly buckets: {list(tier.buckets())}"
+
+        history = context.app.app.history.History(capacity=30, rollups=[(60, 10)])
+        for second in range(0, 600):
+            cpu = context.app.domain.cpu.CPULoadAvgs(m1=second % 60, m5=0, m15=0)
+            history.record({"cpu": context.app.app.sampler.Sample("cpu", second, float(second), second, cpu)})
+
+        m1: dict = history.query("cpu", 0, 600, step=120, agg="max")[0]
+        assert m1["resolution"] == 60, f"Unexpected resolution: {m1['resolution']}"
+        assert m1["points"] == [[120.0 * bucket, 59.0] for bucket in range(5)], \
+            f"Unexpected merged points: {m1['points']}"
+
+    async def test_persistent_history(self):
+        """
+        This method tests the history is batched into the store, written in
+        the background and reloaded
+        """
+        import os
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            path: str = os.path.join(store_dir, "history.store")
+            history = context.app.app.history.History(capacity=10, rollups=[])
+            persistent = context.app.app.persistence.open_persistent_history(history, path, capacity=100)
+            persistent.flush_interval = 3600
+
+            for second in range(3):
+                cpu = context.app.domain.cpu.CPULoadAvgs(m1=second, m5=0, m15=0)
+                persistent.record({"cpu": context.app.app.sampler.Sample("cpu", second, float(second), second, cpu)})
+
+            assert persistent.store.count == 0, "Records must be batched until flushed"
+            persistent.close()
+            assert persistent.stats()["records"] == 9, f"Unexpected records: {persistent.stats()}"
+
+            reloaded = context.app.app.history.History(capacity=10, rollups=[])
+            persistent = context.app.app.persistence.open_persistent_history(reloaded, path, capacity=100)
+            m1: dict = reloaded.query("cpu", 0, 10)[0]
+            assert m1["points"] == [[0.0, 0.0], [1.0, 1.0], [2.0, 2.0]], f"Unexpected reloaded points: {m1}"
+
+            persistent.flush_interval = 0.01
+            persistent.start()
+            cpu = context.app.domain.cpu.CPULoadAvgs(m1=3, m5=0, m15=0)
+            persistent.record({"cpu": context.app.app.sampler.Sample("cpu", 3, 3.0, 3, cpu)})
+            await asyncio.sleep(0.1)
+            await persistent.stop()
+            assert persistent.store.count == 12, f"Batches must be written in the background: {persistent.stats()}"
+            persistent.close()
+
+    def test_persistent_series_table(self):
+        """
+        This method tests the series table of the store is capped, reuses
+        the ids of overwritten series and drops unused keys when reopened
+        """
+        import os
+        import tempfile
+
+        persistence = context.app.app.persistence
+        store_module = context.app.infrastructure.store
+
+        def record(persistent, second: int, field: str) -> None:
+            loads: dict = {"m1": -1, "m5": -1, "m15": -1, field: second}
+            cpu = context.app.domain.cpu.CPULoadAvgs(**loads)
+            persistent.record({"cpu": context.app.app.sampler.Sample("cpu", second, float(second), second, cpu)})
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            path: str = os.path.join(store_dir, "history.store")
+            history = context.app.app.history.History(capacity=10, rollups=[])
+            persistent = persistence.PersistentHistory(store_module.open_store(path, 4), history, max_series=2)
+            record(persistent, 0, "m1")
+            record(persistent, 0, "m5")
+            persistent.flush()
+            record(persistent, 0, "m15")
+            assert persistent.stats()["skipped_records"] == 1, "Series beyond the cap must be skipped"
+
+            for second in range(1, 5):
+                record(persistent, second, "m5")
+            persistent.flush()
+            record(persistent, 5, "m15")
+            assert persistent.stats()["skipped_records"] == 1, "Overwritten series ids must be reused"
+            for second in range(6, 10):
+                record(persistent, second, "m5")
+            persistent.close()
+
+            reloaded = context.app.app.history.History(capacity=10, rollups=[])
+            persistent = persistence.open_persistent_history(reloaded, path, capacity=4)
+            assert persistent.stats()["series"] == 1, f"Unused keys must be dropped: {persistent.stats()}"
+            persistent.close()
+            table: list = store_module.load_series_table(path + ".series")
+            assert table == [None, ["cpu", "m5", ""]], f"Unexpected series table: {table}"
+
+    def test_ws_invalid_messages(self):
+        """
+        This method tests that invalid WebSocket messages, not JSON, binary or
+        with non string domains, are answered with an error and keep the
+        stream open
+        """
+        from fastapi.testclient import TestClient
+        import app.main
+
+        with TestClient(app.main.rpi_mon_api) as client:
+            with client.websocket_connect("/v1/ws?domains=cpu") as websocket:
+                for message in ("{not json", b"\x00binary", '{"domains": 5}', '{"domains": [1]}'):
+                    if isinstance(message, bytes):
+                        websocket.send_bytes(message)
+                    else:
+                        websocket.send_text(message)
+                    reply: dict = websocket.receive_json()
+                    while "error" not in reply:
+                        reply = websocket.receive_json()
+                    assert reply["error"].startswith("Invalid message"), f"Unexpected reply: {reply}"
+
+                websocket.send_json({"domains": ["mem"]})
+                frame: dict = websocket.receive_json()
+                while "mem" not in frame:
+                    frame = websocket.receive_json()
+
+    async def test_fleet(self):
+        """
+        This method tests the fleet aggregator scrapes stand-in instances,
+        revalidates unchanged documents and backs off failing hosts
+        """
+        import httpx
+
+        fleet_module = context.app.app.fleet
+        requests: list[httpx.Request] = []
+
+        def stand_in(request: httpx.Request) -> httpx.Response:
+            """Serve /v1/all for pi1 and refuse connections for pi2"""
+            requests.append(request)
+            if request.url.host == "pi2":
+                raise httpx.ConnectError("Connection refused", request=request)
+            if request.headers.get("if-none-match") == '"a-1"':
+                return httpx.Response(304, headers={"ETag": '"a-1"'})
+            return httpx.Response(200, headers={"ETag": '"a-1"'},
+                                  json={"timestamp": 1.0, "generation": 1, "cpu": {"m1": 1.0}, "mem": {}})
+
+        upstreams = fleet_module.parse_upstreams("http://pi1:8000/, pi2=http://pi2:8000")
+        assert [upstream.name for upstream in upstreams] == ["pi1:8000", "pi2"], \
+            f"Unexpected upstreams: {upstreams}"
+        with_query = fleet_module.parse_upstreams("http://pi3:8000/?token=x, pi4=http://pi4/?a=b")
+        assert [(upstream.name, upstream.url) for upstream in with_query] == \
+            [("pi3:8000", "http://pi3:8000/?token=x"), ("pi4", "http://pi4/?a=b")], \
+            f"Unexpected upstreams with query: {with_query}"
+        assert with_query[0].scrape_url == "http://pi3:8000/v1/all?token=x", \
+            f"Unexpected scrape URL: {with_query[0].scrape_url}"
+
+        fleet = fleet_module.Fleet(upstreams, interval=1, jitter=0, max_backoff=4,
+                                   transport=httpx.MockTransport(stand_in))
+        for _ in range(2):
+            for upstream in fleet.upstreams.values():
+                await fleet.scrape(upstream)
+        await fleet.stop()
+
+        view: dict = fleet.view(frozenset({"cpu"}))
+        pi1: dict = view["hosts"]["pi1:8000"]
+        pi2: dict = view["hosts"]["pi2"]
+        assert pi1["up"] and pi1["data"] == {"timestamp": 1.0, "generation": 1, "cpu": {"m1": 1.0}}, \
+            f"Unexpected pi1 view: {pi1}"
+        assert 0 <= pi1["staleness"] < 1 and pi1["scrape_latency"] >= 0, f"Unexpected pi1 timing: {pi1}"
+        assert requests[2].headers["if-none-match"] == '"a-1"', "Scrapes must be conditional"
+        assert not pi2["up"] and pi2["failures"] == 2 and pi2["data"] is None and pi2["staleness"] == -1, \
+            f"Unexpected pi2 view: {pi2}"
+
+        assert fleet.delay(fleet.upstreams["pi1:8000"]) == 1, "Healthy hosts use the interval"
+        assert fleet.delay(fleet.upstreams["pi2"]) == 4, "Failing hosts must back off"
+        fleet.upstreams["pi2"].failures = 10
+        assert fleet.delay(fleet.upstreams["pi2"]) == 4, "Backoff must be capped"
+
+    async def test_push_exporter(self):
+        """
+        This method tests the push exporter batches lines in order to a
+        stand-in receiver, retrying outages, and spills or drops the batches
+        not fitting in the queue
+        """
+        import gzip
+        import tempfile
+        import httpx
+
+        export_module = context.app.app.export
+        received: list[bytes] = []
+        outage: list[int] = [2]
+
+        def receiver(request: httpx.Request) -> httpx.Response:
+            """Fail the first requests, then accept every batch"""
+            if outage[0] > 0:
+                outage[0] -= 1
+                return httpx.Response(503)
+            received.append(gzip.decompress(request.content))
+            return httpx.Response(204)
+
+        def samples(second: int) -> dict:
+            cpu = context.app.domain.cpu.CPULoadAvgs(m1=second, m5=0.5, m15=0.25)
+            return {"cpu": context.app.app.sampler.Sample("cpu", second, float(second), second, cpu)}
+
+        lines = export_module.format_lines(samples(1), "pi 1")
+        assert lines == [b"rpi_mon_cpu,host=pi\\ 1 m1=1.0,m5=0.5,m15=0.25 1000000000"], \
+            f"Unexpected lines: {lines}"
+
+        with tempfile.TemporaryDirectory() as spool_dir:
+            spool = context.app.infrastructure.spool.Spool(spool_dir, max_bytes=150)
+            exporter = export_module.PushExporter("http://collector/write", host="pi", batch_age=0,
+                                                  queue_size=1, spool=spool, retry_interval=0.001,
+                                                  transport=httpx.MockTransport(receiver))
+            for second in range(5):
+                exporter.record(samples(second))
+            assert exporter.sealing, "Batches must be compressed and spilled in the background"
+            while exporter.sealing:
+                await asyncio.sleep(0.01)
+
+            stats: dict = exporter.stats()
+            assert stats["queue_depth"] == 1 and stats["spooled_batches"] == 2, f"Unexpected queue: {stats}"
+            assert stats["dropped_lines"] == 2, f"Batches not fitting the spool must be dropped: {stats}"
+
+            exporter.start()
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if exporter.stats()["sent_batches"] == 3:
+                    break
+            await exporter.stop()
+
+            stats = exporter.stats()
+            assert stats["retries"] == 2 and stats["spooled_batches"] == 0, f"Unexpected delivery: {stats}"
+            timestamps: list[bytes] = [body.rsplit(b" ", 1)[1] for body in received]
+            assert timestamps == [b"0", b"1000000000", b"4000000000"], f"Unexpected order: {timestamps}"
+
+            spool.push(b"not gzip", 3)
+            exporter = export_module.PushExporter("http://collector/write", spool=spool,
+                                                  transport=httpx.MockTransport(receiver))
+            exporter.start()
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if exporter.stats()["dropped_lines"] == 3:
+                    break
+            await exporter.stop()
+            assert len(received) == 3 and len(spool) == 0, "Corrupt batches must not be sent"
+            assert any(name.endswith(".corrupt") for name in os.listdir(spool_dir)), \
+                "Corrupt batches must be moved aside"
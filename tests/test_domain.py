@@ -2,6 +2,7 @@
 This module contains the tests for the Domain layer
 """
 import unittest
+import dataclasses as dc
 from typing import Union
 from unittest.mock import patch
 
@@ -62,8 +63,30 @@ class TestDomainLayer(unittest.IsolatedAsyncioTestCase):
         assert ram.mem_free == expected['mem_free'], f"Unexpected mem_free value: {ram.mem_free}"
         assert ram.mem_ava == expected['mem_ava'], f"Unexpected mem_ava value: {ram.mem_ava}"
         assert ram.mem_used == expected['mem_used'], f"Unexpected mem_used value: {ram.mem_used}"
+        assert ram.swap_used == -1, f"Missing fields should be unknown: {ram.swap_used}"
 
-    @patch('context.app.infrastructure.cmd.get_disk_usage')
+    @patch('context.app.infrastructure.files.get_mem_info')
+    async def test_read_ram_detail(self, mock_read_memory_info):
+        """
+        This method tests the detailed memory fields and their units
+        """
+        async def read_memory_info_mock() -> dict[str, int]:
+            """File information mock is in kB"""
+            return {"mem_total": 4096, "mem_free": 1024, "mem_ava": 2048, "buffers": 128,
+                    "cached": 512, "swap_total": 1024, "swap_free": 256, "dirty": 8,
+                    "writeback": 0, "slab": 64, "HugePages_Total": 0}
+
+        mock_read_memory_info.side_effect = read_memory_info_mock
+
+        ram: context.app.domain.memory.RAMRawInfo = await context.app.domain.memory.read_ram_info()
+        assert ram.swap_used == 768 * 1024, f"Unexpected swap_used value: {ram.swap_used}"
+
+        ram_dict: dict = ram.as_dict("B", detail=True)
+        assert ram_dict["cached"] == 512, f"Unexpected cached value: {ram_dict['cached']}"
+        assert ram_dict["swap_used"] == 768, f"Unexpected swap_used value: {ram_dict['swap_used']}"
+        assert "slab" not in ram.as_dict("B"), "Detailed fields must only be included on demand"
+
+    @patch('context.app.infrastructure.files.get_disk_usage')
     async def test_read_disks_info(self, mock_read_disks_info):
         """
         This method tests read disks info function
@@ -181,4 +204,141 @@ class TestDomainLayer(unittest.IsolatedAsyncioTestCase):
             for key in statistics_keys:
                 assert iface_data[key] == net_mock[iface][key], f"Unexpected value for {key} in {iface}"
             for key in link_keys:
-                assert iface_data[key] == net_mock[iface][key], f"Unexpected value for {key} in {iface}"
\ No newline at end of file
+                assert iface_data[key] == net_mock[iface][key], f"Unexpected value for {key} in {iface}"
+    @patch('context.app.infrastructure.files.get_link_info')
+    @patch('context.app.infrastructure.files.get_net_info')
+    @patch('context.app.infrastructure.cmd.get_net_info')
+    async def test_read_net_link_info(self, mock_get_net_info_cmd, mock_get_net_info, mock_get_link_info):
+        """
+        This method tests that link data comes from procfs/sysfs and that
+        iwconfig is only used for wireless interfaces without bit rate, at
+        most once per TTL
+        """
+        context.app.domain.network._iwconfig_cache.clear()
+
+        async def get_net_info_mock() -> dict[str, dict[str, int]]:
+            return {"lo": {"rx_bytes": 1}, "eth0": {"rx_bytes": 2}, "wlan0": {"rx_bytes": 3}}
+
+        async def get_link_info_mock(ifaces: list[str]) -> dict[str, dict]:
+            return {
+                "lo": {"wireless": False, "oper_state": "unknown"},
+                "eth0": {"wireless": False, "oper_state": "up", "bit_rate": "1000 Mb/s"},
+                "wlan0": {"wireless": True, "oper_state": "up", "link_quality": 70.0, "signal_level": -40.0}
+            }
+
+        async def get_net_info_cmd_mock(iface: str) -> dict[str, str]:
+            return {"bit_rate": "72.2 Mb/s"}
+
+        mock_get_net_info.side_effect = get_net_info_mock
+        mock_get_link_info.side_effect = get_link_info_mock
+        mock_get_net_info_cmd.side_effect = get_net_info_cmd_mock
+
+        net: dict[str, context.app.domain.network.IfaceInfo] = await context.app.domain.network.read_net_info()
+
+        await context.app.domain.network.read_net_info()
+        mock_get_net_info_cmd.assert_called_once_with("wlan0")
+        assert net["eth0"].bit_rate == "1000 Mb/s", f"Unexpected eth0 bit rate: {net['eth0'].bit_rate}"
+        assert net["wlan0"].bit_rate == "72.2 Mb/s", f"Unexpected wlan0 bit rate: {net['wlan0'].bit_rate}"
+        assert net["wlan0"].link_quality == 70.0, f"Unexpected link quality: {net['wlan0'].link_quality}"
+        assert net["wlan0"].signal_level == -40.0, f"Unexpected signal level: {net['wlan0'].signal_level}"
+        assert net["lo"].link_quality == -1, "Non wireless interfaces must not have link quality"
+        assert net["lo"].oper_state == "unknown", f"Unexpected lo state: {net['lo'].oper_state}"
+
+    def test_models_layout(self):
+        """
+        This method tests that the domain models are slotted, that value
+        records are immutable and that derived fields are set at construction
+        """
+        domain = context.app.domain
+        ram = domain.memory.RAMRawInfo(mem_total=4096, mem_free=1024, mem_ava=3072)
+        assert ram.mem_used == 1024, f"Unexpected mem_used value: {ram.mem_used}"
+        assert domain.memory.RAMRawInfo(mem_total=4096).mem_used == -1, "Unknown mem_used should be -1"
+
+        with self.assertRaises(dc.FrozenInstanceError):
+            ram.mem_ava = 0
+
+        instances: list = [
+            ram, domain.disk.PartitionInfo(), domain.disk.DeviceInfo(), domain.network.IfaceInfo(),
+            domain.network.IfaceRates(), domain.cpu.CPULoadAvgs(), domain.cpu.CPUUsage()
+        ]
+        for instance in instances:
+            assert not hasattr(instance, "__dict__"), f"{type(instance).__name__} should be slotted"
+
+    def test_cpu_stat_tracker(self):
+        """
+        This method tests the CPU usage and rates computation, including
+        cores appearing between samples
+        """
+        tracker = context.app.domain.cpu.CPUStatTracker()
+
+        def ticks(user: int, system: int, idle: int, iowait: int) -> dict[str, int]:
+            return {"user": user, "nice": 0, "system": system, "idle": idle,
+                    "iowait": iowait, "irq": 0, "softirq": 0, "steal": 0}
+
+        first = context.app.domain.cpu.CPULoadAvgs()
+        tracker.update(first, {"cpus": {"cpu": ticks(100, 50, 800, 50), "cpu0": ticks(100, 50, 800, 50)},
+                               "ctxt": 1000, "forks": 10}, 10.0)
+        assert first.usage is None and first.ctxt_rate == -1, "First sample must not have usage"
+
+        second = context.app.domain.cpu.CPULoadAvgs()
+        tracker.update(second, {"cpus": {"cpu": ticks(150, 60, 820, 70), "cpu0": ticks(150, 60, 820, 70),
+                                         "cpu1": ticks(1, 1, 1, 1)},
+                                "ctxt": 1500, "forks": 14}, 12.0)
+
+        assert second.usage.user == 50, f"Unexpected user usage: {second.usage}"
+        assert second.usage.iowait == 20, f"Unexpected iowait usage: {second.usage}"
+        assert second.usage.window == 2.0, f"Unexpected window: {second.usage.window}"
+        assert list(second.cores) == ["cpu0"], f"New cores must not have usage: {second.cores}"
+        assert second.ctxt_rate == 250, f"Unexpected ctxt rate: {second.ctxt_rate}"
+        assert second.fork_rate == 2, f"Unexpected fork rate: {second.fork_rate}"
+
+    def test_net_rates_tracker(self):
+        """
+        This method tests the network rates computation, including counters
+        wraparound and reset, and interfaces appearing and disappearing
+        """
+        IfaceInfo = context.app.domain.network.IfaceInfo
+        tracker = context.app.domain.network.RatesTracker()
+
+        first: dict[str, IfaceInfo] = {
+            "eth0": IfaceInfo(rx_pack=10, rx_bytes=1000, rx_err=0, rx_drop=0,
+                              tx_pack=10, tx_bytes=2 ** 32 - 1000, tx_err=0, tx_drop=0),
+            "veth0": IfaceInfo(rx_pack=1, rx_bytes=1, rx_err=0, rx_drop=0,
+                               tx_pack=1, tx_bytes=1, tx_err=0, tx_drop=0)
+        }
+        tracker.update(first, 100.0)
+        assert first["eth0"].rates is None, "First sample must not have rates"
+
+        second: dict[str, IfaceInfo] = {
+            "eth0": IfaceInfo(rx_pack=30, rx_bytes=3000, rx_err=0, rx_drop=2,
+                              tx_pack=30, tx_bytes=1000, tx_err=0, tx_drop=0),
+            "wlan0": IfaceInfo(rx_pack=1, rx_bytes=1, rx_err=0, rx_drop=0,
+                               tx_pack=1, tx_bytes=1, tx_err=0, tx_drop=0)
+        }
+        tracker.update(second, 102.0)
+
+        rates = second["eth0"].rates
+        assert rates.window == 2.0, f"Unexpected window: {rates.window}"
+        assert rates.rx_bytes == 1000, f"Unexpected rx bytes rate: {rates.rx_bytes}"
+        assert rates.rx_pack == 10, f"Unexpected rx packets rate: {rates.rx_pack}"
+        assert rates.rx_drop == 1, f"Unexpected rx drop rate: {rates.rx_drop}"
+        assert rates.tx_bytes == 1000, f"Unexpected wrapped tx bytes rate: {rates.tx_bytes}"
+        assert second["wlan0"].rates is None, "New interfaces must not have rates"
+
+        third: dict[str, IfaceInfo] = {"veth0": IfaceInfo(rx_bytes=5)}
+        tracker.update(third, 104.0)
+        assert third["veth0"].rates is None, "Disappeared interfaces must be forgotten"
+
+        # A driver reload resets the counters, far beyond what a 100 Mb/s
+        # link can wrap in 30 seconds
+        reset_tracker = context.app.domain.network.RatesTracker()
+        reset_tracker.update({"eth0": IfaceInfo(rx_bytes=3 * 10 ** 9, rx_pack=10 ** 6,
+                                                bit_rate="100 Mb/s")}, 100.0)
+        reset: dict[str, IfaceInfo] = {"eth0": IfaceInfo(rx_bytes=600, rx_pack=3, bit_rate="100 Mb/s")}
+        reset_tracker.update(reset, 130.0)
+        assert reset["eth0"].rates.rx_bytes == 20, f"Resets must count from 0: {reset['eth0'].rates}"
+        assert reset["eth0"].rates.rx_pack == 0.1, f"Resets must count from 0: {reset['eth0'].rates}"
+
+        iface_dict: dict = second["eth0"].as_dict("B", rates=True)
+        assert iface_dict["rates"]["window"] == 2.0, f"Unexpected rates dict: {iface_dict}"
+        assert "rates" not in second["eth0"].as_dict("B"), "Rates must only be included on demand"
@@ -1,10 +1,17 @@
 """
 This module contains the tests for the Infrastructure layer
 """
+import os
 import json
+import time
+import asyncio
 import logging
+import tempfile
+import threading
 import unittest
-from unittest.mock import patch, mock_open
+from unittest.mock import patch
+
+import uvloop
 
 import context
 
@@ -23,8 +30,8 @@ class TestInfrastructureLayer(unittest.IsolatedAsyncioTestCase):
     This class contains the tests for the Infrastructure layer
     """
 
-    @patch("builtins.open")
-    async def test_get_cpu_cores(self, open_mock):
+    @patch("context.app.infrastructure.files._read_proc_file")
+    async def test_get_cpu_cores(self, read_mock):
         """
         This method tests read cpu info function
         """
@@ -74,14 +81,14 @@ Revision        : a02082
 Serial          : XXXXXXXXXXXXXXXX
 Model           : Raspberry Pi 3 Model B Rev 1.2"""
 
-        open_mock.side_effect = mock_open(read_data=cpu_info_file)
+        read_mock.return_value = cpu_info_file.encode()
 
         cores: int = await context.app.infrastructure.files.get_cpu_cores()
 
         assert cores == 4, f"Unexpected cores, value: {cores}"
 
-    @patch("builtins.open")
-    async def test_get_cpu_load_avg(self, open_mock):
+    @patch("context.app.infrastructure.files._read_proc_file")
+    async def test_get_cpu_load_avg(self, read_mock):
         """
         This method tests read cpu load avg function
         """
@@ -90,20 +97,50 @@ Model           : Raspberry Pi 3 Model B Rev 1.2"""
         expected: dict[str, int] = {"1m": "0.53", "5m": "0.60", "15m": "0.62"}
 
         cpu_load_file: str = "0.53 0.60 0.62 1/156 27996"
-        open_mock.side_effect = mock_open(read_data=cpu_load_file)
+        read_mock.return_value = cpu_load_file.encode()
 
         load: dict[str, int] = await context.app.infrastructure.files.get_cpu_load_avg()
 
         for key, value in expected.items():
             assert load[key] == value, f"Unexpected value for {key}, value: {load[key]}"
 
-    @patch("builtins.open")
-    async def test_get_mem_info(self, open_mock):
+    @patch("context.app.infrastructure.files._read_proc_file")
+    async def test_get_cpu_stat(self, read_mock):
+        """
+        This method tests read cpu stat function, including older kernels
+        without steal time
+        """
+        cpu_stat_file: str = (
+            "cpu  4705 356 584 3699 23 23 0 0 0 0\n"
+            "cpu0 2352 178 292 1849 11 11 0 0 0 0\n"
+            "cpu1 2353 178 292 1850 12 12\n"
+            "intr 1462898 0 0 0\n"
+            "ctxt 115315\n"
+            "btime 769041601\n"
+            "processes 86031\n"
+            "procs_running 1\n"
+        )
+        read_mock.return_value = cpu_stat_file.encode()
+
+        cpu_stat: dict = await context.app.infrastructure.files.get_cpu_stat()
+
+        assert list(cpu_stat["cpus"]) == ["cpu", "cpu0", "cpu1"], f"Unexpected cpus: {cpu_stat['cpus']}"
+        assert cpu_stat["cpus"]["cpu"]["idle"] == 3699, f"Unexpected idle: {cpu_stat['cpus']['cpu']}"
+        assert cpu_stat["cpus"]["cpu1"]["steal"] == 0, f"Unexpected steal: {cpu_stat['cpus']['cpu1']}"
+        assert cpu_stat["ctxt"] == 115315, f"Unexpected ctxt: {cpu_stat['ctxt']}"
+        assert cpu_stat["forks"] == 86031, f"Unexpected forks: {cpu_stat['forks']}"
+
+    @patch("context.app.infrastructure.files._read_proc_file")
+    async def test_get_mem_info(self, read_mock):
         """
         This method tests read mem function
         """
 
-        expected: dict[str, int] = {"mem_total": 945364, "mem_free": 163000, "mem_ava": 717680}
+        expected: dict[str, int] = {
+            "mem_total": 945364, "mem_free": 163000, "mem_ava": 717680, "buffers": 70396,
+            "cached": 541668, "swap_total": 204796, "swap_free": 191228, "dirty": 0,
+            "writeback": 0, "slab": 55856, "Active(anon)": 636, "CmaFree": 15444
+        }
 
         mem_info_file: str = """MemTotal:         945364 kB
 MemFree:          163000 kB
@@ -142,14 +179,308 @@ VmallocUsed:        4724 kB
 VmallocChunk:          0 kB
 Percpu:             1456 kB
 CmaTotal:          65536 kB
-CmaFree:           15444 kB"""
-        open_mock.side_effect = mock_open(read_data=mem_info_file)
+CmaFree:           15444 kB
+HugePages_Total:       0
+Hugepagesize:       2048 kB"""
+        read_mock.return_value = mem_info_file.encode()
 
         mem: dict[str, int] = await context.app.infrastructure.files.get_mem_info()
 
         for key, value in expected.items():
             assert mem[key] == value, f"Unexpected value for {key}, value: {mem[key]}"
 
+        assert mem["HugePages_Total"] == 0, "Fields without unit should be parsed as counts"
+        assert len(mem) == 40, f"Every field should be parsed: {len(mem)}"
+
+    def test_proc_file_reader(self):
+        """
+        This method tests the persistent reader rereads the same open file
+        and grows its buffer when the content does not fit
+        """
+        with tempfile.NamedTemporaryFile() as proc_file:
+            proc_file.write(b"0.53 0.60 0.62 1/156 27996\n")
+            proc_file.flush()
+
+            reader = context.app.infrastructure.files.ProcFileReader(proc_file.name, size=8)
+            assert reader.read() == b"0.53 0.60 0.62 1/156 27996\n", "Unexpected content"
+            fileno: int = reader.fileno()
+
+            proc_file.seek(0)
+            proc_file.write(b"1.00")
+            proc_file.flush()
+
+            assert reader.read().startswith(b"1.00 0.60"), "Content must be reread"
+            assert reader.fileno() == fileno, "File must not be reopened"
+            reader.close()
+
+        # procfs seq files return about a page per read. The mappings may
+        # change between two reads, so the same content is expected once
+        reader = context.app.infrastructure.files.ProcFileReader("/proc/self/maps")
+        for _ in range(3):
+            with open("/proc/self/maps", 'rb') as maps_reader:
+                expected: bytes = maps_reader.read()
+            content: bytes = reader.read()
+            if content == expected:
+                break
+        assert len(expected) > context.app.infrastructure.files.PROC_FILE_BUFFER_SIZE, "Expected a multi page file"
+        assert content == expected, f"Content must not be truncated: {len(content)} of {len(expected)} bytes"
+        reader.close()
+
+    @patch("context.app.infrastructure.files._read_proc_file")
+    async def test_get_net_info_parsing(self, read_mock):
+        """
+        This method tests the /proc/net/dev parsing
+        """
+        net_dev_file: str = """Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo:  1024      10    0    0    0     0          0         0     1024      10    0    0    0     0       0          0
+ wlan0: 3072     300    5    6    0     0          0         0     4096     400    7    8    0     0       0          0"""
+        expected: dict[str, int] = {
+            "rx_bytes": 3072, "rx_pack": 300, "rx_err": 5, "rx_drop": 6,
+            "tx_bytes": 4096, "tx_pack": 400, "tx_err": 7, "tx_drop": 8
+        }
+        read_mock.return_value = net_dev_file.encode()
+
+        net_info: dict[str, dict[str, int]] = await context.app.infrastructure.files.get_net_info()
+
+        assert list(net_info) == ["lo", "wlan0"], f"Unexpected interfaces: {list(net_info)}"
+        for key, value in expected.items():
+            assert net_info["wlan0"][key] == value, f"Unexpected value for {key}: {net_info['wlan0'][key]}"
+
+        files = context.app.infrastructure.files
+        gone: str = os.path.join(files.NET_SYSFS_DIRPATH, "veth0a1b2c", "operstate")
+        kept: str = os.path.join(files.NET_SYSFS_DIRPATH, "wlan0", "operstate")
+        with patch.dict(files._proc_readers, {gone: files.ProcFileReader(gone), kept: files.ProcFileReader(kept)}):
+            await files.get_net_info()
+            assert gone not in files._proc_readers, "Readers of removed interfaces must be closed"
+            assert kept in files._proc_readers, "Readers of listed interfaces must be kept"
+
+    def test_record_store(self):
+        """
+        This method tests the memory mapped record store wraps around, is
+        reloaded on reopen and only exposes committed records
+        """
+        store_module = context.app.infrastructure.store
+
+        def pack(records: list[tuple[float, float, int]]) -> bytes:
+            return b"".join(store_module.RECORD_FORMAT.pack(*record) for record in records)
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            path: str = os.path.join(store_dir, "history.store")
+
+            store = store_module.RecordStore(path, capacity=4)
+            store.append(pack([(1.0, 10.0, 0), (2.0, 20.0, 1), (3.0, 30.0, 0)]))
+            store.append(pack([(4.0, 40.0, 1), (5.0, 50.0, 0)]))
+            assert list(store.records()) == [(2.0, 20.0, 1), (3.0, 30.0, 0), (4.0, 40.0, 1), (5.0, 50.0, 0)], \
+                f"Unexpected records: {list(store.records())}"
+            assert store.write_amplification > 1, f"Unexpected write amplification: {store.write_amplification}"
+
+            store.close()
+
+            store = store_module.RecordStore(path, capacity=4)
+            assert [record[0] for record in store.records()] == [2.0, 3.0, 4.0, 5.0], \
+                f"Unexpected reloaded records: {list(store.records())}"
+
+            def write_and_crash(slot: int, records: memoryview) -> None:
+                """Write the records but crash before committing them"""
+                offset: int = store_module.HEADER_SIZE + slot * store_module.RECORD_SIZE
+                store._map[offset:offset + len(records)] = records
+                raise OSError("crash")
+
+            with patch.object(store, "_write_records", side_effect=write_and_crash):
+                with self.assertRaises(OSError):
+                    store.append(pack([(6.0, 60.0, 1)]))
+            store.close()
+
+            store = store_module.RecordStore(path, capacity=4)
+            assert [record[0] for record in store.records()] == [3.0, 4.0, 5.0], \
+                f"Uncommitted records must not be visible: {list(store.records())}"
+            store.close()
+
+            store = store_module.RecordStore(path, capacity=8)
+            assert list(store.records()) == [], "Incompatible stores must be discarded"
+            store.close()
+
+    async def test_timing(self):
+        """
+        This method tests the latency histograms and the timed functions,
+        which must not record anything while disabled
+        """
+        timing = context.app.infrastructure.timing
+
+        histogram = timing.Histogram()
+        for latency in range(1, 101):
+            histogram.record(latency / 1000)
+        summary: dict[str, float] = histogram.as_dict()
+        assert summary["count"] == 100 and summary["max_ms"] == 100, f"Unexpected summary: {summary}"
+        for percentile in timing.PERCENTILES:
+            estimate: float = summary[f"p{percentile}_ms"]
+            assert percentile <= estimate <= percentile * 1.2, f"Unexpected p{percentile}: {estimate}"
+
+        @timing.timed("test.sleep")
+        async def sleep() -> str:
+            return "done"
+
+        enabled: bool = timing.enabled()
+        try:
+            timing.set_enabled(False)
+            assert await sleep() == "done", "Timed functions must return their result"
+            assert "test.sleep" not in timing.summary(), "Disabled timings must not be recorded"
+
+            timing.set_enabled(True)
+            await sleep()
+            assert timing.summary()["test.sleep"]["count"] == 1, f"Unexpected timings: {timing.summary()}"
+        finally:
+            timing.set_enabled(enabled)
+            timing.reset()
+
+        meter = timing.CPUMeter(window=0.05, min_span=0.03)
+        assert meter.per_minute() == -1, "Unmarked meters must report -1"
+        meter.mark()
+        assert meter.per_minute() == -1, "Spans below the minimum must report -1"
+        for _ in range(5):
+            meter.mark()
+            busy_until: float = time.monotonic() + 0.02
+            while time.monotonic() < busy_until:
+                pass
+        assert len(meter._marks) <= 4, f"Marks beyond the window must be discarded: {len(meter._marks)}"
+        assert 0 < meter.per_minute() <= 61 * (os.cpu_count() or 1), f"Unexpected CPU time: {meter.per_minute()}"
+
+    async def test_profiler(self):
+        """
+        This method tests the sampling profiler separates the collectors from
+        the event loop, takes one profile at a time and requires the token
+        """
+        profiler = context.app.infrastructure.profiler
+
+        assert profiler.categorize(["asyncio.run", "app.domain.cpu.read_cpu_info", "json.dumps"]) == \
+            profiler.CATEGORY_COLLECTOR, "Domain readers must be collectors"
+        assert profiler.categorize(["asyncio.run", "selectors.EpollSelector.select"]) == \
+            profiler.CATEGORY_IDLE, "Waiting for events must be idle"
+        assert profiler.categorize(["asyncio.run", "app.main.cpu_avg"]) == \
+            profiler.CATEGORY_EVENT_LOOP, "Anything else must be event loop"
+        assert profiler.categorize(["uvicorn.main.run", "uvicorn.server.Server.run"]) == \
+            profiler.CATEGORY_IDLE, "C loops waiting for events must be idle"
+
+        async def busy() -> None:
+            """Block the event loop for a while once the profile started"""
+            await asyncio.sleep(0.05)
+            blocked_until: float = time.monotonic() + 0.2
+            while time.monotonic() < blocked_until:
+                sum(range(1000))
+
+        busy_task: asyncio.Task = asyncio.create_task(busy())
+        try:
+            result, concurrent = await asyncio.gather(profiler.profile(0.3, 200),
+                                                      profiler.profile(0.3, 200),
+                                                      return_exceptions=True)
+        finally:
+            busy_task.cancel()
+
+        assert isinstance(concurrent, RuntimeError), "Only one profile can be taken at a time"
+        assert result.samples > 0 and sum(result.categories.values()) == result.samples, \
+            f"Unexpected samples: {result.samples}, {result.categories}"
+        assert any(stack.startswith("event_loop;") and "busy" in stack for stack in result.stacks), \
+            f"Busy coroutine not found: {list(result.stacks)[:3]}"
+        assert result.collapsed().endswith("\n"), "Collapsed stacks must be one per line"
+
+        # uvloop waits for events in C, without any selectors frame
+        uvloop_started: threading.Event = threading.Event()
+        uvloop_stop: threading.Event = threading.Event()
+
+        async def wait_stop() -> None:
+            uvloop_started.set()
+            while not uvloop_stop.is_set():
+                await asyncio.sleep(0.01)
+
+        uvloop_thread: threading.Thread = threading.Thread(target=uvloop.run, args=(wait_stop(),))
+        uvloop_thread.start()
+        try:
+            uvloop_started.wait(5)
+            idle_result = await profiler.profile(0.2, 200, thread_id=uvloop_thread.ident)
+        finally:
+            uvloop_stop.set()
+            uvloop_thread.join()
+
+        assert idle_result.categories[profiler.CATEGORY_IDLE] > idle_result.samples * 0.8, \
+            f"Waiting uvloop must be idle: {idle_result.categories}"
+
+        assert profiler.is_authorized("Bearer s3cret", "s3cret"), "Valid token must be authorized"
+        assert not profiler.is_authorized("Bearer wrong", "s3cret"), "Invalid token must be refused"
+        assert not profiler.is_authorized("Bearer ", ""), "Profiling must be disabled without token"
+
+    def test_spool(self):
+        """
+        This method tests the spool keeps the batches in order under its
+        size ceiling, reopens them and moves unreadable ones aside
+        """
+        spool_module = context.app.infrastructure.spool
+
+        with tempfile.TemporaryDirectory() as spool_dir:
+            spool = spool_module.Spool(spool_dir, max_bytes=10)
+            assert spool.push(b"first", 1) and spool.push(b"other", 2), "Batches must fit"
+            assert not spool.push(b"x", 1), "Batches beyond the ceiling must be refused"
+
+            spool = spool_module.open_spool(spool_dir, max_bytes=10)
+            assert len(spool) == 2 and spool.bytes == 10, f"Unexpected reopened spool: {len(spool)}"
+            name, batch, lines = spool.peek()
+            assert (batch, lines) == (b"first", 1), f"Unexpected oldest batch: {batch}"
+
+            spool.remove(name)
+            assert spool.push(b"third", 3), "Removed batches must free space"
+            assert spool.peek()[1:] == (b"other", 2), f"Unexpected order: {spool.peek()}"
+
+            assert spool.quarantine() == 2 and spool.bytes == 5, "Quarantined batches must be forgotten"
+            assert spool.peek()[1:] == (b"third", 3), f"Unexpected order: {spool.peek()}"
+            assert len(spool_module.open_spool(spool_dir, max_bytes=10)) == 1, \
+                "Quarantined batches must not be reopened"
+
+    async def test_fixture_replay(self):
+        """
+        This method tests recorded snapshots are read instead of the live
+        system while replaying, stepping through them and starting over
+        """
+        fixtures = context.app.infrastructure.fixtures
+        files = context.app.infrastructure.files
+
+        with tempfile.TemporaryDirectory() as fixture_dir:
+            assert fixtures.record(fixture_dir, count=2, interval=0) == 2, "Unexpected snapshot count"
+            snapshots: list[str] = fixtures.list_snapshots(fixture_dir)
+            for index, snapshot in enumerate(snapshots):
+                with open(os.path.join(snapshot, "proc/loadavg"), "w") as loadavg:
+                    loadavg.write(f"{index}.50 0.60 0.62 1/156 27996\n")
+
+            replay = fixtures.open_replay(fixture_dir)
+            assert len(replay.delays) == 2 and all(0 < delay < 1 for delay in replay.delays), \
+                f"Delays must follow the recorded timestamps: {replay.delays}"
+            try:
+                load = await files.get_cpu_load_avg()
+                assert load["1m"] == "0.50", f"Unexpected first snapshot load: {load}"
+                disks = await files.get_disk_usage()
+                assert "/" in [disk["mount"] for disk in disks.values()], \
+                    f"Recorded statvfs must be replayed: {disks}"
+
+                replay.step()
+                load = await files.get_cpu_load_avg()
+                assert load["1m"] == "1.50", f"Unexpected second snapshot load: {load}"
+
+                assert replay.step() == snapshots[0], "Replay must start over"
+            finally:
+                replay.close()
+
+            assert fixtures.open_replay(os.path.join(fixture_dir, "missing")) is None, \
+                "Missing fixtures must not be replayed"
+
+            # A mounted host filesystem has no recorded statvfs
+            os.remove(os.path.join(snapshots[0], files.STATVFS_FILENAME))
+            files.set_fs_root(snapshots[0])
+            try:
+                disks = await files.get_disk_usage()
+                assert "/" in [disk["mount"] for disk in disks.values()], \
+                    f"Mount points must be stat under the root: {disks}"
+            finally:
+                files.set_fs_root(files.FS_ROOT)
+
     async def test_os_allowed_cmds(self):
         """
         This method tests the allowed commands
@@ -164,7 +495,7 @@ CmaFree:           15444 kB"""
                 context.app.infrastructure.cmd._is_command_allowed(tc['command']) == \
                 tc['allowed'], "Unexpected permissions for test case"
 
-    def test_get_disk_usage(self):
+    async def test_get_disk_usage(self):
         """
         This method tests the get disk usage function
         """
@@ -172,7 +503,7 @@ CmaFree:           15444 kB"""
             "/"
         ]
         
-        get_disk_data: dict[str, int] = context.app.infrastructure.cmd.get_disk_usage()
+        get_disk_data: dict[str, int] = await context.app.infrastructure.cmd.get_disk_usage()
 
         for partition in expected_partitions:
             assert partition in [dev_data['mount'] for dev, dev_data in get_disk_data.items()], \
@@ -180,6 +511,67 @@ CmaFree:           15444 kB"""
 
         logging.debug("Disk info: \n%s", json.dumps(get_disk_data, indent=4))
 
+    @patch('context.app.infrastructure.cmd.ALLOWED_OS_COMMANDS', ['echo', 'sleep'])
+    async def test_exec_cmd(self):
+        """
+        This method tests the command execution without shell and its timeout
+        """
+        output = await context.app.infrastructure.cmd.exec_cmd(["echo", "$HOME;", "`ls`"])
+        assert output == "$HOME; `ls`\n", f"Command must not be run by a shell: {output}"
+
+        output = await context.app.infrastructure.cmd.exec_cmd("ls -l")
+        assert output is None, "Not allowed commands must not be executed"
+
+        output = await context.app.infrastructure.cmd.exec_cmd(["sleep", "5"], timeout=0.1)
+        assert output is None, "Timed out commands must not return output"
+
+    async def test_get_native_disk_usage(self):
+        """
+        This method tests the get disk usage function based on the mount
+        table and statvfs, which must match the df based one
+        """
+        native_disk_data: dict[str, dict] = await context.app.infrastructure.files.get_disk_usage()
+        df_disk_data: dict[str, dict] = await context.app.infrastructure.cmd.get_disk_usage()
+
+        assert "/" in [dev_data['mount'] for dev_data in native_disk_data.values()], \
+            "Partition / not found in disk data"
+
+        for dev, dev_data in native_disk_data.items():
+            assert dev_data['fs_type'], f"Device {dev} does not have fs type"
+            if dev in df_disk_data and dev_data['mount'] == df_disk_data[dev]['mount']:
+                assert dev_data['total'] == df_disk_data[dev]['total'], \
+                    f"Unexpected total for {dev}: {dev_data['total']}"
+
+    def test_proc_mount_string(self):
+        """
+        This method tests the /proc/self/mountinfo line parsing
+        """
+        test_lines: dict[bytes, tuple[str, str, str]] = {
+            b"29 1 179:2 / / rw,noatime shared:1 - ext4 /dev/root rw": \
+                ("/dev/root", "/", "ext4"),
+            b"30 29 179:1 / /boot rw,relatime shared:2 master:1 - vfat /dev/mmcblk0p1 rw": \
+                ("/dev/mmcblk0p1", "/boot", "vfat"),
+            b"31 29 8:1 / /mnt/usb\\040disk rw - exfat /dev/sda1 rw": \
+                ("/dev/sda1", "/mnt/usb disk", "exfat"),
+            b"broken line": None
+        }
+
+        for line, expected in test_lines.items():
+            mount = context.app.infrastructure.files._proc_mount_string(line)
+            assert mount == expected, f"Unexpected mount for {line}: {mount}"
+
+    def test_proc_wireless_string(self):
+        """
+        This method tests the /proc/net/wireless line parsing
+        """
+        line: bytes = b" wlan0: 0000   70.  -40.  -256        0      0      0    317      0        0"
+
+        iface, iface_data = context.app.infrastructure.files._proc_wireless_string(line)
+
+        assert iface == "wlan0", f"Unexpected interface: {iface}"
+        assert iface_data["link_quality"] == 70, f"Unexpected link quality: {iface_data}"
+        assert iface_data["signal_level"] == -40, f"Unexpected signal level: {iface_data}"
+
     async def test_read_net_info(self):
         """
         This method tests the read net info function
@@ -198,7 +590,7 @@ CmaFree:           15444 kB"""
         logging.debug("Net info: \n%s", json.dumps(net_info, indent=4))
 
     @patch('context.app.infrastructure.cmd.exec_cmd')
-    def test_get_net_info(self, exec_cmd_mock):
+    async def test_get_net_info(self, exec_cmd_mock):
         """
         This method tests the get net info function
         """
@@ -216,5 +608,5 @@ Tx excessive retries:317  Invalid misc:0   Missed beacon:0"""
         for iface, data in test_ifaces.items():
             exec_cmd_mock.return_value = data
 
-            net_info: dict[str, int] = context.app.infrastructure.cmd.get_net_info(iface)
+            net_info: dict[str, int] = await context.app.infrastructure.cmd.get_net_info(iface)
             assert "bit_rate" in net_info, f"Interface {iface} does not have bit rate"